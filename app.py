@@ -1,11 +1,152 @@
 import streamlit as st
 import tempfile
+import hashlib
 import json
+import os
+import threading
+import time
+from collections import OrderedDict
 
 # Import functions from your separate modules.
-from text_extraction import extract_text_with_gemma3
-from text_translate import translate_english_to_spanish, translate_spanish_to_english
+from text_extraction import extract_text_with_gemma3_stream
+from text_translate import translate_english_to_spanish_stream, translate_spanish_to_english_stream
 from text_analysis import run_workflow  # This function implements the LangGraph workflow
+from text_stats import analyze_text
+from model_manager import warm_up_async
+from job_queue import get_job_service
+from llm_call import get_client
+
+# -------------------------------
+# Helper: Queued Jobs With Progressive Rendering
+# -------------------------------
+POLL_INTERVAL = 0.25
+
+def run_job(kind: str, job_id: str, label: str = None, height: int = 200) -> dict:
+    """
+    Poll a queued job until it finishes, showing the queue position while waiting and, for
+    streaming jobs, the text produced so far. Finished text is shown in a text area when
+    `label` is given. Returns the job's final snapshot.
+    """
+    service = get_job_service()
+    placeholder = st.empty()
+    while True:
+        job = service.get(job_id)
+        if job["state"] in ("done", "failed"):
+            break
+        if job["state"] == "queued":
+            placeholder.info(f"Queued behind {service.queue_position(job_id)} job(s) "
+                             f"for {job['wait_seconds']:.0f}s...")
+        elif job["partial"]:
+            placeholder.text(job["partial"])
+        time.sleep(POLL_INTERVAL)
+    if job["state"] == "failed":
+        placeholder.error(f"{kind} failed: {job['error']}")
+    elif label:
+        placeholder.text_area(label, job["result"], height=height)
+    else:
+        placeholder.empty()
+    return job
+
+# -------------------------------
+# Helper: Memoization Across Streamlit Reruns
+# Streamlit re-executes this script on every widget interaction, interrupting whatever the
+# previous run was polling. Each stage is keyed on the content it depends on (starting from
+# the uploaded image's hash); its queued job is recorded under that key before polling, so
+# a rerun reattaches to it, and its result is reused from the session, or from a cache
+# shared by all sessions in this process.
+# -------------------------------
+SHARED_RESULT_LIMIT = 256
+
+@st.cache_resource
+def shared_results():
+    return {"lock": threading.Lock(), "items": OrderedDict(), "jobs": {}}
+
+@st.cache_resource
+def init_backend():
+    # Created once per process and shared by every session.
+    warm_up_async()
+    return get_client(), get_job_service()
+
+def content_key(*parts) -> str:
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+def stage_started(stage: str, key: str) -> bool:
+    """Whether this stage has a result or a job in flight for `key`."""
+    cache_key = f"{stage}:{key}"
+    shared = shared_results()
+    with shared["lock"]:
+        return (cache_key in st.session_state.get("stage_results", {}) or cache_key in shared["items"]
+                or cache_key in shared["jobs"])
+
+def memoized(stage: str, key: str, submit, label: str = None, height: int = 200):
+    """
+    Return (result, stats, computed_now). `submit(stats)` queues the job computing the stage
+    and returns its id; it is only called when there is neither a result nor a job in flight
+    for this key. `stats` is the dict the job fills in (empty for a reused result).
+    """
+    cache_key = f"{stage}:{key}"
+    session_results = st.session_state.setdefault("stage_results", {})
+    if cache_key in session_results:
+        return session_results[cache_key], {}, False
+    shared = shared_results()
+    service = get_job_service()
+    with shared["lock"]:
+        if cache_key in shared["items"]:
+            shared["items"].move_to_end(cache_key)
+            session_results[cache_key] = shared["items"][cache_key]
+            return session_results[cache_key], {}, False
+        pending = shared["jobs"].get(cache_key)
+        if pending is not None:
+            try:
+                service.get(pending["id"])
+            except KeyError:
+                # Finished long ago and pruned without anyone collecting the result.
+                pending = None
+        if pending is None:
+            stats = {}
+            pending = shared["jobs"][cache_key] = {"id": submit(stats), "stats": stats}
+    job = run_job(stage, pending["id"], label=label, height=height)
+    with shared["lock"]:
+        shared["jobs"].pop(cache_key, None)
+        if job["state"] == "done":
+            shared["items"][cache_key] = job["result"]
+            while len(shared["items"]) > SHARED_RESULT_LIMIT:
+                shared["items"].popitem(last=False)
+    if job["state"] == "failed":
+        # Dropped above, so the next rerun queues the stage again.
+        st.stop()
+    session_results[cache_key] = job["result"]
+    return job["result"], pending["stats"], True
+
+def _extract_temp_file(path: str, stats: dict):
+    # Runs inside the job, which owns the temp file: it is removed once extraction ends,
+    # however the Streamlit run that queued it went.
+    try:
+        yield from extract_text_with_gemma3_stream(path, stats)
+    finally:
+        os.remove(path)
+
+def submit_extraction(image_bytes: bytes, suffix: str, stats: dict) -> str:
+    # The vision model reads from a file path.
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
+        tmp_file.write(image_bytes)
+    return get_job_service().submit("extraction", _extract_temp_file, tmp_file.name, stats, stream=True)
+
+def show_stage_result(label: str, text: str, computed: bool, stats: dict, height: int = 200):
+    # Freshly computed results were already rendered while streaming.
+    if computed:
+        show_stream_stats(stats)
+    else:
+        st.text_area(label, text, height=height)
+        st.caption("Reused from an earlier run; no LLM calls made.")
+
+def show_stream_stats(stats: dict):
+    if "ttft" in stats:
+        st.caption(f"First token after {stats['ttft']:.2f}s, finished in {stats['total_time']:.2f}s")
+    if stats.get("segments"):
+        st.caption(f"Translation memory covered {stats['coverage']:.0%} of sentences "
+                   f"({stats['exact']} reused, {stats['translated']} newly translated, "
+                   f"{stats['fuzzy']} of them with a near match as reference)")
 
 # -------------------------------
 # Streamlit App Setup
@@ -17,6 +158,10 @@ st.markdown(
     "based on LangGraph, and handles translation. Sensitive student documents remain local."
 )
 
+# Create the LLM client and job service once per process, and load and pin the
+# configured models in the background so the first request is fast.
+init_backend()
+
 # -------------------------------
 # Sidebar: Student Metadata and Language Selection
 # -------------------------------
@@ -29,32 +174,46 @@ student_age = st.sidebar.number_input("Age", min_value=5, max_value=30, value=15
 st.sidebar.header("Original Text Language")
 original_language = st.sidebar.radio("Select language", options=["English", "Spanish"])
 
+st.sidebar.header("Job Queue")
+queue_stats = get_job_service().stats()
+st.sidebar.caption(
+    f"Queued: {queue_stats['queue_depth']['interactive']} interactive, {queue_stats['queue_depth']['batch']} batch · "
+    f"running: {queue_stats['running']} · LLM requests in flight: {queue_stats['llm']['in_flight']}/{queue_stats['llm']['capacity']} · "
+    f"mean wait: {queue_stats['mean_wait_seconds']:.1f}s"
+)
+
 # -------------------------------
 # Step 1: File Upload & Text Extraction
 # -------------------------------
 st.header("Step 1: Extract Text from Image")
-uploaded_file = st.file_uploader("Upload an image of student writing", type=["png", "jpg", "jpeg"])
+uploaded_file = st.file_uploader("Upload an image or PDF of student writing", type=["png", "jpg", "jpeg", "pdf"])
 
 if uploaded_file is not None:
-    # Save the uploaded file temporarily.
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp_file:
-        tmp_file.write(uploaded_file.getvalue())
-        tmp_file_path = tmp_file.name
+    image_bytes = uploaded_file.getvalue()
+    image_hash = hashlib.sha256(image_bytes).hexdigest()
+    suffix = os.path.splitext(uploaded_file.name)[1] or ".png"
 
-    st.image(uploaded_file, caption="Uploaded Image", use_column_width=True)
+    if suffix.lower() != ".pdf":
+        st.image(uploaded_file, caption="Uploaded Image", use_column_width=True)
     st.markdown("**Extracting text from image...**")
-    extracted_text = extract_text_with_gemma3(tmp_file_path)
     st.subheader("Extracted Text")
-    st.text_area("Extracted Text", extracted_text, height=200)
+    extracted_text, extraction_stats, computed = memoized(
+        "extraction", image_hash, lambda stats: submit_extraction(image_bytes, suffix, stats), label="Extracted Text")
+    show_stage_result("Extracted Text", extracted_text, computed, extraction_stats)
     
     # -------------------------------
     # Step 2: Translation (if needed) for Analysis
     # -------------------------------
     if original_language == "Spanish":
         st.markdown("**Translating Spanish text to English for analysis...**")
-        english_text = translate_spanish_to_english(extracted_text)
         st.subheader("Translated to English")
-        st.text_area("English Version", english_text, height=200)
+        english_text, translation_stats, computed = memoized(
+            "translation_es_en", image_hash,
+            lambda stats: get_job_service().submit("translation", translate_spanish_to_english_stream,
+                                                   extracted_text, stats, stream=True),
+            label="English Version",
+        )
+        show_stage_result("English Version", english_text, computed, translation_stats)
     else:
         english_text = extracted_text
 
@@ -63,21 +222,34 @@ if uploaded_file is not None:
     # -------------------------------
     st.header("Step 3: Run Analysis")
     title_input=""
+
+    # Computed locally in milliseconds, so teachers see these before any agent answers.
+    st.subheader("Text Statistics")
+    st.json(analyze_text(english_text), expanded=False)
     
-    if st.button("Run Analysis"):
-        # Build the ocr_json input for the LangGraph workflow.
-        ocr_json = {
-            "metadata": {
-                "name": student_name,
-                "school": student_school,
-                "DOB": student_dob,
-                "Age": student_age,
-            },
-            "Title": title_input,
-            "Story": english_text,
-        }
+    # Build the ocr_json input for the LangGraph workflow.
+    ocr_json = {
+        "metadata": {
+            "name": student_name,
+            "school": student_school,
+            "DOB": student_dob,
+            "Age": student_age,
+        },
+        "Title": title_input,
+        "Story": english_text,
+        # Identifies this piece of work across edits of its text, for the student history.
+        "submission_id": image_hash,
+    }
+    analysis_key = content_key(image_hash, original_language, ocr_json)
+    # Keep showing a finished report across reruns until the inputs change, and keep polling
+    # a running analysis, so clicking again never starts a second one on the same thread.
+    show_report = st.button("Run Analysis") or stage_started("analysis", analysis_key)
+    if show_report:
         st.markdown("**Running analysis workflow using LangGraph...**")
-        analysis_report = run_workflow(ocr_json, max_iterations=5, context_dir="context_storage")
+        analysis_report, _, _ = memoized(
+            "analysis", analysis_key,
+            lambda stats: get_job_service().submit("analysis", run_workflow, ocr_json, 5, "context_storage"),
+        )
         st.subheader("Analysis Report")
         st.json(analysis_report)
         
@@ -88,6 +260,11 @@ if uploaded_file is not None:
             # We assume the corrected text is available in analysis_report under "FinalEditedText"
             corrected_english = analysis_report.get("FinalEditedText", english_text)
             st.markdown("**Translating corrected text back to Spanish...**")
-            translated_spanish = translate_english_to_spanish(corrected_english)
             st.subheader("Final Corrected Text (Spanish)")
-            st.text_area("Corrected Spanish Text", translated_spanish, height=200)
+            translated_spanish, back_translation_stats, computed = memoized(
+                "translation_en_es", content_key(corrected_english),
+                lambda stats: get_job_service().submit("translation", translate_english_to_spanish_stream,
+                                                       corrected_english, stats, stream=True),
+                label="Corrected Spanish Text",
+            )
+            show_stage_result("Corrected Spanish Text", translated_spanish, computed, back_translation_stats)
@@ -0,0 +1,243 @@
+import argparse
+import hashlib
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+from llm_scheduler import priority
+from text_extraction import extract_text_with_gemma3
+from text_translate import translate_english_to_spanish, translate_spanish_to_english
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".pdf")
+
+# Marks the end of the input on a stage queue.
+_DONE = object()
+
+# -------------------------------
+# Stage Functions
+# Each stage takes the per-image record, fills in its own fields and returns it.
+# -------------------------------
+
+def _extract_stage(record: dict) -> dict:
+    record["extracted_text"] = extract_text_with_gemma3(record["image"])
+    return record
+
+def _translate_in_stage(record: dict) -> dict:
+    record["english_text"] = translate_spanish_to_english(record["extracted_text"])
+    return record
+
+def _analyze_stage(record: dict) -> dict:
+    # Imported here so the graph is only built once the pipeline actually runs.
+    from text_analysis import run_workflow
+    ocr_json = {
+        "metadata": record["metadata"],
+        "Title": record.get("title", ""),
+        "Story": record.get("english_text", record["extracted_text"]),
+        "submission_id": record["image_sha256"],
+    }
+    record["report"] = run_workflow(ocr_json, max_iterations=5, context_dir="context_storage")
+    return record
+
+def _translate_out_stage(record: dict) -> dict:
+    corrected = record["report"].get("FinalEditedText", record.get("english_text", ""))
+    record["translated_text"] = translate_english_to_spanish(corrected)
+    return record
+
+# -------------------------------
+# Helpers
+# -------------------------------
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def find_images(input_dir: str) -> list:
+    paths = []
+    for name in sorted(os.listdir(input_dir)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            paths.append(os.path.join(input_dir, name))
+    return paths
+
+def load_completed(output_path: str) -> set:
+    """Return the image hashes that already have a successful line in the report file."""
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                # A crash can leave a half-written last line; that image is simply redone.
+                continue
+            if not row.get("error"):
+                completed.add(row.get("image_sha256"))
+    return completed
+
+def load_metadata(image_path: str, defaults: dict) -> dict:
+    """Per-image metadata comes from an optional `<image>.json` sidecar, falling back to `defaults`."""
+    metadata = dict(defaults)
+    sidecar = os.path.splitext(image_path)[0] + ".json"
+    if os.path.exists(sidecar):
+        with open(sidecar, "r", encoding="utf-8") as f:
+            metadata.update(json.load(f))
+    return metadata
+
+# -------------------------------
+# Pipeline
+# -------------------------------
+
+class BatchPipeline:
+    """
+    Runs extraction -> (translation) -> analysis -> (back-translation) over a folder of scans.
+    Every stage has its own worker threads and a bounded queue in front of it, so an image can
+    be analysed while the next one is still being extracted. Results are appended to a JSONL
+    file one line per image, and images that already have a successful line are skipped.
+    """
+
+    def __init__(self, output_path: str, language: str = "English", back_translate: bool = True,
+                 workers: dict = None, queue_size: int = 4, default_metadata: dict = None, log=sys.stderr):
+        self.output_path = output_path
+        self.language = language
+        self.default_metadata = default_metadata or {}
+        self.log = log
+        workers = workers or {}
+
+        self.stages = [("extract", _extract_stage, workers.get("extract", 2))]
+        if language == "Spanish":
+            self.stages.append(("translate_in", _translate_in_stage, workers.get("translate", 2)))
+        self.stages.append(("analyze", _analyze_stage, workers.get("analyze", 2)))
+        if language == "Spanish" and back_translate:
+            self.stages.append(("translate_out", _translate_out_stage, workers.get("translate", 2)))
+        # One queue in front of every stage plus one in front of the writer.
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(len(self.stages) + 1)]
+
+        self.total = 0
+        self.done = 0
+        self.failed = 0
+        self.started = None
+
+    def _worker(self, func, inbox: queue.Queue, outbox: queue.Queue):
+        # Bulk work yields LLM slots to interactive requests from the app.
+        with priority("batch"):
+            self._work(func, inbox, outbox)
+
+    def _work(self, func, inbox: queue.Queue, outbox: queue.Queue):
+        while True:
+            record = inbox.get()
+            if record is _DONE:
+                return
+            # A record that already failed upstream passes through untouched.
+            if not record.get("error"):
+                try:
+                    record = func(record)
+                except Exception as e:
+                    record["error"] = f"{type(e).__name__}: {e}"
+            outbox.put(record)
+
+    def _writer(self, inbox: queue.Queue):
+        with open(self.output_path, "a", encoding="utf-8") as out:
+            while True:
+                record = inbox.get()
+                if record is _DONE:
+                    return
+                record["elapsed_seconds"] = round(time.perf_counter() - record.pop("_start"), 3)
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+                self.done += 1
+                if record.get("error"):
+                    self.failed += 1
+                self._report_progress(record)
+
+    def _report_progress(self, record: dict):
+        if self.log is None:
+            return
+        minutes = (time.perf_counter() - self.started) / 60
+        rate = self.done / minutes if minutes > 0 else 0.0
+        status = "FAILED " + record["error"] if record.get("error") else "ok"
+        print(f"[{self.done}/{self.total}] {os.path.basename(record['image'])}: {status} "
+              f"({rate:.1f} pages/min)", file=self.log, flush=True)
+
+    def run(self, image_paths: list) -> dict:
+        completed = load_completed(self.output_path)
+        pending = []
+        for path in image_paths:
+            digest = file_sha256(path)
+            if digest not in completed:
+                pending.append((path, digest))
+        skipped = len(image_paths) - len(pending)
+        self.total = len(pending)
+        self.started = time.perf_counter()
+
+        stage_threads = []
+        for index, (name, func, count) in enumerate(self.stages):
+            threads = [
+                threading.Thread(target=self._worker, args=(func, self.queues[index], self.queues[index + 1]),
+                                 name=f"{name}-{i}", daemon=True)
+                for i in range(max(1, count))
+            ]
+            for t in threads:
+                t.start()
+            stage_threads.append(threads)
+        writer = threading.Thread(target=self._writer, args=(self.queues[-1],), name="writer", daemon=True)
+        writer.start()
+
+        for path, digest in pending:
+            self.queues[0].put({
+                "image": path,
+                "image_sha256": digest,
+                "language": self.language,
+                "metadata": load_metadata(path, self.default_metadata),
+                "_start": time.perf_counter(),
+            })
+        # Shut stages down in order: once every worker of a stage has exited, nothing more
+        # can reach the next queue, so it is safe to close that one too.
+        for index, threads in enumerate(stage_threads):
+            for _ in threads:
+                self.queues[index].put(_DONE)
+            for t in threads:
+                t.join()
+        self.queues[-1].put(_DONE)
+        writer.join()
+
+        elapsed = time.perf_counter() - self.started
+        return {
+            "processed": self.done,
+            "failed": self.failed,
+            "skipped": skipped,
+            "elapsed_seconds": round(elapsed, 2),
+            "pages_per_minute": round(self.done / (elapsed / 60), 2) if elapsed > 0 else 0.0,
+        }
+
+# -------------------------------
+# Command Line Entry Point
+# -------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the extraction and analysis workflow over a folder of scans.")
+    parser.add_argument("input_dir", help="Folder containing .png/.jpg/.jpeg scans or PDFs")
+    parser.add_argument("--output", default="batch_report.jsonl", help="JSONL report file (appended to, resumable)")
+    parser.add_argument("--language", choices=["English", "Spanish"], default="English")
+    parser.add_argument("--no-back-translate", action="store_true", help="Skip translating corrected text back to Spanish")
+    parser.add_argument("--school", default="826 Valencia", help="Default school when an image has no metadata sidecar")
+    parser.add_argument("--extract-workers", type=int, default=2)
+    parser.add_argument("--translate-workers", type=int, default=2)
+    parser.add_argument("--analyze-workers", type=int, default=2)
+    parser.add_argument("--queue-size", type=int, default=4)
+    args = parser.parse_args()
+
+    pipeline = BatchPipeline(
+        args.output,
+        language=args.language,
+        back_translate=not args.no_back_translate,
+        workers={"extract": args.extract_workers, "translate": args.translate_workers, "analyze": args.analyze_workers},
+        queue_size=args.queue_size,
+        default_metadata={"school": args.school},
+    )
+    summary = pipeline.run(find_images(args.input_dir))
+    print(json.dumps(summary, indent=4))
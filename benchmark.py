@@ -0,0 +1,254 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fake_ollama import FakeOllamaServer
+
+# -------------------------------
+# Benchmark Harness
+# Runs the real pipeline against fake_ollama.py, so timings reflect our own code
+# (orchestration, concurrency, caching) on top of a fixed, known LLM cost.
+# -------------------------------
+
+SAMPLE_STORY = (
+    "Today I went to teh park and saw many interesting things. "
+    "I loved the bright colors and the funny sounds. My heart felt light and free.\n\n"
+    "Later my friend came and we played on the swings until the sun went down. "
+    "We laughed so hard that my stomach hurt."
+)
+
+# A longer story, several sentences per paragraph, as a whole class assignment might be.
+LONG_STORY = "\n\n".join([SAMPLE_STORY] * 4)
+
+# Long enough to be copyedited in paragraph chunks; the edit case changes one paragraph.
+CHUNKED_STORY = "\n\n".join(
+    f"On day {day} of the summer I went to teh {place} with my cousin. We brought sandwiches and "
+    f"a ball, and we stayed until the lights came on. Everything about the {place} felt new to me, "
+    f"even the parts I had seen a hundred times before. When we walked home we talked about it."
+    for day, place in enumerate(("park", "beach", "library", "museum", "market", "river"), start=1)
+)
+
+# Metrics where a larger value is better; every other metric is a latency.
+HIGHER_IS_BETTER = {"throughput_per_min", "cache_hit_rate", "concurrency_speedup", "translation_memory_coverage"}
+
+def _submission(index: int) -> dict:
+    # A distinct story per submission so neither the cache nor the checkpoints short-circuit it.
+    return {
+        "metadata": {"name": f"Student {index}", "school": "826 Valencia", "DOB": "2010-01-01", "Age": 14},
+        "Title": f"Benchmark Story {index}",
+        "Story": SAMPLE_STORY,
+    }
+
+def _latency_summary(samples: list) -> dict:
+    ordered = sorted(samples)
+    return {
+        "mean": round(statistics.mean(ordered), 4),
+        "p50": round(ordered[len(ordered) // 2], 4),
+        "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 4),
+    }
+
+def run_benchmarks(runs: int = 5, submissions: int = 12, concurrency_levels=(1, 2, 4),
+                   context_dir: str = "context_storage") -> dict:
+    """Run every scenario and return a flat dict of metric name -> value."""
+    # Imported here so OLLAMA_HOST and the storage paths set by main() are picked up.
+    import llm_cache
+    import translation_memory
+    import instrumentation
+    from text_analysis import evaluate_writing_metrics, get_workflow, run_workflow
+    from text_extraction import extract_text_with_gemma3
+    from text_translate import translate_spanish_to_english
+
+    cache = llm_cache.get_cache()
+    memory = translation_memory.get_translation_memory()
+    results = {}
+    counter = iter(range(10 ** 9))
+    # Compile the graph up front so its one-off cost is not charged to the first run.
+    get_workflow()
+
+    # Cold paths: no response cache, no translation memory.
+    cache.enabled = False
+    memory.enabled = False
+
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        run_workflow(_submission(next(counter)), context_dir=context_dir)
+        samples.append(time.perf_counter() - start)
+    for key, value in _latency_summary(samples).items():
+        results[f"workflow_latency_{key}"] = value
+
+    throughput = {}
+    for level in concurrency_levels:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=level) as executor:
+            list(executor.map(lambda i: run_workflow(_submission(i), context_dir=context_dir), [next(counter) for _ in range(submissions)]))
+        elapsed = time.perf_counter() - start
+        throughput[level] = submissions / (elapsed / 60)
+        results[f"throughput_per_min_c{level}"] = round(throughput[level], 2)
+    results["concurrency_speedup"] = round(throughput[max(concurrency_levels)] / throughput[min(concurrency_levels)], 3)
+
+    image_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_img.png")
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        extract_text_with_gemma3(image_path)
+        samples.append(time.perf_counter() - start)
+    results["extraction_latency_mean"] = _latency_summary(samples)["mean"]
+
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        translate_spanish_to_english(SAMPLE_STORY)
+        samples.append(time.perf_counter() - start)
+    results["translation_latency_mean"] = _latency_summary(samples)["mean"]
+
+    # The default configuration: translation memory on, but nothing in it yet.
+    memory.enabled = True
+    samples = []
+    for _ in range(runs):
+        memory.clear()
+        start = time.perf_counter()
+        translate_spanish_to_english(LONG_STORY)
+        samples.append(time.perf_counter() - start)
+    results["translation_default_latency_mean"] = _latency_summary(samples)["mean"]
+    memory.enabled = False
+
+    # Rubric scoring: six separate prompts against one fused prompt (WRITING_METRICS_MODE).
+    for mode in ("separate", "fused"):
+        samples, prompt_tokens, eval_tokens = [], 0, 0
+        for _ in range(runs):
+            with instrumentation.collect() as collector:
+                start = time.perf_counter()
+                evaluate_writing_metrics(SAMPLE_STORY, mode=mode)
+                samples.append(time.perf_counter() - start)
+            calls = collector.summary()["LLMCalls"]
+            prompt_tokens += sum(call.get("prompt_tokens", 0) for call in calls)
+            eval_tokens += sum(call.get("eval_tokens", 0) for call in calls)
+        results[f"rubric_{mode}_latency_mean"] = _latency_summary(samples)["mean"]
+        results[f"rubric_{mode}_prompt_tokens"] = round(prompt_tokens / runs, 1)
+        results[f"rubric_{mode}_eval_tokens"] = round(eval_tokens / runs, 1)
+
+    # Warm paths: the second pass over the same inputs should be served locally.
+    memory.enabled = True
+    memory.clear()
+    stats = {}
+    translate_spanish_to_english(SAMPLE_STORY, stats={})
+    start = time.perf_counter()
+    translate_spanish_to_english(SAMPLE_STORY, stats=stats)
+    results["translation_memory_latency"] = round(time.perf_counter() - start, 4)
+    results["translation_memory_coverage"] = stats.get("coverage", 0.0)
+
+    cache.enabled = True
+    cache.clear()
+    # Bypass the checkpoint shortcut so the repeat run really goes through the graph.
+    warm_submissions = [_submission(next(counter)) for _ in range(2)]
+    warm_submissions[1]["metadata"] = dict(warm_submissions[1]["metadata"], name=warm_submissions[0]["metadata"]["name"] + " ")
+    warm_submissions[1]["Title"] = warm_submissions[0]["Title"]
+    run_workflow(warm_submissions[0], context_dir=context_dir)
+    before = cache.stats()
+    start = time.perf_counter()
+    run_workflow(warm_submissions[1], context_dir=context_dir)
+    results["cached_workflow_latency"] = round(time.perf_counter() - start, 4)
+    after = cache.stats()
+    lookups = (after["hits"] - before["hits"]) + (after["misses"] - before["misses"])
+    results["cache_hit_rate"] = round((after["hits"] - before["hits"]) / lookups, 4) if lookups else 0.0
+
+    # A teacher edits one paragraph and re-runs: only that paragraph's chunk should reach the model.
+    draft = {**_submission(next(counter)), "Story": CHUNKED_STORY, "submission_id": "benchmark-edit"}
+    run_workflow(draft, context_dir=context_dir)
+    edited = dict(draft, Story=CHUNKED_STORY.replace("with my cousin", "with my best friend", 1))
+    with instrumentation.collect() as collector:
+        start = time.perf_counter()
+        run_workflow(edited, context_dir=context_dir)
+        results["edit_rerun_latency"] = round(time.perf_counter() - start, 4)
+    calls = collector.summary()["LLMCalls"]
+    results["edit_rerun_grammar_calls"] = sum(1 for call in calls if call.get("task") == "grammar" and call.get("cache") != "hit")
+
+    # Startup cost for the CLI and scripts; the graph itself is only built on first use.
+    results["analysis_import_seconds"] = measure_import_time("text_analysis")
+    return results
+
+def measure_import_time(module: str = "text_analysis", runs: int = 3) -> float:
+    """Best-of-`runs` seconds to import `module` in a fresh interpreter, as the CLI and scripts pay it."""
+    code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+    here = os.path.dirname(os.path.abspath(__file__))
+    samples = [
+        float(subprocess.run([sys.executable, "-c", code], cwd=here, capture_output=True, text=True, check=True).stdout)
+        for _ in range(runs)
+    ]
+    return round(min(samples), 4)
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Return a description of every metric that regressed by more than `tolerance` (a fraction)."""
+    regressions = []
+    for name, base in baseline.get("metrics", {}).items():
+        if name not in results or not base:
+            continue
+        current = results[name]
+        higher_better = any(name.startswith(prefix) for prefix in HIGHER_IS_BETTER)
+        change = (base - current) / base if higher_better else (current - base) / base
+        if change > tolerance:
+            regressions.append(f"{name}: {base} -> {current} ({change:+.0%} worse)")
+    return regressions
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the workflow against a deterministic fake Ollama server.")
+    parser.add_argument("--runs", type=int, default=5, help="Repetitions for latency measurements")
+    parser.add_argument("--submissions", type=int, default=12, help="Submissions per throughput measurement")
+    parser.add_argument("--latency", type=float, default=0.05, help="Fake server seconds per request")
+    parser.add_argument("--tokens-per-sec", type=float, default=400.0, help="Fake server generation speed")
+    parser.add_argument("--max-parallel", type=int, default=4, help="Requests the fake server serves at once")
+    parser.add_argument("--output", default="benchmark_results.json", help="Where to write this run's results")
+    parser.add_argument("--baseline", help="Baseline JSON to compare against; exits 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative slowdown before failing")
+    args = parser.parse_args(argv)
+
+    fake = FakeOllamaServer(latency=args.latency, tokens_per_sec=args.tokens_per_sec,
+                            max_parallel=args.max_parallel).start()
+    workdir = tempfile.mkdtemp(prefix="word-weavers-bench-")
+    # Must be set before the project modules are imported, since they read these at import time.
+    os.environ["OLLAMA_HOST"] = fake.url
+    os.environ["LLM_CACHE_PATH"] = os.path.join(workdir, "llm_cache.sqlite")
+    os.environ["TRANSLATION_MEMORY_PATH"] = os.path.join(workdir, "translation_memory.sqlite")
+    os.environ["WORKFLOW_CHECKPOINT_PATH"] = os.path.join(workdir, "checkpoints.sqlite")
+    os.environ["REPORT_STORE_PATH"] = os.path.join(workdir, "reports.sqlite")
+    try:
+        metrics = run_benchmarks(runs=args.runs, submissions=args.submissions,
+                                 context_dir=os.path.join(workdir, "context_storage"))
+    finally:
+        fake.stop()
+
+    results = {
+        "metrics": metrics,
+        "fake_server": {"latency": args.latency, "tokens_per_sec": args.tokens_per_sec,
+                        "max_parallel": args.max_parallel, "requests": fake.requests},
+        "python": platform.python_version(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=4)
+    print(json.dumps(metrics, indent=4))
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("fake_server", {}).get("latency") != args.latency:
+            print("Warning: baseline was recorded with different fake server settings.", file=sys.stderr)
+        regressions = compare(metrics, baseline, args.tolerance)
+        if regressions:
+            print("Performance regressions against " + args.baseline + ":", file=sys.stderr)
+            for line in regressions:
+                print("  " + line, file=sys.stderr)
+            return 1
+        print("No regressions against " + args.baseline)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
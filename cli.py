@@ -0,0 +1,126 @@
+import argparse
+import json
+import os
+import sys
+
+# Standard library only, unlike the workflow modules imported by each subcommand.
+from llm_call import LLMError
+
+# -------------------------------
+# Headless Command Line Interface
+# For scripts, cron jobs and tests: no Streamlit, and each subcommand imports only the
+# modules it needs, so `extract` and `translate` never load LangGraph.
+#
+#   python cli.py extract page1.png page2.png
+#   python cli.py translate story.txt --to Spanish
+#   cat story.txt | python cli.py analyze - --name "Jane Smith" --age 15
+#   python cli.py trends --window week --by school age_band --metric overall
+# -------------------------------
+
+def _read_text(path: str) -> str:
+    if path == "-":
+        return sys.stdin.read()
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+def _emit(result, indent: int):
+    json.dump(result, sys.stdout, indent=indent or None, ensure_ascii=False)
+    sys.stdout.write("\n")
+
+def cmd_extract(args) -> int:
+    from text_extraction import extract_text_with_gemma3
+
+    for path in args.images:
+        # The prompt only references the path, so a typo would otherwise go unnoticed.
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"No such image: {path}")
+    results = [{"file": path, "text": extract_text_with_gemma3(path, preprocess=not args.no_preprocess)}
+               for path in args.images]
+    _emit(results if len(results) > 1 else results[0], args.indent)
+    return 0
+
+def cmd_translate(args) -> int:
+    from text_translate import translate_english_to_spanish, translate_spanish_to_english
+
+    text = _read_text(args.input)
+    stats = {}
+    if args.to == "Spanish":
+        translated = translate_english_to_spanish(text, stats=stats)
+    else:
+        translated = translate_spanish_to_english(text, stats=stats)
+    _emit({"target_language": args.to, "text": translated, "stats": stats}, args.indent)
+    return 0
+
+def cmd_analyze(args) -> int:
+    from text_analysis import run_workflow
+
+    metadata = {}
+    if args.metadata:
+        with open(args.metadata, "r", encoding="utf-8") as f:
+            metadata = json.load(f)
+    for key, value in (("name", args.name), ("school", args.school), ("DOB", args.dob), ("Age", args.age)):
+        if value is not None:
+            metadata[key] = value
+    ocr_json = {"metadata": metadata, "Title": args.title, "Story": _read_text(args.input),
+                "submission_id": args.submission_id}
+    _emit(run_workflow(ocr_json, max_iterations=args.max_iterations, context_dir=args.context_dir), args.indent)
+    return 0
+
+def cmd_trends(args) -> int:
+    from report_store import get_report_store
+
+    rows = get_report_store().trends(window=args.window, by=args.by, metric=args.metric,
+                                     school=args.school, age_band=args.age_band, since=args.since)
+    _emit(rows, args.indent)
+    return 0
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Extract, translate and analyze student writing; prints JSON.")
+    parser.add_argument("--indent", type=int, default=2, help="JSON indentation (0 for one line)")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+
+    extract = subcommands.add_parser("extract", help="Extract text from one or more images or PDFs")
+    extract.add_argument("images", nargs="+", help="Image files (.png/.jpg/.jpeg) or PDFs")
+    extract.add_argument("--no-preprocess", action="store_true", help="Send the original file without tiling")
+    extract.set_defaults(func=cmd_extract)
+
+    translate = subcommands.add_parser("translate", help="Translate text between English and Spanish")
+    translate.add_argument("input", nargs="?", default="-", help="Text file, or - for stdin (default)")
+    translate.add_argument("--to", choices=["English", "Spanish"], required=True, help="Target language")
+    translate.set_defaults(func=cmd_translate)
+
+    analyze = subcommands.add_parser("analyze", help="Run the editing and feedback workflow on a story")
+    analyze.add_argument("input", nargs="?", default="-", help="Story text file, or - for stdin (default)")
+    analyze.add_argument("--title", default="")
+    analyze.add_argument("--metadata", help="JSON file with student metadata (name, school, DOB, Age)")
+    analyze.add_argument("--name")
+    analyze.add_argument("--school")
+    analyze.add_argument("--dob", help="YYYY-MM-DD")
+    analyze.add_argument("--age", type=int)
+    analyze.add_argument("--submission-id", help="Stable id of this piece of work (e.g. its image hash), so a "
+                         "re-analysis after edits is not treated as an earlier submission")
+    analyze.add_argument("--max-iterations", type=int, default=5)
+    analyze.add_argument("--context-dir", default="context_storage")
+    analyze.set_defaults(func=cmd_analyze)
+
+    trends = subcommands.add_parser("trends", help="Score trends from stored reports")
+    trends.add_argument("--window", choices=["day", "week", "month", "all"], default="month")
+    trends.add_argument("--by", nargs="*", choices=["school", "age_band"], default=["school"],
+                        help="Columns to group by besides the period")
+    trends.add_argument("--metric", help="e.g. grammar, overall, conventions (default: all)")
+    trends.add_argument("--school")
+    trends.add_argument("--age-band")
+    trends.add_argument("--since", help="Earliest period start, YYYY-MM-DD")
+    trends.set_defaults(func=cmd_trends)
+    return parser
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    try:
+        return args.func(args)
+    except (OSError, LLMError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 2
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+import argparse
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# -------------------------------
+# Canned Responses
+# A deterministic stand-in for a local Ollama server, used by benchmark.py.
+# Structured requests get a schema-valid JSON object; plain prompts get stable text.
+# -------------------------------
+
+# Prompt sections the real agents put their text under; echoed back for text fields.
+TEXT_SECTIONS = {
+    "edited_text": "Student Writing:\n",
+    "final_text": "Edited Text:\n",
+}
+
+def _section(prompt: str, marker: str) -> str:
+    return prompt.split(marker, 1)[-1].strip() if marker in prompt else ""
+
+def _value_for(field: str, spec: dict, prompt: str):
+    kind = spec.get("type")
+    if field in TEXT_SECTIONS and kind == "string":
+        # Mimic a light copyedit so the voice loop sees realistic text.
+        return _section(prompt, TEXT_SECTIONS[field]).replace(" teh ", " the ")
+    if kind == "string":
+        return f"Canned {field.replace('_', ' ')}."
+    if kind in ("number", "integer"):
+        low = spec.get("minimum", 0)
+        high = spec.get("maximum", 100)
+        value = low + (high - low) * 0.75
+        return int(round(value)) if kind == "integer" else round(value, 1)
+    if kind == "boolean":
+        return True
+    if kind == "array":
+        items = spec.get("items")
+        return [_value_for(field, items, prompt)] if items else []
+    if kind == "object":
+        return {name: _value_for(name, sub, prompt) for name, sub in spec.get("properties", {}).items()}
+    return None
+
+def canned_response(payload: dict) -> str:
+    schema = payload.get("format")
+    prompt = payload.get("prompt", "")
+    if isinstance(schema, dict):
+        return json.dumps(_value_for("root", schema, prompt))
+    if schema == "json":
+        return json.dumps({"response": "Canned."})
+    if "Translate the following text" in prompt:
+        # Deterministic pseudo-translation of the same length as the source.
+        return prompt.split("without any initial or trailing text:", 1)[-1].strip()[::-1]
+    if payload.get("images"):
+        digest = hashlib.sha256("".join(payload["images"]).encode("ascii")).hexdigest()[:8]
+        return f"Extracted text {digest}. Today I went to teh park and saw many interesting things."
+    return "Canned response."
+
+# -------------------------------
+# Server
+# -------------------------------
+class FakeOllamaServer:
+    """
+    Threaded HTTP server implementing the parts of /api/generate the app uses.
+    Each request takes `latency` seconds plus generated_tokens / `tokens_per_sec`, and at
+    most `max_parallel` requests are served at once, like a real single-GPU host.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.05,
+                 tokens_per_sec: float = 400.0, max_parallel: int = 4):
+        self.latency = latency
+        self.tokens_per_sec = tokens_per_sec
+        self.slots = threading.BoundedSemaphore(max_parallel)
+        self.requests = 0
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, status: int, body: dict):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                if self.path != "/api/generate":
+                    self._send_json(200, {})
+                    return
+                with server._lock:
+                    server.requests += 1
+                text = canned_response(payload)
+                prompt_tokens = max(1, len(payload.get("prompt", "")) // 4)
+                eval_tokens = max(1, len(text) // 4)
+                generation = eval_tokens / server.tokens_per_sec
+                with server.slots:
+                    time.sleep(server.latency)
+                    if payload.get("stream"):
+                        self._stream(text, prompt_tokens, eval_tokens, generation)
+                    else:
+                        time.sleep(generation)
+                        self._send_json(200, {
+                            "model": payload.get("model"),
+                            "response": text,
+                            "done": True,
+                            "prompt_eval_count": prompt_tokens,
+                            "eval_count": eval_tokens,
+                            "eval_duration": int(generation * 1e9),
+                            "total_duration": int((server.latency + generation) * 1e9),
+                        })
+
+            def _stream(self, text: str, prompt_tokens: int, eval_tokens: int, generation: float):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                words = text.split(" ")
+                pause = generation / max(1, len(words))
+
+                def chunk(body: dict):
+                    line = json.dumps(body).encode("utf-8") + b"\n"
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+                    self.wfile.flush()
+
+                for i, word in enumerate(words):
+                    time.sleep(pause)
+                    chunk({"response": word if i == 0 else " " + word, "done": False})
+                chunk({"response": "", "done": True, "prompt_eval_count": prompt_tokens,
+                       "eval_count": eval_tokens, "eval_duration": int(generation * 1e9)})
+                self.wfile.write(b"0\r\n\r\n")
+
+        return Handler
+
+    def start(self) -> "FakeOllamaServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deterministic stand-in for a local Ollama server.")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--latency", type=float, default=0.05, help="Fixed seconds added to every request")
+    parser.add_argument("--tokens-per-sec", type=float, default=400.0)
+    parser.add_argument("--max-parallel", type=int, default=4)
+    args = parser.parse_args()
+    fake = FakeOllamaServer(port=args.port, latency=args.latency, tokens_per_sec=args.tokens_per_sec,
+                            max_parallel=args.max_parallel)
+    print(f"Fake Ollama listening on {fake.url}")
+    fake.httpd.serve_forever()
@@ -0,0 +1,167 @@
+import difflib
+import os
+import re
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it images are sent to the model unchanged.
+    Image = None
+    ImageOps = None
+
+# -------------------------------
+# Configuration
+# The vision model sees each image at a fixed square resolution (896x896 for Gemma 3), so
+# anything larger only costs encoding time, and a page much taller than that square
+# loses detail. Pages are therefore scaled to the model's width, and only long ones are
+# cut into overlapping, roughly square tiles.
+# -------------------------------
+TILE_SIZE = int(os.environ.get("EXTRACTION_TILE_SIZE", "896"))
+# Fraction of each tile repeated at the top of the next one, so no line is only ever cut.
+TILE_OVERLAP = float(os.environ.get("EXTRACTION_TILE_OVERLAP", "0.15"))
+# A page up to this much taller than it is wide stays a single tile. Standard portrait
+# pages (4:3 photos 1.33, Letter 1.29, A4 1.41) fit: halving the vision calls is worth
+# more than the resolution the model's square input costs them.
+SINGLE_TILE_MAX_ASPECT = 1.5
+# Resolution PDF pages are rendered at before scaling.
+PDF_RENDER_DPI = 150
+# Percentage of the darkest and lightest pixels clipped by the contrast stretch.
+CONTRAST_CUTOFF = 1
+
+PDF_EXTENSIONS = (".pdf",)
+
+def available() -> bool:
+    return Image is not None
+
+# -------------------------------
+# Loading
+# -------------------------------
+def _render_pdf(path: str) -> list:
+    try:
+        import pypdfium2 as pdfium
+    except ImportError as e:
+        raise ValueError(f"Reading PDF files needs the pypdfium2 package: {path}") from e
+    document = pdfium.PdfDocument(path)
+    try:
+        return [document[i].render(scale=PDF_RENDER_DPI / 72).to_pil() for i in range(len(document))]
+    finally:
+        document.close()
+
+def load_pages(path: str) -> list:
+    """Return the pages of an image or PDF file as PIL images, upright per their EXIF orientation."""
+    if path.lower().endswith(PDF_EXTENSIONS):
+        return _render_pdf(path)
+    with Image.open(path) as image:
+        image.load()
+        return [ImageOps.exif_transpose(image)]
+
+# -------------------------------
+# Normalization and Tiling
+# -------------------------------
+def normalize(image):
+    """Grayscale with a contrast stretch, scaled down (never up) to the tile width."""
+    if image.mode in ("RGBA", "LA", "P"):
+        # Flatten transparency onto white, as on paper, rather than onto black.
+        background = Image.new("RGB", image.size, "white")
+        rgba = image.convert("RGBA")
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        image = background
+    image = ImageOps.autocontrast(image.convert("L"), cutoff=CONTRAST_CUTOFF)
+    if image.width > TILE_SIZE:
+        height = max(1, round(image.height * TILE_SIZE / image.width))
+        image = image.resize((TILE_SIZE, height), Image.LANCZOS)
+    return image
+
+def tile_boxes(width: int, height: int, overlap: float = TILE_OVERLAP) -> list:
+    """Crop boxes, top to bottom, covering a page with tiles about as tall as they are wide."""
+    tile_height = width
+    step = max(1, int(tile_height * (1 - overlap)))
+    boxes = []
+    top = 0
+    # The last tile may run up to SINGLE_TILE_MAX_ASPECT tall rather than leave a thin strip.
+    while height - top > tile_height * SINGLE_TILE_MAX_ASPECT:
+        boxes.append((0, top, width, top + tile_height))
+        top += step
+    boxes.append((0, top, width, height))
+    return boxes
+
+def prepare_tiles(path: str, output_dir: str) -> list:
+    """
+    Preprocess an image or PDF into PNG tiles under `output_dir`. Returns one list of tile
+    paths per page, in reading order. Without Pillow the original file is the only tile.
+    """
+    if not available():
+        if path.lower().endswith(PDF_EXTENSIONS):
+            raise ValueError(f"Reading PDF files needs Pillow and pypdfium2: {path}")
+        return [[path]]
+    pages = []
+    for page_number, page in enumerate(load_pages(path), start=1):
+        image = normalize(page)
+        tiles = []
+        for tile_number, box in enumerate(tile_boxes(image.width, image.height), start=1):
+            tile_path = os.path.join(output_dir, f"page{page_number:03d}_tile{tile_number:02d}.png")
+            # Fast, light compression: the tiles only travel to the local model.
+            image.crop(box).save(tile_path, compress_level=1)
+            tiles.append(tile_path)
+        pages.append(tiles)
+    return pages
+
+# -------------------------------
+# Stitching
+# Neighbouring tiles share a band of text, so the end of one tile's transcript and the
+# start of the next usually repeat a line or two (the line cut by the tile edge may be
+# garbled in either). The longest common run of words between the two is kept once.
+# -------------------------------
+# Words compared at each end of a tile transcript.
+STITCH_WINDOW_WORDS = 80
+# Shorter common runs are treated as coincidence, not overlap.
+STITCH_MIN_WORDS = 3
+# The shared run must sit at the seam: at most this many words (a garbled cut line) may
+# follow it in the first tile or precede it in the second.
+STITCH_MAX_SLACK_WORDS = 15
+
+_TOKEN = re.compile(r"\S+\s*")
+_PUNCTUATION = re.compile(r"[^\w']+")
+
+def _word_key(token: str) -> str:
+    return _PUNCTUATION.sub("", token.lower())
+
+def stitch_pair(first: str, second: str) -> str:
+    first, second = first.rstrip(), second.strip()
+    if not first or not second:
+        return first or second
+    first_tokens, second_tokens = _TOKEN.findall(first), _TOKEN.findall(second)
+    tail_start = max(0, len(first_tokens) - STITCH_WINDOW_WORDS)
+    tail = [_word_key(t) for t in first_tokens[tail_start:]]
+    head = [_word_key(t) for t in second_tokens[:STITCH_WINDOW_WORDS]]
+    match = difflib.SequenceMatcher(None, tail, head, autojunk=False).find_longest_match(0, len(tail), 0, len(head))
+    at_seam = len(tail) - (match.a + match.size) <= STITCH_MAX_SLACK_WORDS and match.b <= STITCH_MAX_SLACK_WORDS
+    if match.size < STITCH_MIN_WORDS or not at_seam:
+        return first + "\n" + second
+    # Keep the first tile up to the end of the shared run and the second tile after it.
+    keep_first = first_tokens[:tail_start + match.a + match.size]
+    keep_second = second_tokens[match.b + match.size:]
+    joined = "".join(keep_first)
+    if keep_second:
+        if not joined[-1:].isspace():
+            joined += " "
+        joined += "".join(keep_second)
+    return joined.strip()
+
+def hold_back_tail(text: str) -> tuple:
+    """
+    Split `text` into (settled, tail): stitch_pair only ever matches or drops the last
+    STITCH_WINDOW_WORDS words of a tile, so everything before them can be shown already.
+    """
+    tokens = _TOKEN.findall(text)
+    if len(tokens) <= STITCH_WINDOW_WORDS:
+        return "", text
+    settled_tokens = tokens[:-STITCH_WINDOW_WORDS]
+    cut = text.find(settled_tokens[0]) + sum(len(token) for token in settled_tokens)
+    return text[:cut], text[cut:]
+
+def stitch(texts: list) -> str:
+    """Join the transcripts of one page's tiles in order, removing the overlapping text."""
+    result = ""
+    for text in texts:
+        result = stitch_pair(result, text) if result else (text or "").strip()
+    return result
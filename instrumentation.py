@@ -0,0 +1,173 @@
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# -------------------------------
+# Configuration
+# -------------------------------
+# When set, every run_workflow appends its records to this JSONL file...
+METRICS_JSONL_PATH = os.environ.get("WORKFLOW_METRICS_JSONL", "")
+# ...and rewrites this Prometheus text-format file with process-wide totals.
+METRICS_PROMETHEUS_PATH = os.environ.get("WORKFLOW_METRICS_PROMETHEUS", "")
+
+# Process-wide history is capped so a long-lived Streamlit server does not grow without bound.
+PROCESS_HISTORY = 10000
+
+# Name of the innermost active span (node or agent), e.g. "metrics/content_metrics_agent_llm".
+_current_span = contextvars.ContextVar("current_span", default=None)
+# Collectors that should receive records from the current context (per-run plus process-wide).
+_active_collectors = contextvars.ContextVar("active_collectors", default=())
+
+# -------------------------------
+# Collector
+# -------------------------------
+class MetricsCollector:
+    """Thread-safe store of LLM call and span (node/agent) timing records."""
+
+    def __init__(self, max_records: int = None):
+        self.llm_calls = deque(maxlen=max_records)
+        self.spans = deque(maxlen=max_records)
+        self._lock = threading.Lock()
+        # Totals for Prometheus export survive the history cap.
+        self.totals = {}
+
+    def _add_total(self, metric: str, labels: tuple, value: float):
+        key = (metric, labels)
+        self.totals[key] = self.totals.get(key, 0) + value
+
+    def record_llm_call(self, record: dict):
+        with self._lock:
+            self.llm_calls.append(record)
+            labels = (("node", record.get("node") or "none"), ("cache", record.get("cache", "miss")))
+            self._add_total("llm_calls_total", labels, 1)
+            self._add_total("llm_call_seconds_total", labels, record.get("wall_time", 0))
+            self._add_total("llm_prompt_tokens_total", labels, record.get("prompt_tokens", 0))
+            self._add_total("llm_eval_tokens_total", labels, record.get("eval_tokens", 0))
+            self._add_total("llm_retries_total", labels, record.get("retries", 0))
+            if record.get("error"):
+                self._add_total("llm_errors_total", labels, 1)
+
+    def record_span(self, record: dict):
+        with self._lock:
+            self.spans.append(record)
+            labels = (("node", record["name"]),)
+            self._add_total("node_runs_total", labels, 1)
+            self._add_total("node_seconds_total", labels, record["wall_time"])
+
+    def summary(self) -> dict:
+        """Aggregate the records into the `Timings` section of the analysis report."""
+        with self._lock:
+            spans = list(self.spans)
+            calls = list(self.llm_calls)
+        nodes = {}
+        for span in spans:
+            entry = nodes.setdefault(span["name"], {"runs": 0, "seconds": 0.0})
+            entry["runs"] += 1
+            entry["seconds"] = round(entry["seconds"] + span["wall_time"], 4)
+        llm_by_node = {}
+        for call in calls:
+            entry = llm_by_node.setdefault(call.get("node") or "none", {
+                "calls": 0, "seconds": 0.0, "prompt_tokens": 0, "eval_tokens": 0, "retries": 0, "cache_hits": 0,
+            })
+            entry["calls"] += 1
+            entry["seconds"] = round(entry["seconds"] + call.get("wall_time", 0), 4)
+            entry["prompt_tokens"] += call.get("prompt_tokens", 0)
+            entry["eval_tokens"] += call.get("eval_tokens", 0)
+            entry["retries"] += call.get("retries", 0)
+            entry["cache_hits"] += 1 if call.get("cache") == "hit" else 0
+        return {
+            "Nodes": nodes,
+            "LLMByNode": llm_by_node,
+            "LLMCalls": calls,
+        }
+
+    # Exporters ------------------------------------------------------------
+    def export_jsonl(self, path: str, run_id: str = None):
+        """Append every record as one JSON line, tagged with its kind and run id."""
+        with self._lock:
+            records = [("llm_call", r) for r in self.llm_calls] + [("span", r) for r in self.spans]
+        with open(path, "a", encoding="utf-8") as f:
+            for kind, record in records:
+                f.write(json.dumps({"kind": kind, "run_id": run_id, **record}) + "\n")
+
+    def export_prometheus(self, path: str, prefix: str = "wordweavers"):
+        """Write cumulative totals in the Prometheus text exposition format."""
+        with self._lock:
+            totals = dict(self.totals)
+        lines = []
+        for metric in sorted({metric for metric, _ in totals}):
+            lines.append(f"# TYPE {prefix}_{metric} counter")
+            for (name, labels), value in sorted(totals.items()):
+                if name != metric:
+                    continue
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+                lines.append(f"{prefix}_{metric}{{{label_text}}} {value:g}")
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        # Replace atomically so a scraper never reads a half-written file.
+        os.replace(tmp_path, path)
+
+process_metrics = MetricsCollector(max_records=PROCESS_HISTORY)
+
+# -------------------------------
+# Recording Hooks
+# -------------------------------
+def record_llm_call(record: dict):
+    """Called by llm_call for every request, cached or not."""
+    record.setdefault("node", _current_span.get())
+    record.setdefault("timestamp", time.time())
+    process_metrics.record_llm_call(record)
+    for collector in _active_collectors.get():
+        collector.record_llm_call(record)
+
+@contextlib.contextmanager
+def span(name: str):
+    """Time a block and attribute any LLM calls inside it to `name` (nested under the current span)."""
+    parent = _current_span.get()
+    full_name = f"{parent}/{name}" if parent else name
+    token = _current_span.set(full_name)
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(token)
+        record = {"name": full_name, "wall_time": round(time.perf_counter() - start, 6), "timestamp": time.time()}
+        if error:
+            record["error"] = error
+        process_metrics.record_span(record)
+        for collector in _active_collectors.get():
+            collector.record_span(record)
+
+def traced(name: str):
+    """Decorator form of span()."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+@contextlib.contextmanager
+def collect():
+    """Collect every record produced inside the block (including worker threads started via submit())."""
+    collector = MetricsCollector()
+    token = _active_collectors.set(_active_collectors.get() + (collector,))
+    try:
+        yield collector
+    finally:
+        _active_collectors.reset(token)
+
+def submit(executor, func, *args, **kwargs):
+    """executor.submit() that carries the current span and collectors into the worker thread."""
+    return executor.submit(contextvars.copy_context().run, func, *args, **kwargs)
@@ -0,0 +1,174 @@
+import itertools
+import os
+import queue
+import threading
+import time
+import traceback
+import uuid
+
+from llm_scheduler import PRIORITIES, priority, scheduler
+
+# -------------------------------
+# Configuration
+# -------------------------------
+# Jobs running at once. LLM requests inside them are capped separately by llm_scheduler.
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "8"))
+# Finished jobs are kept this long so the UI can still poll their result.
+JOB_RETENTION_SECONDS = float(os.environ.get("JOB_RETENTION_SECONDS", "3600"))
+
+# -------------------------------
+# Jobs
+# -------------------------------
+class Job:
+    def __init__(self, kind: str, func, args: tuple, kwargs: dict, priority_name: str, stream: bool):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority_name
+        self.stream = stream
+        self.state = "queued"
+        self.result = None
+        self.error = None
+        # Text produced so far by streaming jobs, for progressive rendering while polling.
+        self.partial = []
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.done = threading.Event()
+
+    def snapshot(self) -> dict:
+        now = time.time()
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "priority": self.priority,
+            "state": self.state,
+            "result": self.result,
+            "error": self.error,
+            "partial": "".join(self.partial),
+            "wait_seconds": round((self.started or now) - self.submitted, 3),
+            "run_seconds": round((self.finished or now) - self.started, 3) if self.started else 0.0,
+        }
+
+class JobService:
+    """
+    Local job queue in front of the LLM. Callers submit extraction, translation or analysis
+    work and poll for the result instead of blocking on it. Queued jobs start in priority
+    order (interactive single-page work before bulk batch work), and every LLM request they
+    make goes through the shared llm_scheduler, which caps in-flight requests to the host.
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS):
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._completed = 0
+        self._total_wait = 0.0
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True) for i in range(max(1, workers))
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, kind: str, func, *args, priority: str = "interactive", stream: bool = False, **kwargs) -> str:
+        """
+        Queue `func(*args, **kwargs)` and return its job id. With `stream=True`, `func` must
+        return an iterator of text pieces; they are exposed as `partial` while the job runs.
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority {priority!r}; expected one of {sorted(PRIORITIES)}")
+        job = Job(kind, func, args, kwargs, priority, stream)
+        with self._lock:
+            self._prune_locked()
+            self._jobs[job.id] = job
+        self._queue.put((PRIORITIES[priority], next(self._sequence), job))
+        return job.id
+
+    def get(self, job_id: str) -> dict:
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            raise KeyError(f"Unknown job {job_id}")
+        return job.snapshot()
+
+    def wait(self, job_id: str, timeout: float = None) -> dict:
+        with self._lock:
+            job = self._jobs[job_id]
+        job.done.wait(timeout)
+        return job.snapshot()
+
+    def queue_position(self, job_id: str) -> int:
+        """How many queued jobs will start before this one (0 once it is running)."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.state != "queued":
+                return 0
+            ahead = (PRIORITIES[job.priority], job.submitted)
+            return sum(1 for other in self._jobs.values()
+                       if other.state == "queued" and (PRIORITIES[other.priority], other.submitted) < ahead)
+
+    def stats(self) -> dict:
+        with self._lock:
+            depth = {name: 0 for name in PRIORITIES}
+            running = 0
+            now = time.time()
+            oldest_wait = 0.0
+            for job in self._jobs.values():
+                if job.state == "queued":
+                    depth[job.priority] += 1
+                    oldest_wait = max(oldest_wait, now - job.submitted)
+                elif job.state == "running":
+                    running += 1
+            return {
+                "queue_depth": depth,
+                "running": running,
+                "completed": self._completed,
+                "mean_wait_seconds": round(self._total_wait / self._completed, 3) if self._completed else 0.0,
+                "oldest_queued_seconds": round(oldest_wait, 3),
+                "llm": scheduler.stats(),
+            }
+
+    def _prune_locked(self):
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        for job_id in [j.id for j in self._jobs.values() if j.finished and j.finished < cutoff]:
+            del self._jobs[job_id]
+
+    def _worker(self):
+        while True:
+            _, _, job = self._queue.get()
+            job.state = "running"
+            job.started = time.time()
+            try:
+                with priority(job.priority):
+                    if job.stream:
+                        for piece in job.func(*job.args, **job.kwargs):
+                            job.partial.append(piece)
+                        job.result = "".join(job.partial).strip()
+                    else:
+                        job.result = job.func(*job.args, **job.kwargs)
+                job.state = "done"
+            except Exception as e:
+                job.error = f"{type(e).__name__}: {e}"
+                job.state = "failed"
+                traceback.print_exc()
+            finally:
+                job.finished = time.time()
+                with self._lock:
+                    self._completed += 1
+                    self._total_wait += job.started - job.submitted
+                job.done.set()
+
+_service = None
+_service_lock = threading.Lock()
+
+def get_job_service() -> JobService:
+    """Return the process-wide job service (shared by every Streamlit session), starting it on first use."""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = JobService()
+    return _service
@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# -------------------------------
+# Configuration
+# -------------------------------
+DEFAULT_CACHE_PATH = os.environ.get("LLM_CACHE_PATH", os.path.join("cache_storage", "llm_cache.sqlite"))
+DEFAULT_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", "5000"))
+DEFAULT_MAX_BYTES = int(os.environ.get("LLM_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+DEFAULT_MAX_AGE = float(os.environ.get("LLM_CACHE_MAX_AGE_SECONDS", str(30 * 24 * 3600)))
+# Set LLM_CACHE_DISABLED=1 to bypass the cache entirely.
+CACHE_DISABLED = os.environ.get("LLM_CACHE_DISABLED", "").lower() in ("1", "true", "yes")
+
+# Evicting on every write would add a few queries per call; do it periodically instead.
+EVICT_EVERY = 50
+
+# -------------------------------
+# Content-Addressed Response Cache
+# -------------------------------
+class LLMCache:
+    """
+    Local SQLite cache for LLM responses.
+    Entries are keyed by a hash of everything that determines the output (model, prompt,
+    generation options, output format and attached image bytes), so identical requests
+    are answered from disk. Entries older than `max_age` are dropped, and the least
+    recently used entries are evicted once `max_entries` or `max_bytes` is exceeded.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 max_bytes: int = DEFAULT_MAX_BYTES, max_age: float = DEFAULT_MAX_AGE,
+                 enabled: bool = not CACHE_DISABLED):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY,"
+                " response TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " created REAL NOT NULL,"
+                " last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+            conn.commit()
+            self._conn = conn
+            self._evict_locked()
+        return self._conn
+
+    @staticmethod
+    def make_key(model: str, prompt: str, options: dict = None, images: list = None,
+                 format=None, system: str = None) -> str:
+        digest = hashlib.sha256()
+        header = {"model": model, "options": options or {}, "format": format, "system": system or ""}
+        digest.update(json.dumps(header, sort_keys=True).encode("utf-8"))
+        digest.update(b"\0prompt\0" + prompt.encode("utf-8"))
+        for image in images or []:
+            digest.update(b"\0image\0" + (image.encode("ascii") if isinstance(image, str) else image))
+        return digest.hexdigest()
+
+    def get(self, key: str):
+        """Return the cached response for `key`, or None on a miss."""
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            now = time.time()
+            if row is None or now - row[1] > self.max_age:
+                self.misses += 1
+                return None
+            conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, response: str):
+        with self._lock:
+            conn = self._connect()
+            now = time.time()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, created, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, response, len(response.encode("utf-8")), now, now),
+            )
+            conn.commit()
+            self._writes += 1
+            if self._writes % EVICT_EVERY == 0:
+                self._evict_locked()
+
+    def delete(self, key: str):
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            conn.commit()
+
+    def _evict_locked(self):
+        conn = self._conn
+        conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.max_age,))
+        count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if count > self.max_entries:
+            conn.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_access ASC LIMIT ?)",
+                (count - self.max_entries,),
+            )
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total > self.max_bytes:
+            # Walk from least to most recently used until we are back under the byte budget.
+            to_free = total - self.max_bytes
+            doomed = []
+            for key, size in conn.execute("SELECT key, size FROM responses ORDER BY last_access ASC"):
+                if to_free <= 0:
+                    break
+                doomed.append((key,))
+                to_free -= size
+            conn.executemany("DELETE FROM responses WHERE key = ?", doomed)
+        conn.commit()
+
+    def evict(self):
+        with self._lock:
+            self._connect()
+            self._evict_locked()
+
+    def clear(self):
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM responses")
+            conn.commit()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            conn = self._connect()
+            count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "entries": count,
+            "bytes": total,
+        }
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache() -> LLMCache:
+    """Return the process-wide response cache, creating it on first use."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = LLMCache()
+    return _cache
@@ -1,13 +1,403 @@
-import subprocess
-import shlex
+import base64
+import http.client
+import json
+import os
+import queue
+import re
+import socket
+import threading
+import time
+import urllib.parse
 
-def llm_call(command_temp: str):
-    # Safely quote the command_temp to avoid shell syntax issues.
-    command = f'ollama run gemma3 {shlex.quote(command_temp)}'
+from llm_cache import get_cache
+from instrumentation import record_llm_call
+from llm_scheduler import current_priority, scheduler
+
+# -------------------------------
+# Configuration
+# -------------------------------
+DEFAULT_HOST = os.environ.get("OLLAMA_HOST", "http://127.0.0.1:11434")
+DEFAULT_MODEL = os.environ.get("OLLAMA_MODEL", "gemma3")
+DEFAULT_TIMEOUT = float(os.environ.get("OLLAMA_TIMEOUT", "300"))
+DEFAULT_POOL_SIZE = int(os.environ.get("OLLAMA_POOL_SIZE", "8"))
+# How long Ollama keeps a model resident after each request. Every request re-arms it,
+# so all requests must use the same value for model_manager's pinning to hold.
+DEFAULT_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+
+# The `ollama run` CLI picks up image paths written inside the prompt and attaches
+# them to the request. We do the same so existing callers keep working unchanged.
+IMAGE_PATH_PATTERN = re.compile(r"[^\s'\"]+\.(?:png|jpe?g|webp)\b", re.IGNORECASE)
+
+# -------------------------------
+# Errors
+# -------------------------------
+class LLMError(Exception):
+    """Base class for every failure talking to the local LLM."""
+
+class LLMConnectionError(LLMError):
+    """The Ollama server could not be reached."""
+
+class LLMTimeoutError(LLMError):
+    """The Ollama server did not answer within the configured timeout."""
+
+class LLMResponseError(LLMError):
+    """The Ollama server answered with an error status or an unreadable body."""
+
+    def __init__(self, message: str, status: int = None):
+        super().__init__(message)
+        self.status = status
+
+# -------------------------------
+# Pooled HTTP Client
+# -------------------------------
+class OllamaClient:
+    """
+    Long-lived client for the Ollama HTTP API.
+    Keeps a small pool of keep-alive connections so repeated prompts skip process
+    start-up and TCP handshakes. Transient failures (connection drops, timeouts,
+    5xx answers) are retried with exponential backoff.
+    """
+
+    def __init__(self, host: str = DEFAULT_HOST, model: str = DEFAULT_MODEL, options: dict = None,
+                 timeout: float = DEFAULT_TIMEOUT, max_retries: int = 2, backoff: float = 0.5,
+                 pool_size: int = DEFAULT_POOL_SIZE, keep_alive: str = DEFAULT_KEEP_ALIVE):
+        if "://" not in host:
+            host = "http://" + host
+        parsed = urllib.parse.urlparse(host)
+        self.scheme = parsed.scheme or "http"
+        self.hostname = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or (443 if self.scheme == "https" else 11434)
+        self.model = model
+        self.options = dict(options or {})
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.keep_alive = keep_alive
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        # Retries used by the most recent request on each thread, for instrumentation.
+        self._local = threading.local()
+
+    @property
+    def last_retries(self) -> int:
+        return getattr(self._local, "retries", 0)
+
+    # Connection pool ------------------------------------------------------
+    def _new_connection(self) -> http.client.HTTPConnection:
+        conn_class = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+        return conn_class(self.hostname, self.port, timeout=self.timeout)
+
+    def _acquire(self) -> http.client.HTTPConnection:
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            return self._new_connection()
+
+    def _release(self, conn: http.client.HTTPConnection):
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+    # Requests -------------------------------------------------------------
+    def _request_once(self, method: str, path: str, payload: dict = None) -> dict:
+        body = json.dumps(payload).encode("utf-8") if payload is not None else None
+        headers = {"Content-Type": "application/json", "Connection": "keep-alive"}
+        conn = self._acquire()
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            raw = response.read()
+        except socket.timeout as e:
+            conn.close()
+            raise LLMTimeoutError(f"Ollama request to {path} timed out after {self.timeout}s") from e
+        except (ConnectionError, http.client.HTTPException, OSError) as e:
+            conn.close()
+            raise LLMConnectionError(f"Could not reach Ollama at {self.hostname}:{self.port}: {e}") from e
+        self._release(conn)
+
+        if response.status >= 400:
+            raise LLMResponseError(f"Ollama returned HTTP {response.status}: {raw.decode('utf-8', 'replace')}",
+                                   status=response.status)
+        try:
+            return json.loads(raw)
+        except ValueError as e:
+            raise LLMResponseError(f"Ollama returned invalid JSON: {raw[:200]!r}", status=response.status) from e
+
+    def _with_retries(self, func, *args):
+        attempt = 0
+        while True:
+            self._local.retries = attempt
+            try:
+                return func(*args)
+            except LLMResponseError as e:
+                # Client errors (bad model name, malformed request) will not fix themselves.
+                if e.status is None or e.status < 500 or attempt >= self.max_retries:
+                    raise
+            except (LLMConnectionError, LLMTimeoutError):
+                if attempt >= self.max_retries:
+                    raise
+            time.sleep(self.backoff * (2 ** attempt))
+            attempt += 1
+
+    def _request(self, method: str, path: str, payload: dict = None) -> dict:
+        return self._with_retries(self._request_once, method, path, payload)
+
+    def _build_payload(self, prompt: str, stream: bool, model: str = None, options: dict = None,
+                       images: list = None, format=None, system: str = None) -> dict:
+        payload = {
+            "model": model or self.model,
+            "prompt": prompt,
+            "stream": stream,
+            "keep_alive": self.keep_alive,
+        }
+        merged_options = {**self.options, **(options or {})}
+        if merged_options:
+            payload["options"] = merged_options
+        if images:
+            payload["images"] = images
+        if format is not None:
+            payload["format"] = format
+        if system:
+            payload["system"] = system
+        return payload
+
+    def generate_full(self, prompt: str, **kwargs) -> dict:
+        """Run a non-streaming /api/generate call and return Ollama's full response dict."""
+        return self._request("POST", "/api/generate", self._build_payload(prompt, False, **kwargs))
+
+    def generate(self, prompt: str, **kwargs) -> str:
+        """Run a prompt and return the generated text."""
+        return self.generate_full(prompt, **kwargs).get("response", "").strip()
+
+    # Streaming ------------------------------------------------------------
+    def _open_stream(self, payload: dict):
+        conn = self._acquire()
+        try:
+            conn.request("POST", "/api/generate", body=json.dumps(payload).encode("utf-8"),
+                         headers={"Content-Type": "application/json", "Connection": "keep-alive"})
+            response = conn.getresponse()
+        except socket.timeout as e:
+            conn.close()
+            raise LLMTimeoutError(f"Ollama stream timed out after {self.timeout}s") from e
+        except (ConnectionError, http.client.HTTPException, OSError) as e:
+            conn.close()
+            raise LLMConnectionError(f"Could not reach Ollama at {self.hostname}:{self.port}: {e}") from e
+        if response.status >= 400:
+            raw = response.read()
+            conn.close()
+            raise LLMResponseError(f"Ollama returned HTTP {response.status}: {raw.decode('utf-8', 'replace')}",
+                                   status=response.status)
+        return conn, response
+
+    def generate_stream(self, prompt: str, stats: dict = None, **kwargs):
+        """
+        Yield response tokens as Ollama generates them.
+        If `stats` is given it is filled with `ttft` (seconds to the first token),
+        `total_time`, and Ollama's final counters (`eval_count`, `prompt_eval_count`, ...).
+        Only opening the stream is retried; a stream that fails midway raises.
+        """
+        start = time.perf_counter()
+        payload = self._build_payload(prompt, True, **kwargs)
+        conn, response = self._with_retries(self._open_stream, payload)
+        finished = False
+        try:
+            while True:
+                try:
+                    line = response.readline()
+                except socket.timeout as e:
+                    raise LLMTimeoutError(f"Ollama stream stalled for more than {self.timeout}s") from e
+                except (ConnectionError, http.client.HTTPException, OSError) as e:
+                    raise LLMConnectionError(f"Ollama stream was interrupted: {e}") from e
+                if not line:
+                    break
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    chunk = json.loads(line)
+                except ValueError as e:
+                    raise LLMResponseError(f"Ollama streamed invalid JSON: {line[:200]!r}") from e
+                if "error" in chunk:
+                    raise LLMResponseError(f"Ollama stream error: {chunk['error']}")
+                token = chunk.get("response", "")
+                if token:
+                    if stats is not None and "ttft" not in stats:
+                        stats["ttft"] = time.perf_counter() - start
+                    yield token
+                if chunk.get("done"):
+                    if stats is not None:
+                        stats.update({k: v for k, v in chunk.items() if k.endswith(("_count", "_duration"))})
+                    finished = True
+                    break
+        finally:
+            if stats is not None:
+                stats["total_time"] = time.perf_counter() - start
+            # A stream abandoned midway leaves unread bytes on the socket, so it cannot be reused.
+            if finished:
+                response.read()
+                self._release(conn)
+            else:
+                conn.close()
+
+# -------------------------------
+# Helpers
+# -------------------------------
+def extract_image_paths(prompt: str):
+    """
+    Mirrors `ollama run`: image file paths written inside the prompt are removed from
+    the text and returned as base64 payloads for the request's `images` field.
+    """
+    images = []
+    for match in IMAGE_PATH_PATTERN.findall(prompt):
+        path = os.path.expanduser(match)
+        if os.path.isfile(path):
+            with open(path, "rb") as f:
+                images.append(base64.b64encode(f.read()).decode("ascii"))
+            prompt = prompt.replace(match, "")
+    return prompt.strip(), images
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client() -> OllamaClient:
+    """Return the process-wide pooled client, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = OllamaClient()
+    return _client
+
+def _cache_key(client: OllamaClient, prompt: str, images: list, options: dict, kwargs: dict) -> str:
+    return get_cache().make_key(kwargs.get("model") or client.model, prompt, {**client.options, **(options or {})},
+                                images, kwargs.get("format"), kwargs.get("system"))
+
+def _route(task: str, options: dict, kwargs: dict) -> dict:
+    """Apply model_manager's model and options for `task`; explicit arguments win."""
+    if task is None:
+        return options
+    from model_manager import resolve
+    model, task_options = resolve(task)
+    kwargs.setdefault("model", model)
+    return {**task_options, **(options or {})}
+
+def _call_record(client: OllamaClient, prompt: str, kwargs: dict, start: float, cache_status: str,
+                 response: dict = None, error: Exception = None, task: str = None, wait: dict = None) -> dict:
+    response = response or {}
+    eval_count = response.get("eval_count", 0)
+    eval_duration = response.get("eval_duration", 0)
+    record = {
+        "model": kwargs.get("model") or client.model,
+        "wall_time": round(time.perf_counter() - start, 6),
+        "prompt_chars": len(prompt),
+        "prompt_tokens": response.get("prompt_eval_count", 0),
+        "eval_tokens": eval_count,
+        # Ollama reports durations in nanoseconds.
+        "tokens_per_sec": round(eval_count / (eval_duration / 1e9), 2) if eval_duration else 0.0,
+        "retries": client.last_retries if cache_status != "hit" else 0,
+        "cache": cache_status,
+        "task": task,
+        "priority": current_priority(),
+        "queue_wait": (wait or {}).get("queue_wait", 0.0),
+    }
+    if "ttft" in response:
+        record["ttft"] = round(response["ttft"], 6)
+    if error is not None:
+        record["error"] = f"{type(error).__name__}: {error}"
+    return record
+
+def llm_call(command_temp: str, options: dict = None, use_cache: bool = True, task: str = None, **kwargs) -> str:
+    # Generation options (temperature, num_ctx, seed, ...) are passed straight to Ollama.
+    # A task type ("grammar", "rubric", ...) selects the model and options configured in model_manager.
+    # Failures raise an LLMError subclass instead of returning None.
+    # Identical requests are answered from the local response cache unless use_cache=False.
+    # Every call is timed and reported to the instrumentation hooks.
+    start = time.perf_counter()
+    options = _route(task, options, kwargs)
+    prompt, images = extract_image_paths(command_temp)
+    client = get_client()
+    cache = get_cache()
+    key = None
+    cache_status = "bypass"
+    if use_cache and cache.enabled:
+        key = _cache_key(client, prompt, images, options, kwargs)
+        cached = cache.get(key)
+        if cached is not None:
+            record_llm_call(_call_record(client, prompt, kwargs, start, "hit", task=task))
+            return cached
+        cache_status = "miss"
+    # Admission control: wait for a free request slot on the Ollama host.
+    wait = {}
+    try:
+        with scheduler.slot(wait):
+            full = client.generate_full(prompt, options=options, images=images, **kwargs)
+    except LLMError as e:
+        record_llm_call(_call_record(client, prompt, kwargs, start, cache_status, error=e, task=task, wait=wait))
+        raise
+    record_llm_call(_call_record(client, prompt, kwargs, start, cache_status, full, task=task, wait=wait))
+    response = full.get("response", "").strip()
+    if key is not None:
+        cache.put(key, response)
+    return response
+
+def replace_cached_response(command_temp: str, response: str = None, options: dict = None, task: str = None, **kwargs):
+    """
+    Overwrite the cached response llm_call() would return for the same arguments, e.g. with
+    a repaired answer after the cached one proved unusable. `response=None` removes it.
+    """
+    cache = get_cache()
+    if not cache.enabled:
+        return
+    options = _route(task, options, kwargs)
+    prompt, images = extract_image_paths(command_temp)
+    key = _cache_key(get_client(), prompt, images, options, kwargs)
+    if response is None:
+        cache.delete(key)
+    else:
+        cache.put(key, response)
+
+def llm_call_stream(command_temp: str, options: dict = None, use_cache: bool = True, stats: dict = None,
+                    task: str = None, **kwargs):
+    """
+    Streaming variant of llm_call(): yields text as it is generated.
+    Cache hits are yielded in one piece; completed streams are written to the cache.
+    See OllamaClient.generate_stream for the contents of `stats`.
+    """
+    start = time.perf_counter()
+    options = _route(task, options, kwargs)
+    prompt, images = extract_image_paths(command_temp)
+    client = get_client()
+    cache = get_cache()
+    key = None
+    cache_status = "bypass"
+    if use_cache and cache.enabled:
+        key = _cache_key(client, prompt, images, options, kwargs)
+        cached = cache.get(key)
+        if cached is not None:
+            if stats is not None:
+                stats.update({"ttft": 0.0, "total_time": 0.0, "cached": True})
+            record_llm_call(_call_record(client, prompt, kwargs, start, "hit", task=task))
+            yield cached
+            return
+        cache_status = "miss"
+    stats = {} if stats is None else stats
+    parts = []
     try:
-        result = subprocess.run(command, shell=True, capture_output=True, text=True, check=True)
-        return result.stdout.strip()
-    except subprocess.CalledProcessError as e:
-        print("Error running command:")
-        print(e.stderr)
-        return None
+        # The slot is held until the stream is finished or abandoned.
+        with scheduler.slot(stats):
+            for token in client.generate_stream(prompt, stats=stats, options=options, images=images, **kwargs):
+                parts.append(token)
+                yield token
+    except LLMError as e:
+        record_llm_call(_call_record(client, prompt, kwargs, start, cache_status, stats, error=e, task=task, wait=stats))
+        raise
+    record_llm_call(_call_record(client, prompt, kwargs, start, cache_status, stats, task=task, wait=stats))
+    if key is not None:
+        cache.put(key, "".join(parts).strip())
@@ -0,0 +1,94 @@
+import contextlib
+import contextvars
+import heapq
+import itertools
+import os
+import threading
+import time
+
+# -------------------------------
+# Configuration
+# -------------------------------
+# Requests the Ollama host can serve at once; further calls wait for a free slot.
+MAX_INFLIGHT = int(os.environ.get("OLLAMA_MAX_INFLIGHT", "4"))
+
+# Lower value is served first.
+PRIORITIES = {"interactive": 0, "batch": 1}
+
+_current_priority = contextvars.ContextVar("llm_priority", default="interactive")
+
+@contextlib.contextmanager
+def priority(name: str):
+    """Run the block (and LLM calls in threads started via instrumentation.submit) at `name` priority."""
+    if name not in PRIORITIES:
+        raise ValueError(f"Unknown priority {name!r}; expected one of {sorted(PRIORITIES)}")
+    token = _current_priority.set(name)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+def current_priority() -> str:
+    return _current_priority.get()
+
+# -------------------------------
+# Admission Control
+# -------------------------------
+class LLMScheduler:
+    """
+    Caps in-flight LLM requests at `capacity`. Waiting callers are admitted by priority
+    (interactive before batch) and then in arrival order.
+    """
+
+    def __init__(self, capacity: int = MAX_INFLIGHT):
+        self.capacity = max(1, capacity)
+        self.in_flight = 0
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+        self._admitted = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    @contextlib.contextmanager
+    def slot(self, wait_stats: dict = None):
+        """Hold one request slot for the duration of the block; the wait is stored in `wait_stats`."""
+        ticket = (PRIORITIES[current_priority()], next(self._sequence))
+        start = time.perf_counter()
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            while self.in_flight >= self.capacity or self._waiting[0] != ticket:
+                self._cond.wait()
+            heapq.heappop(self._waiting)
+            self.in_flight += 1
+            waited = time.perf_counter() - start
+            self._admitted += 1
+            self._total_wait += waited
+            self._max_wait = max(self._max_wait, waited)
+            # The next waiter in line may also fit.
+            self._cond.notify_all()
+        if wait_stats is not None:
+            wait_stats["queue_wait"] = round(waited, 6)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.in_flight -= 1
+                self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            waiting = {name: 0 for name in PRIORITIES}
+            by_value = {value: name for name, value in PRIORITIES.items()}
+            for value, _ in self._waiting:
+                waiting[by_value[value]] += 1
+            return {
+                "capacity": self.capacity,
+                "in_flight": self.in_flight,
+                "waiting": waiting,
+                "admitted": self._admitted,
+                "mean_wait_seconds": round(self._total_wait / self._admitted, 4) if self._admitted else 0.0,
+                "max_wait_seconds": round(self._max_wait, 4),
+            }
+
+scheduler = LLMScheduler()
@@ -0,0 +1,112 @@
+import json
+import os
+import threading
+
+from llm_call import DEFAULT_MODEL, LLMError, get_client
+
+# -------------------------------
+# Task-Based Model Routing
+# Each task type can run on its own model with its own generation options. Override a
+# route with OLLAMA_MODEL_<TASK> (e.g. OLLAMA_MODEL_RUBRIC=gemma3:1b) and
+# OLLAMA_OPTIONS_<TASK> (a JSON object, e.g. '{"temperature": 0}').
+# -------------------------------
+TASKS = ("extraction", "translation", "grammar", "voice", "rubric", "feedback")
+
+DEFAULT_ROUTES = {
+    "extraction": {"model": DEFAULT_MODEL, "options": {"temperature": 0}},
+    "translation": {"model": DEFAULT_MODEL, "options": {"temperature": 0.2}},
+    "grammar": {"model": DEFAULT_MODEL, "options": {}},
+    "voice": {"model": DEFAULT_MODEL, "options": {}},
+    # Short 1-6 scoring prompts: deterministic.
+    "rubric": {"model": DEFAULT_MODEL, "options": {"temperature": 0}},
+    "feedback": {"model": DEFAULT_MODEL, "options": {}},
+}
+
+# Options Ollama applies when it loads a model. A request whose values differ from the
+# loaded runner's makes Ollama reload the model, so they must agree across every route that
+# shares a model; sampling options (temperature, seed, ...) are free to differ per request.
+LOAD_OPTIONS = ("num_ctx", "num_batch", "num_gpu", "main_gpu", "num_thread", "low_vram", "use_mmap", "use_mlock")
+
+def _align_load_options(routes: dict) -> dict:
+    """
+    Give every route of a model the same load options: the largest num_ctx any of them asks
+    for (a larger window serves the others too) and, for the rest, the first value set.
+    """
+    shared = {}
+    for route in routes.values():
+        load = shared.setdefault(route["model"], {})
+        for name in LOAD_OPTIONS:
+            if name not in route["options"]:
+                continue
+            if name not in load:
+                load[name] = route["options"][name]
+            elif name == "num_ctx":
+                load[name] = max(load[name], route["options"][name])
+    for route in routes.values():
+        route["options"].update(shared[route["model"]])
+    return routes
+
+def _load_routes() -> dict:
+    routes = {}
+    for task, route in DEFAULT_ROUTES.items():
+        model = os.environ.get(f"OLLAMA_MODEL_{task.upper()}", route["model"])
+        options = dict(route["options"])
+        override = os.environ.get(f"OLLAMA_OPTIONS_{task.upper()}")
+        if override:
+            options.update(json.loads(override))
+        routes[task] = {"model": model, "options": options}
+    return _align_load_options(routes)
+
+ROUTES = _load_routes()
+
+def load_options(model: str) -> dict:
+    """The load options every route of `model` shares (empty for Ollama's defaults)."""
+    for route in ROUTES.values():
+        if route["model"] == model:
+            return {name: route["options"][name] for name in LOAD_OPTIONS if name in route["options"]}
+    return {}
+
+def resolve(task: str):
+    """Return (model, options) for a task type; unknown tasks use the default model."""
+    route = ROUTES.get(task)
+    if route is None:
+        model = get_client().model
+        return model, load_options(model)
+    return route["model"], dict(route["options"])
+
+# -------------------------------
+# Residency and Warm-Up
+# -------------------------------
+WARM_UP_PROMPT = "Reply with OK."
+
+def warm_up(tasks=TASKS) -> dict:
+    """
+    Load every model used by `tasks` into memory, pinned for the client's keep_alive
+    (OLLAMA_KEEP_ALIVE), and run a one-token prompt through each so the first real
+    request does not pay the load cost. Models are loaded with their routes' load options,
+    so the first real request does not reload them. Returns {model: "ready" | error message}.
+    """
+    client = get_client()
+    status = {}
+    for model in sorted({resolve(task)[0] for task in tasks}):
+        try:
+            # An empty prompt only loads the model; the short prompt warms the runner.
+            options = load_options(model)
+            client.generate_full("", model=model, options=options)
+            client.generate_full(WARM_UP_PROMPT, model=model, options={**options, "num_predict": 1})
+            status[model] = "ready"
+        except LLMError as e:
+            status[model] = f"failed: {e}"
+    return status
+
+_warm_up_thread = None
+_warm_up_lock = threading.Lock()
+
+def warm_up_async(tasks=TASKS) -> threading.Thread:
+    """Start warm_up() once per process on a background thread, so the UI is not blocked."""
+    global _warm_up_thread
+    with _warm_up_lock:
+        if _warm_up_thread is None:
+            _warm_up_thread = threading.Thread(target=warm_up, args=(tasks,), name="model-warm-up", daemon=True)
+            _warm_up_thread.start()
+    return _warm_up_thread
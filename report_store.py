@@ -0,0 +1,330 @@
+import datetime
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+# -------------------------------
+# Configuration
+# -------------------------------
+DEFAULT_REPORT_STORE_PATH = os.environ.get("REPORT_STORE_PATH", os.path.join("report_storage", "reports.sqlite"))
+# Set REPORT_STORE_DISABLED=1 to keep reports out of the analytics store.
+REPORT_STORE_DISABLED = os.environ.get("REPORT_STORE_DISABLED", "").lower() in ("1", "true", "yes")
+
+# (upper bound inclusive, label); ages above the last bound fall in the open-ended band.
+AGE_BANDS = ((8, "5-8"), (11, "9-11"), (14, "12-14"), (18, "15-18"))
+WINDOWS = ("day", "week", "month", "all")
+
+# Flattened metric columns and where they come from in the report.
+SCORE_COLUMNS = {
+    "grammar": ("Scores", "Grammar"),
+    "style": ("Scores", "Style"),
+    "voice_preservation": ("Scores", "VoicePreservation"),
+    "personalized_feedback": ("Scores", "PersonalizedFeedback"),
+    "overall": ("Scores", "Overall"),
+    "content": ("WritingMetrics", "Content"),
+    "structure": ("WritingMetrics", "Structure"),
+    "stance": ("WritingMetrics", "Stance"),
+    "sentence_fluency": ("WritingMetrics", "Sentence Fluency"),
+    "diction": ("WritingMetrics", "Diction"),
+    "conventions": ("WritingMetrics", "Conventions"),
+    "metrics_overall": ("WritingMetrics", "Overall"),
+}
+METRICS = tuple(SCORE_COLUMNS)
+# The agent (as named in the report's OutputErrors) behind each LLM score; when it failed,
+# the score is its fallback value, not a measurement.
+SCORE_AGENTS = {
+    "grammar": "GrammarAndStyle",
+    "style": "GrammarAndStyle",
+    "voice_preservation": "VoicePreservation",
+    "personalized_feedback": "PersonalizedFeedback",
+}
+# Averages over the columns above; unusable when any of their parts is.
+COMBINED_COLUMNS = {
+    "overall": ("grammar", "style", "voice_preservation", "personalized_feedback"),
+    "metrics_overall": ("content", "structure", "stance", "sentence_fluency", "diction", "conventions"),
+}
+RUBRIC_RANGE = (1, 6)
+
+def age_band(metadata: dict, on: datetime.date = None) -> str:
+    """Age band from the metadata's Age, or from its DOB when Age is missing."""
+    age = metadata.get("Age")
+    if age in (None, ""):
+        try:
+            dob = datetime.date.fromisoformat(str(metadata.get("DOB", "")))
+        except ValueError:
+            return "unknown"
+        on = on or datetime.date.today()
+        age = on.year - dob.year - ((on.month, on.day) < (dob.month, dob.day))
+    try:
+        age = int(age)
+    except (TypeError, ValueError):
+        return "unknown"
+    for upper, label in AGE_BANDS:
+        if age <= upper:
+            return label
+    return f"{AGE_BANDS[-1][0] + 1}+"
+
+def window_start(kind: str, day: datetime.date) -> str:
+    if kind == "day":
+        return day.isoformat()
+    if kind == "week":
+        return (day - datetime.timedelta(days=day.weekday())).isoformat()
+    if kind == "month":
+        return day.replace(day=1).isoformat()
+    return ""
+
+def window_end(kind: str, day: datetime.date) -> str:
+    """First day after the window containing `day`, or None for the open-ended window."""
+    if kind == "all":
+        return None
+    start = datetime.date.fromisoformat(window_start(kind, day))
+    if kind == "day":
+        return (start + datetime.timedelta(days=1)).isoformat()
+    if kind == "week":
+        return (start + datetime.timedelta(days=7)).isoformat()
+    return (start.replace(day=28) + datetime.timedelta(days=4)).replace(day=1).isoformat()
+
+def flatten_scores(report: dict) -> dict:
+    """
+    Pull every score in SCORE_COLUMNS out of a report. Missing or non-numeric scores are
+    None, and so are fallback scores of failed agents (an output_error, or a rubric score
+    outside 1-6), so they stay out of the aggregates instead of counting as a real 0.
+    """
+    errors = report.get("OutputErrors", {}) or {}
+    values = {}
+    for column, (section, field) in SCORE_COLUMNS.items():
+        value = report.get(section, {}).get(field)
+        failed = errors.get(SCORE_AGENTS.get(column))
+        if isinstance(value, dict):
+            failed = failed or value.get("output_error")
+            value = value.get("score")
+        try:
+            values[column] = None if failed else float(value)
+        except (TypeError, ValueError):
+            values[column] = None
+        if section == "WritingMetrics" and column not in COMBINED_COLUMNS and values[column] is not None \
+                and not RUBRIC_RANGE[0] <= values[column] <= RUBRIC_RANGE[1]:
+            values[column] = None
+    for column, parts in COMBINED_COLUMNS.items():
+        if any(values[part] is None for part in parts):
+            values[column] = None
+    return values
+
+# -------------------------------
+# Report Store
+# -------------------------------
+class ReportStore:
+    """
+    SQLite store of analysis reports. Each report becomes one row with its scores
+    flattened into columns (the full report is kept zlib-compressed alongside), and a
+    later report of the same submission replaces it. Count, sum, sum of squares, min and
+    max per school, age band, time window and metric are updated in the same transaction,
+    so trend queries read a few aggregate rows instead of scanning the reports.
+    """
+
+    def __init__(self, path: str = DEFAULT_REPORT_STORE_PATH, enabled: bool = not REPORT_STORE_DISABLED):
+        self.path = path
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS reports ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " submission_id TEXT UNIQUE,"
+                " created REAL NOT NULL,"
+                " day TEXT NOT NULL,"
+                " school TEXT NOT NULL,"
+                " age_band TEXT NOT NULL,"
+                " workshop TEXT NOT NULL,"
+                + "".join(f" {column} REAL," for column in METRICS)
+                + " report BLOB NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS reports_school_day ON reports (school, day)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS aggregates ("
+                " school TEXT NOT NULL,"
+                " age_band TEXT NOT NULL,"
+                " granularity TEXT NOT NULL,"
+                " period TEXT NOT NULL,"
+                " metric TEXT NOT NULL,"
+                " count INTEGER NOT NULL,"
+                " total REAL NOT NULL,"
+                " total_sq REAL NOT NULL,"
+                " min_value REAL NOT NULL,"
+                " max_value REAL NOT NULL,"
+                " PRIMARY KEY (granularity, period, school, age_band, metric))"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def append(self, report: dict, submission_id: str = None, created: float = None) -> bool:
+        """
+        Store a report and fold its scores into the aggregates. A report whose
+        `submission_id` is already stored (e.g. a re-analysis after the teacher edited the
+        text) replaces that row, and its contribution to the aggregates, so each submission
+        counts once. Returns True when the report was stored.
+        """
+        if not self.enabled:
+            return False
+        if created is None:
+            try:
+                created = datetime.datetime.fromisoformat(str(report.get("Timestamp"))).timestamp()
+            except ValueError:
+                created = time.time()
+        day = datetime.date.fromtimestamp(created)
+        metadata = report.get("StudentID", {}) or {}
+        school = " ".join(str(metadata.get("school", "")).split()) or "unknown"
+        band = age_band(metadata, on=day)
+        workshop = str(metadata.get("workshop", ""))
+        scores = flatten_scores(report)
+        blob = zlib.compress(json.dumps(report, default=str).encode("utf-8"))
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                if submission_id is not None:
+                    self._remove_locked(conn, submission_id)
+                conn.execute(
+                    "INSERT INTO reports (submission_id, created, day, school, age_band, workshop, "
+                    + ", ".join(METRICS) + ", report) VALUES (" + ", ".join("?" * (len(METRICS) + 7)) + ")",
+                    (submission_id, created, day.isoformat(), school, band, workshop,
+                     *(scores[m] for m in METRICS), blob),
+                )
+                conn.executemany(
+                    "INSERT INTO aggregates (school, age_band, granularity, period, metric, count, total, total_sq, min_value, max_value)"
+                    " VALUES (?, ?, ?, ?, ?, 1, ?, ?, ?, ?)"
+                    " ON CONFLICT (granularity, period, school, age_band, metric) DO UPDATE SET"
+                    " count = count + 1, total = total + excluded.total, total_sq = total_sq + excluded.total_sq,"
+                    " min_value = MIN(min_value, excluded.min_value), max_value = MAX(max_value, excluded.max_value)",
+                    [
+                        (school, band, window, window_start(window, day), metric, value, value * value, value, value)
+                        for window in WINDOWS for metric, value in scores.items() if value is not None
+                    ],
+                )
+        return True
+
+    def _remove_locked(self, conn: sqlite3.Connection, submission_id: str):
+        # Take a stored report and its scores back out of the aggregates.
+        row = conn.execute("SELECT id, day, school, age_band, " + ", ".join(METRICS)
+                           + " FROM reports WHERE submission_id = ?", (submission_id,)).fetchone()
+        if row is None:
+            return
+        report_id, day, school, band = row[:4]
+        scores = {metric: value for metric, value in zip(METRICS, row[4:]) if value is not None}
+        conn.execute("DELETE FROM reports WHERE id = ?", (report_id,))
+        day = datetime.date.fromisoformat(day)
+        for window in WINDOWS:
+            key = (window, window_start(window, day), school, band)
+            conn.executemany(
+                "UPDATE aggregates SET count = count - 1, total = total - ?, total_sq = total_sq - ?"
+                " WHERE granularity = ? AND period = ? AND school = ? AND age_band = ? AND metric = ?",
+                [(value, value * value, *key, metric) for metric, value in scores.items()],
+            )
+            conn.execute("DELETE FROM aggregates WHERE count <= 0 AND granularity = ? AND period = ?"
+                         " AND school = ? AND age_band = ?", key)
+            # Min and max cannot be taken back; recompute them from the period's remaining reports.
+            where, params = "school = ? AND age_band = ? AND day >= ?", [school, band, key[1]]
+            end = window_end(window, day)
+            if end is not None:
+                where += " AND day < ?"
+                params.append(end)
+            bounds = conn.execute("SELECT " + ", ".join(f"MIN({m}), MAX({m})" for m in scores)
+                                  + " FROM reports WHERE " + where, params).fetchone() if scores else ()
+            conn.executemany(
+                "UPDATE aggregates SET min_value = ?, max_value = ?"
+                " WHERE granularity = ? AND period = ? AND school = ? AND age_band = ? AND metric = ?",
+                [(bounds[2 * i], bounds[2 * i + 1], *key, metric) for i, metric in enumerate(scores)
+                 if bounds[2 * i] is not None],
+            )
+
+    def trends(self, window: str = "month", by=("school",), metric: str = None, school: str = None,
+               age_band: str = None, since: str = None) -> list:
+        """
+        Summaries per period from the aggregates: count, mean, std, min and max of each
+        metric, grouped by period and the columns in `by` (any of "school", "age_band").
+        `since` is an ISO date; periods starting before it are left out.
+        """
+        if window not in WINDOWS:
+            raise ValueError(f"Unknown window {window!r}; expected one of {WINDOWS}")
+        group = [column for column in by if column in ("school", "age_band")]
+        where, params = ["granularity = ?"], [window]
+        for column, value in (("metric", metric), ("school", school), ("age_band", age_band)):
+            if value is not None:
+                where.append(f"{column} = ?")
+                params.append(value)
+        if since:
+            where.append("period >= ?")
+            params.append(since)
+        columns = ["period"] + group + ["metric"]
+        query = (
+            "SELECT " + ", ".join(columns) + ", SUM(count), SUM(total), SUM(total_sq), MIN(min_value), MAX(max_value)"
+            " FROM aggregates WHERE " + " AND ".join(where)
+            + " GROUP BY " + ", ".join(columns) + " ORDER BY " + ", ".join(columns)
+        )
+        with self._lock:
+            rows = self._connect().execute(query, params).fetchall()
+        results = []
+        for row in rows:
+            keys = dict(zip(columns, row))
+            count, total, total_sq, low, high = row[len(columns):]
+            mean = total / count
+            results.append({
+                **keys,
+                "count": count,
+                "mean": round(mean, 3),
+                "std": round(math.sqrt(max(total_sq / count - mean * mean, 0.0)), 3),
+                "min": low,
+                "max": high,
+            })
+        return results
+
+    def reports(self, school: str = None, since: str = None, limit: int = 100) -> list:
+        """Newest flattened report rows (without the stored report body)."""
+        where, params = [], []
+        if school is not None:
+            where.append("school = ?")
+            params.append(school)
+        if since:
+            where.append("day >= ?")
+            params.append(since)
+        columns = ["id", "submission_id", "created", "day", "school", "age_band", "workshop", *METRICS]
+        query = ("SELECT " + ", ".join(columns) + " FROM reports"
+                 + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY id DESC LIMIT ?")
+        with self._lock:
+            rows = self._connect().execute(query, params + [limit]).fetchall()
+        return [dict(zip(columns, row)) for row in rows]
+
+    def load_report(self, report_id: int) -> dict:
+        with self._lock:
+            row = self._connect().execute("SELECT report FROM reports WHERE id = ?", (report_id,)).fetchone()
+        if row is None:
+            raise KeyError(f"Unknown report {report_id}")
+        return json.loads(zlib.decompress(row[0]).decode("utf-8"))
+
+    def size(self) -> int:
+        with self._lock:
+            return self._connect().execute("SELECT COUNT(*) FROM reports").fetchone()[0]
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_report_store() -> ReportStore:
+    """Return the process-wide report store, creating it on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ReportStore()
+    return _store
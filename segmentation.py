@@ -0,0 +1,37 @@
+import re
+
+# -------------------------------
+# Paragraph and Sentence Segmentation
+# Plain regular expressions with no dependencies, shared by translation, grammar editing
+# and the local text statistics.
+# -------------------------------
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+# Whitespace after sentence-ending punctuation, optionally followed by a closing quote or bracket.
+SENTENCE_END = re.compile(r"(?:(?<=[.!?\u2026])|(?<=[.!?\u2026][\"'\u201d\u00bb)]))\s+")
+
+def split_into_chunks(text: str, max_chars: int) -> list:
+    """
+    Split text into paragraphs, and paragraphs longer than `max_chars` into runs of whole
+    sentences no longer than `max_chars` (a single overlong sentence becomes its own chunk).
+    Returns a list of paragraphs, each a list of chunk strings.
+    """
+    paragraphs = []
+    for paragraph in PARAGRAPH_BREAK.split(text.strip()):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) <= max_chars:
+            paragraphs.append([paragraph])
+            continue
+        chunks = []
+        current = ""
+        for sentence in SENTENCE_END.split(paragraph):
+            if current and len(current) + 1 + len(sentence) > max_chars:
+                chunks.append(current)
+                current = sentence
+            else:
+                current = (current + " " + sentence).strip()
+        if current:
+            chunks.append(current)
+        paragraphs.append(chunks)
+    return paragraphs
@@ -0,0 +1,178 @@
+import ast
+import json
+import re
+
+from llm_call import llm_call, replace_cached_response
+
+# -------------------------------
+# Errors
+# -------------------------------
+class StructuredOutputError(ValueError):
+    """An agent response could not be parsed or did not match its schema."""
+
+# -------------------------------
+# Tolerant JSON Parsing
+# -------------------------------
+_CODE_FENCE = re.compile(r"```(?:json|JSON)?\s*(.*?)```", re.DOTALL)
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_NUMBER_IN_TEXT = re.compile(r"-?\d+(?:\.\d+)?")
+
+def _find_json_object(text: str) -> str:
+    """Return the first balanced {...} block, ignoring braces inside strings."""
+    start = text.find("{")
+    if start == -1:
+        raise StructuredOutputError("No JSON object found in response")
+    depth = 0
+    quote = None
+    escaped = False
+    for i in range(start, len(text)):
+        char = text[i]
+        if quote:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == quote:
+                quote = None
+        elif char in ("'", '"'):
+            quote = char
+        elif char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    raise StructuredOutputError("Unbalanced braces in response (output may be truncated)")
+
+def parse_json_lenient(text: str) -> dict:
+    """
+    Parse a JSON object out of an LLM response, repairing the usual defects:
+    markdown code fences, prose before or after the object, trailing commas, and
+    Python-style literals (single quotes, True/False/None).
+    """
+    if text is None:
+        raise StructuredOutputError("Empty response")
+    fenced = _CODE_FENCE.search(text)
+    if fenced:
+        text = fenced.group(1)
+    text = text.strip()
+    try:
+        data = json.loads(text)
+    except ValueError:
+        candidate = _TRAILING_COMMA.sub(r"\1", _find_json_object(text))
+        try:
+            data = json.loads(candidate)
+        except ValueError:
+            try:
+                data = ast.literal_eval(candidate)
+            except (ValueError, SyntaxError) as e:
+                raise StructuredOutputError(f"Could not repair JSON: {e}") from e
+    if not isinstance(data, dict):
+        raise StructuredOutputError(f"Expected a JSON object, got {type(data).__name__}")
+    return data
+
+# -------------------------------
+# Schema Validation and Coercion
+# -------------------------------
+def _coerce_number(value, spec: dict, field: str):
+    if isinstance(value, bool):
+        raise StructuredOutputError(f"'{field}' should be a number, got a boolean")
+    if isinstance(value, str):
+        # Accept "85", "85%", "85/100", "Score: 5".
+        match = _NUMBER_IN_TEXT.search(value)
+        if not match:
+            raise StructuredOutputError(f"'{field}' should be a number, got {value!r}")
+        value = match.group(0)
+    try:
+        value = float(value)
+    except (TypeError, ValueError) as e:
+        raise StructuredOutputError(f"'{field}' should be a number, got {value!r}") from e
+    if "minimum" in spec:
+        value = max(value, spec["minimum"])
+    if "maximum" in spec:
+        value = min(value, spec["maximum"])
+    if spec.get("type") == "integer":
+        value = int(round(value))
+    return value
+
+def _coerce(value, spec: dict, field: str):
+    kind = spec.get("type")
+    if kind in ("number", "integer"):
+        return _coerce_number(value, spec, field)
+    if kind == "string":
+        if isinstance(value, (dict, list)):
+            return json.dumps(value)
+        return "" if value is None else str(value)
+    if kind == "array":
+        if value is None:
+            return []
+        if not isinstance(value, list):
+            value = [value]
+        item_spec = spec.get("items")
+        if item_spec:
+            return [_coerce(item, item_spec, f"{field}[]") for item in value]
+        return value
+    if kind == "object":
+        if not isinstance(value, dict):
+            raise StructuredOutputError(f"'{field}' should be an object, got {type(value).__name__}")
+        return validate_output(value, spec, strict=False)
+    return value
+
+def validate_output(data: dict, schema: dict, strict: bool = True) -> dict:
+    """
+    Check `data` against a (small subset of) JSON schema and coerce field types, e.g. a
+    score returned as "85" becomes 85.0 and is clamped to the schema's bounds.
+    Missing required fields raise StructuredOutputError when `strict`, and are left out otherwise.
+    """
+    properties = schema.get("properties", {})
+    result = dict(data)
+    for field, spec in properties.items():
+        if field in data:
+            result[field] = _coerce(data[field], spec, field)
+        elif strict and field in schema.get("required", []):
+            raise StructuredOutputError(f"Missing required field '{field}'")
+    return result
+
+# -------------------------------
+# Agent Call With Repair and Retry
+# -------------------------------
+def call_json_agent(prompt: str, schema: dict, fallback: dict = None, max_attempts: int = 3, task: str = None) -> dict:
+    """
+    Ask the LLM for JSON constrained to `schema`, then parse, repair and validate it.
+    A malformed answer re-asks this agent only (bypassing the response cache), up to
+    `max_attempts` times; the repaired answer then replaces the malformed one in the
+    cache. If every attempt fails and a `fallback` is given, the fallback values are
+    returned, merged with whatever valid fields were recovered, plus an 'output_error'
+    note; without a fallback the last error is raised.
+    `task` selects the model route in model_manager.
+    """
+    last_error = None
+    recovered = {}
+    for attempt in range(max_attempts):
+        attempt_prompt = prompt
+        if last_error is not None:
+            attempt_prompt = (
+                prompt + "\n\nYour previous answer could not be used (" + str(last_error) + "). "
+                "Reply with only a JSON object matching the requested keys."
+            )
+        output_text = llm_call(attempt_prompt, format=schema, use_cache=attempt == 0, task=task)
+        try:
+            data = parse_json_lenient(output_text)
+            recovered = {**recovered, **validate_output(data, schema, strict=False)}
+            result = validate_output(data, schema)
+        except StructuredOutputError as e:
+            last_error = e
+            continue
+        if attempt:
+            # The cached first answer was unusable; keep the repaired one in its place so a
+            # rerun of the same prompt neither hits the bad answer nor pays for the retry.
+            replace_cached_response(prompt, json.dumps(result), format=schema, task=task)
+        return result
+    if max_attempts:
+        # Nothing usable came back; do not serve the malformed answer from the cache again.
+        replace_cached_response(prompt, None, format=schema, task=task)
+    if fallback is None:
+        raise last_error
+    result = {**fallback, **recovered}
+    result["output_error"] = str(last_error)
+    return result
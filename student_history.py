@@ -0,0 +1,350 @@
+import hashlib
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+from text_stats import STOPWORDS
+
+# -------------------------------
+# Configuration
+# -------------------------------
+HISTORY_FILENAME = "student_history.sqlite"
+# Approximate tokens of prior context handed to the agents per submission.
+HISTORY_TOKEN_BUDGET = int(os.environ.get("STUDENT_HISTORY_TOKEN_BUDGET", "400"))
+# Once a student has more than MAX_ENTRIES submissions on file, all but the newest
+# KEEP_RECENT are folded into a single digest entry.
+HISTORY_MAX_ENTRIES = int(os.environ.get("STUDENT_HISTORY_MAX_ENTRIES", "8"))
+HISTORY_KEEP_RECENT = int(os.environ.get("STUDENT_HISTORY_KEEP_RECENT", "4"))
+# Feedback notes carried in a digest; older notes drop off as new ones are folded in.
+DIGEST_MAX_NOTES = 3
+NOTE_MAX_CHARS = 200
+EXAMPLES_PER_SUBMISSION = 3
+
+# Two texts whose estimated word-trigram overlap (Jaccard) reaches this are drafts of the
+# same submission, e.g. a story re-analysed after a teacher's edit.
+NEAR_DUPLICATE_SIMILARITY = 0.5
+# MinHash values kept per submission to estimate that overlap.
+FINGERPRINT_SIZE = 32
+_MERSENNE_PRIME = (1 << 61) - 1
+
+# BM25 parameters.
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_TERM = re.compile(r"[^\W\d_]+(?:'[^\W\d_]+)?")
+
+def estimate_tokens(text: str) -> int:
+    # Roughly four characters per token for English prose; close enough for budgeting.
+    return max(1, len(text) // 4)
+
+def _terms(text: str) -> list:
+    return [t for t in _TERM.findall(text.lower()) if t not in STOPWORDS and len(t) > 1]
+
+def student_key(metadata: dict) -> str:
+    """
+    Identify a student from the app's metadata. Name, school and date of birth are used;
+    age is left out because it changes between submissions. Returns "" without a name.
+    """
+    name = " ".join(str(metadata.get("name", "")).lower().split())
+    if not name:
+        return ""
+    parts = [name, " ".join(str(metadata.get("school", "")).lower().split()), str(metadata.get("DOB", "")).strip()]
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()[:32]
+
+def _shingle_hash(shingle: str) -> int:
+    return int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+
+# Fixed (a, b) pairs for the MinHash permutations, so fingerprints stay comparable across runs.
+_PERMUTATIONS = [(_shingle_hash(f"a{i}") % _MERSENNE_PRIME | 1, _shingle_hash(f"b{i}") % _MERSENNE_PRIME)
+                 for i in range(FINGERPRINT_SIZE)]
+
+def fingerprint(text: str) -> list:
+    """MinHash of the text's word trigrams; compare two with `similarity`."""
+    words = re.findall(r"\w+", text.lower())
+    shingles = {" ".join(words[i:i + 3]) for i in range(max(1, len(words) - 2))}
+    hashes = [_shingle_hash(shingle) for shingle in shingles]
+    return [min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in _PERMUTATIONS]
+
+def similarity(first: list, second: list) -> float:
+    """Estimated Jaccard similarity of the texts behind two fingerprints."""
+    if not first or not second or len(first) != len(second):
+        return 0.0
+    return sum(1 for x, y in zip(first, second) if x == y) / len(first)
+
+def _first_sentence(text: str) -> str:
+    text = " ".join((text or "").split())
+    match = re.search(r"(?<=[.!?])\s", text)
+    sentence = text[:match.start()] if match else text
+    return sentence[:NOTE_MAX_CHARS]
+
+# -------------------------------
+# Lexical Index
+# -------------------------------
+class _BM25Index:
+    """In-memory BM25 index over one student's history entries."""
+
+    def __init__(self, entries: list):
+        self.entries = entries
+        self.doc_terms = [Counter(_terms(entry["text"])) for entry in entries]
+        self.doc_lengths = [sum(terms.values()) for terms in self.doc_terms]
+        self.avg_length = (sum(self.doc_lengths) / len(entries)) if entries else 0.0
+        self.doc_freq = Counter()
+        for terms in self.doc_terms:
+            self.doc_freq.update(terms.keys())
+
+    def scores(self, query: str) -> list:
+        n = len(self.entries)
+        query_terms = set(_terms(query))
+        results = []
+        for terms, length in zip(self.doc_terms, self.doc_lengths):
+            score = 0.0
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * length / (self.avg_length or 1))
+            for term in query_terms:
+                freq = terms.get(term)
+                if freq:
+                    idf = math.log(1 + (n - self.doc_freq[term] + 0.5) / (self.doc_freq[term] + 0.5))
+                    score += idf * freq * (BM25_K1 + 1) / (freq + norm)
+            results.append(score)
+        return results
+
+# -------------------------------
+# History Store
+# -------------------------------
+class StudentHistory:
+    """
+    Local store of each student's past submissions: a short note per submission with its
+    scores, the kinds of edits made and the feedback given. `context_for` returns the most
+    relevant notes for a new story within a token budget, and `record` compacts old notes
+    into a digest so a student's history (and prompt size) stays bounded.
+    """
+
+    def __init__(self, path: str, token_budget: int = HISTORY_TOKEN_BUDGET,
+                 max_entries: int = HISTORY_MAX_ENTRIES, keep_recent: int = HISTORY_KEEP_RECENT):
+        self.path = path
+        self.token_budget = token_budget
+        self.max_entries = max(max_entries, keep_recent + 1)
+        self.keep_recent = keep_recent
+        self._lock = threading.Lock()
+        self._conn = None
+        self._indexes = {}
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " student_key TEXT NOT NULL,"
+                " submission_id TEXT,"
+                " kind TEXT NOT NULL,"
+                " created REAL NOT NULL,"
+                " text TEXT NOT NULL,"
+                " data TEXT NOT NULL,"
+                " UNIQUE (student_key, submission_id))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_student ON entries (student_key, created)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _entries(self, key: str) -> list:
+        rows = self._connect().execute(
+            "SELECT id, submission_id, kind, created, text, data FROM entries WHERE student_key = ? ORDER BY created",
+            (key,),
+        )
+        return [
+            {"id": row[0], "submission_id": row[1], "kind": row[2], "created": row[3], "text": row[4],
+             "data": json.loads(row[5])}
+            for row in rows
+        ]
+
+    def _index(self, key: str) -> _BM25Index:
+        index = self._indexes.get(key)
+        if index is None:
+            index = _BM25Index(self._entries(key))
+            self._indexes[key] = index
+        return index
+
+    @staticmethod
+    def _same_submission(entry: dict, submission_id: str, text_fingerprint: list) -> bool:
+        # The caller's id when both sides have one, otherwise near-identical text.
+        if entry["kind"] != "submission":
+            return False
+        if submission_id is not None and entry["submission_id"] is not None:
+            return entry["submission_id"] == submission_id
+        return similarity(entry["data"].get("fingerprint"), text_fingerprint) >= NEAR_DUPLICATE_SIMILARITY
+
+    def context_for(self, metadata: dict, text: str, submission_id: str = None) -> tuple:
+        """
+        Return (context, entries_used): prior notes for this student ranked by BM25 against
+        `text`, most relevant first, within the token budget. Ties go to the newest entry.
+        Earlier drafts of this submission (same `submission_id`, or near-identical text when
+        there is none) are not prior work and are left out.
+        """
+        key = student_key(metadata)
+        if not key:
+            return "", 0
+        text_fingerprint = fingerprint(text)
+        with self._lock:
+            index = self._index(key)
+            candidates = [
+                (score, entry["created"], entry) for score, entry in zip(index.scores(text), index.entries)
+                if not self._same_submission(entry, submission_id, text_fingerprint)
+            ]
+        candidates.sort(key=lambda c: (c[0], c[1]), reverse=True)
+        notes, used = [], 0
+        for _, _, entry in candidates:
+            cost = estimate_tokens(entry["text"])
+            if used + cost > self.token_budget:
+                continue
+            notes.append(entry["text"])
+            used += cost
+        return "\n".join(notes), len(notes)
+
+    def record(self, metadata: dict, report: dict, text: str, submission_id: str = None):
+        """
+        Store a note for a finished analysis of `text`, replacing the note of any earlier
+        draft of the same submission, then compact the student's history if needed.
+        """
+        key = student_key(metadata)
+        if not key:
+            return
+        data = _submission_data(report)
+        data["fingerprint"] = fingerprint(text)
+        with self._lock:
+            conn = self._connect()
+            drafts = [entry["id"] for entry in self._entries(key)
+                      if self._same_submission(entry, submission_id, data["fingerprint"])]
+            conn.executemany("DELETE FROM entries WHERE id = ?", [(entry_id,) for entry_id in drafts])
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (student_key, submission_id, kind, created, text, data)"
+                " VALUES (?, ?, 'submission', ?, ?, ?)",
+                (key, submission_id, time.time(), _submission_note(data), json.dumps(data)),
+            )
+            conn.commit()
+            self._compact_locked(key)
+            self._indexes.pop(key, None)
+
+    def _compact_locked(self, key: str):
+        entries = self._entries(key)
+        submissions = [e for e in entries if e["kind"] == "submission"]
+        if len(submissions) <= self.max_entries:
+            return
+        folded = submissions[:len(submissions) - self.keep_recent]
+        digests = [e for e in entries if e["kind"] == "digest"]
+        digest = _merge_digest([d["data"] for d in digests] + [e["data"] for e in folded])
+        conn = self._connect()
+        conn.executemany("DELETE FROM entries WHERE id = ?", [(e["id"],) for e in digests + folded])
+        # The digest sorts before the submissions it does not cover.
+        conn.execute(
+            "INSERT INTO entries (student_key, submission_id, kind, created, text, data) VALUES (?, NULL, 'digest', ?, ?, ?)",
+            (key, folded[-1]["created"], _digest_note(digest), json.dumps(digest)),
+        )
+        conn.commit()
+
+    def size(self, metadata: dict) -> int:
+        with self._lock:
+            return self._connect().execute(
+                "SELECT COUNT(*) FROM entries WHERE student_key = ?", (student_key(metadata),)).fetchone()[0]
+
+# -------------------------------
+# Notes and Digests
+# -------------------------------
+SCORE_KEYS = ("Grammar", "Style", "VoicePreservation", "PersonalizedFeedback")
+
+def _submission_data(report: dict) -> dict:
+    categories = Counter(
+        str(change.get("category", "")).strip().lower() or "other"
+        for change in report.get("ChangeSuggestions", []) if isinstance(change, dict)
+    )
+    scores = report.get("Scores", {})
+    rubric = {name: result.get("score", 0) for name, result in report.get("WritingMetrics", {}).items()
+              if isinstance(result, dict) and name != "Overall"}
+    feedback = report.get("Feedback", {})
+    examples = [
+        f"{change.get('original')} -> {change.get('suggestion')}" for change in report.get("ChangeSuggestions", [])
+        if isinstance(change, dict) and change.get("original") and change.get("suggestion")
+    ]
+    return {
+        "date": str(report.get("Timestamp", ""))[:10],
+        "count": 1,
+        # The opening line gives BM25 something to match the topic of a new story against.
+        "topic": _first_sentence(report.get("FinalEditedText", ""))[:120],
+        "examples": [example[:80] for example in examples[:EXAMPLES_PER_SUBMISSION]],
+        "scores": {name: scores.get(name, 0) for name in SCORE_KEYS},
+        "rubric": rubric,
+        "categories": dict(categories),
+        "notes": [note for note in (_first_sentence(feedback.get("Personalized", "")),
+                                    _first_sentence(feedback.get("VoicePreservation", ""))) if note],
+    }
+
+def _format_counts(counts: dict, limit: int = 5) -> str:
+    top = sorted(counts.items(), key=lambda item: -item[1])[:limit]
+    return ", ".join(f"{name} ({count})" for name, count in top) or "none"
+
+def _submission_note(data: dict) -> str:
+    scores = ", ".join(f"{name} {round(value)}" for name, value in data["scores"].items())
+    weakest = sorted(data["rubric"].items(), key=lambda item: item[1])[:2]
+    lines = [
+        f"Submission {data['date']} ({data['topic']}): scores {scores}.",
+        f"Edits: {_format_counts(data['categories'])}.",
+    ]
+    if data["examples"]:
+        lines.append("Examples: " + "; ".join(data["examples"]) + ".")
+    if weakest:
+        lines.append("Weakest rubric areas: " + ", ".join(f"{name} {score}/6" for name, score in weakest) + ".")
+    lines.extend(f"Feedback: {note}" for note in data["notes"])
+    return " ".join(lines)
+
+def _merge_digest(items: list) -> dict:
+    """Combine submission and digest data into one digest; averages are weighted by count."""
+    count = sum(item["count"] for item in items)
+    scores = {name: sum(item["scores"].get(name, 0) * item["count"] for item in items) / count for name in SCORE_KEYS}
+    categories = Counter()
+    for item in items:
+        categories.update(item["categories"])
+    # Newest distinct notes win.
+    notes = list(dict.fromkeys(note for item in reversed(items) for note in reversed(item["notes"])))
+    notes = notes[:DIGEST_MAX_NOTES][::-1]
+    dates = [item["date"] for item in items if item["date"]]
+    first_dates = [item.get("first_date") or item["date"] for item in items if item["date"]]
+    return {
+        "date": max(dates) if dates else "",
+        "first_date": min(first_dates) if first_dates else "",
+        "count": count,
+        "scores": scores,
+        "rubric": {},
+        "categories": dict(categories),
+        "notes": notes,
+    }
+
+def _digest_note(digest: dict) -> str:
+    scores = ", ".join(f"{name} {round(value)}" for name, value in digest["scores"].items())
+    lines = [
+        f"Earlier work ({digest['count']} submissions, {digest['first_date']} to {digest['date']}): "
+        f"average scores {scores}.",
+        f"Recurring edits: {_format_counts(digest['categories'])}.",
+    ]
+    lines.extend(f"Earlier feedback: {note}" for note in digest["notes"])
+    return " ".join(lines)
+
+_histories = {}
+_histories_lock = threading.Lock()
+
+def get_student_history(context_dir: str = "context_storage") -> StudentHistory:
+    """Return the process-wide history store kept in `context_dir`, creating it on first use."""
+    with _histories_lock:
+        history = _histories.get(context_dir)
+        if history is None:
+            history = StudentHistory(os.path.join(context_dir, HISTORY_FILENAME))
+            _histories[context_dir] = history
+    return history
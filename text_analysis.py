@@ -1,9 +1,88 @@
 import json
+import os
 import datetime
-from llm_call import llm_call
+import time
+import difflib
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import TypedDict
+from structured_output import StructuredOutputError, call_json_agent, validate_output
+from text_stats import analyze_text, format_hints
+from segmentation import split_into_chunks
+from student_history import estimate_tokens, get_student_history
+from report_store import get_report_store
+import instrumentation
+from instrumentation import submit, traced
 
-from langgraph.graph import START, END, StateGraph
-from langgraph.checkpoint.memory import MemorySaver
+from workflow_checkpoints import ThreadRegistry, make_checkpointer, submission_thread_id
+
+# -------------------------------
+# Agent Output Schemas
+# Sent to Ollama as the `format` constraint and used to validate and coerce each reply,
+# so that scores are always numbers by the time run_workflow does its math.
+# -------------------------------
+GRAMMAR_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "edited_text": {"type": "string"},
+        "changes": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "original": {"type": "string"},
+                    "suggestion": {"type": "string"},
+                    "category": {"type": "string"},
+                    "rationale": {"type": "string"},
+                },
+            },
+        },
+        "grammar_score": {"type": "number", "minimum": 0, "maximum": 100},
+        "style_score": {"type": "number", "minimum": 0, "maximum": 100},
+    },
+    "required": ["edited_text", "changes", "grammar_score", "style_score"],
+}
+
+VOICE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "final_text": {"type": "string"},
+        "voice_score": {"type": "number", "minimum": 0, "maximum": 100},
+        "voice_feedback": {"type": "string"},
+    },
+    "required": ["final_text", "voice_score", "voice_feedback"],
+}
+
+FEEDBACK_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "feedback_message": {"type": "string"},
+        "personalized_score": {"type": "number", "minimum": 0, "maximum": 100},
+    },
+    "required": ["feedback_message", "personalized_score"],
+}
+
+RUBRIC_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "score": {"type": "integer", "minimum": 1, "maximum": 6},
+        "comment": {"type": "string"},
+    },
+    "required": ["score", "comment"],
+}
+# A rubric agent that never produced usable output counts as 0, as before.
+RUBRIC_FALLBACK = {"score": 0, "comment": ""}
+
+def _rubric_prompt(label: str, rubric: str, text: str, hints: str = "") -> str:
+    # Exact counts from text_stats stand in for the part of the judgement the agent would
+    # otherwise spend counting, so the prompt only asks for what needs reading.
+    return (
+        f"Score the student writing below for {label} on this rubric:\n{rubric}"
+        + (f"Exact counts, already measured; use them instead of counting:\n{hints}\n" if hints else "")
+        + "Return a JSON object with keys 'score' (1-6) and 'comment'.\n\n"
+        "Student Writing:\n" + text
+    )
 
 # -------------------------------
 # Core Agent Functions with Expanded Prompts
@@ -17,15 +96,129 @@ def grammar_and_style_agent_llm(text: str, context: str = "") -> dict:
         "error category, and rationale), and assign a Grammar Score and a Style Score (each between 0 and 100). "
         "Return your output as a JSON object with keys 'edited_text', 'changes', 'grammar_score', and 'style_score'."
         "Do not have any initial or trailing text. \n\n"
-        "Student Writing:\n" + text
+        + ("Editor Notes:\n" + context + "\n\n" if context else "")
+        + "Student Writing:\n" + text
     )
-    output_text = llm_call(prompt)
-    # Strip markdown code block delimiters if present
-    if output_text.startswith("```json"):
-        output_text = output_text[len("```json"):].strip()
-    if output_text.endswith("```"):
-        output_text = output_text[:-3].strip()
-    return json.loads(output_text)
+    return call_json_agent(prompt, GRAMMAR_SCHEMA, fallback={"edited_text": text, "changes": [], "grammar_score": 0, "style_score": 0}, task="grammar")
+
+# -------------------------------
+# Chunked Grammar Editing
+# Long stories are edited one paragraph (or run of sentences) at a time, concurrently, so a
+# truncated reply only loses one chunk and an unchanged paragraph is never edited twice.
+# -------------------------------
+GRAMMAR_CHUNK_MAX_CHARS = int(os.environ.get("GRAMMAR_CHUNK_MAX_CHARS", "1500"))
+GRAMMAR_CONCURRENCY = int(os.environ.get("GRAMMAR_CONCURRENCY", "4"))
+
+def _locate_chunks(text: str, chunks: list) -> list:
+    """Start offset of each chunk in `text`, searching forward; None if it cannot be found."""
+    starts, cursor = [], 0
+    for chunk in chunks:
+        start = text.find(chunk, cursor)
+        if start == -1:
+            # Sentence runs are rejoined with single spaces; their first sentence still matches.
+            start = text.find(chunk[:40], cursor)
+        starts.append(start if start != -1 else None)
+        if start != -1:
+            cursor = start + 1
+    return starts
+
+def _grammar_chunks(text: str, max_chars: int = None) -> list:
+    """The chunks edit_in_chunks sends for `text`, grouped by paragraph."""
+    max_chars = max_chars or GRAMMAR_CHUNK_MAX_CHARS
+    # Every chunk repeats the instructions and context, so a text within budget stays whole.
+    return [[text.strip()]] if len(text.strip()) <= max_chars else split_into_chunks(text, max_chars)
+
+def edit_in_chunks(text: str, context: str = "", reuse: dict = None, max_chars: int = None,
+                   max_workers: int = None) -> tuple:
+    """
+    Run the grammar agent over each chunk of `text` concurrently and merge the results.
+    Text longer than `max_chars` is split into paragraphs, and long paragraphs into runs of
+    sentences; shorter text is a single chunk.
+    `reuse` maps a chunk's content hash (including the context) to an earlier result and is
+    updated in place; matching chunks skip the LLM, and so does a chunk the agent itself
+    produced, which the next pass gets back when the voice agent keeps it. Each merged
+    change gets the chunk it came from and the `offset` of its original text in `text`, the
+    text this pass edited (None if it cannot be located); rebase_offsets moves them onto
+    the student's text.
+    Scores are averaged weighted by chunk length.
+    Returns (results, chunks_reused, llm_calls).
+    """
+    reuse = {} if reuse is None else reuse
+    paragraphs = _grammar_chunks(text, max_chars)
+    chunks = [chunk for paragraph in paragraphs for chunk in paragraph]
+    if not chunks:
+        return {"edited_text": text, "changes": [], "grammar_score": 0, "style_score": 0}, 0, 0
+    keys = [text_hash(chunk + "\0" + context) for chunk in chunks]
+    pending = {key: chunk for key, chunk in zip(keys, chunks) if key not in reuse}
+    reused = len(chunks) - sum(1 for key in keys if key in pending)
+    if pending:
+        workers = max(1, min(max_workers or GRAMMAR_CONCURRENCY, len(pending)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {key: submit(executor, grammar_and_style_agent_llm, chunk, context) for key, chunk in pending.items()}
+            for key, future in futures.items():
+                reuse[key] = result = future.result()
+                # The next pass gets this chunk back as edited whenever the voice agent keeps
+                # it; editing the agent's own output again would only repeat this result.
+                own = (result.get("edited_text") or "").strip()
+                if own and not result.get("output_error"):
+                    reuse.setdefault(text_hash(own + "\0" + context), result)
+    results = [reuse[key] for key in keys]
+
+    edited, position = [], 0
+    for paragraph in paragraphs:
+        edited.append(" ".join((r.get("edited_text") or chunk).strip()
+                               for r, chunk in zip(results[position:position + len(paragraph)], paragraph)))
+        position += len(paragraph)
+    changes = []
+    for index, (chunk, start, result) in enumerate(zip(chunks, _locate_chunks(text, chunks), results)):
+        for change in result.get("changes", []):
+            change = dict(change)
+            found = text.find(change.get("original") or "\0", start) if start is not None else -1
+            change["chunk"] = index
+            # Only trust a match inside this chunk, not a repeat of the phrase further on.
+            change["offset"] = found if start is not None and start <= found < start + len(chunk) else None
+            changes.append(change)
+    weights = [len(chunk) for chunk in chunks]
+    merged = {
+        "edited_text": "\n\n".join(edited),
+        "changes": changes,
+        "grammar_score": round(sum(r.get("grammar_score", 0) * w for r, w in zip(results, weights)) / sum(weights), 2),
+        "style_score": round(sum(r.get("style_score", 0) * w for r, w in zip(results, weights)) / sum(weights), 2),
+    }
+    if any(r.get("output_error") for r in results):
+        merged["output_error"] = "; ".join(r["output_error"] for r in results if r.get("output_error"))
+    return merged, reused, len(pending)
+
+def rebase_offsets(changes: list, edited_from: str, full_text: str) -> list:
+    """
+    Point each change's `offset` at its original text in the student's `full_text`, searching
+    the span that the change's chunk of `edited_from` (the text the grammar pass edited)
+    came from. Changes reused from an earlier pass are found this way too; an original
+    that no longer occurs there (e.g. words the voice agent added) gets None.
+    """
+    chunks = [chunk for paragraph in _grammar_chunks(edited_from) for chunk in paragraph]
+    starts = _locate_chunks(edited_from, chunks)
+    blocks = difflib.SequenceMatcher(None, edited_from, full_text, autojunk=False).get_matching_blocks()
+
+    def to_full(position):
+        # The matching block at or before `position`, extended by the distance into it.
+        return next((b + min(position - a, size) for a, b, size in reversed(blocks) if a <= position), 0)
+
+    rebased, cursors = [], {}
+    for change in changes:
+        change, index = dict(change), change.get("chunk")
+        original = change.get("original") or ""
+        offset = None
+        if original and index is not None and index < len(chunks) and starts[index] is not None:
+            low, high = to_full(starts[index]), to_full(starts[index] + len(chunks[index]))
+            # Repeats of a phrase within a chunk map to successive occurrences.
+            found = full_text.find(original, max(low, cursors.get(index, low)), max(high, low) + len(original))
+            if found != -1:
+                offset = found
+                cursors[index] = found + 1
+        change["offset"] = offset
+        rebased.append(change)
+    return rebased
 
 def voice_preservation_agent_llm(original_text: str, edited_text: str, context: str = "") -> dict:
     prompt = (
@@ -37,13 +230,7 @@ def voice_preservation_agent_llm(original_text: str, edited_text: str, context:
         "Original Text:\n" + original_text + "\n\n"
         "Edited Text:\n" + edited_text
     )
-    output_text = llm_call(prompt)
-    # Strip markdown code block delimiters if present
-    if output_text.startswith("```json"):
-        output_text = output_text[len("```json"):].strip()
-    if output_text.endswith("```"):
-        output_text = output_text[:-3].strip()
-    return json.loads(output_text)
+    return call_json_agent(prompt, VOICE_SCHEMA, fallback={"final_text": edited_text, "voice_score": 0, "voice_feedback": ""}, task="voice")
 
 def personalized_feedback_agent_llm(metadata: dict, text: str, context: str = "") -> dict:
     prompt = (
@@ -52,166 +239,167 @@ def personalized_feedback_agent_llm(metadata: dict, text: str, context: str = ""
         "Analytic Writing Continuum as your reference. Return your output as JSON with keys 'feedback_message' and "
         "'personalized_score' (0-100).\n\n"
         "Student Metadata:\n" + json.dumps(metadata, indent=2) + "\n\n"
-        "Writing Sample:\n" + text
+        + ("Notes From Earlier Submissions (build on these; mention progress where you see it):\n" + context + "\n\n"
+           if context else "")
+        + "Writing Sample:\n" + text
     )
-    output_text = llm_call(prompt)
-    # Strip markdown code block delimiters if present
-    if output_text.startswith("```json"):
-        output_text = output_text[len("```json"):].strip()
-    if output_text.endswith("```"):
-        output_text = output_text[:-3].strip()
-    return json.loads(output_text)
+    return call_json_agent(prompt, FEEDBACK_SCHEMA, fallback={"feedback_message": "", "personalized_score": 0}, task="feedback")
+
+# Upper bound on rubric agents sent to Ollama at the same time.
+METRICS_CONCURRENCY = int(os.environ.get("WRITING_METRICS_CONCURRENCY", "6"))
+# "separate" sends one prompt per rubric dimension; "fused" scores all six in one prompt
+# (the story is sent once) and falls back to the separate agent for any bad dimension.
+METRICS_MODE = os.environ.get("WRITING_METRICS_MODE", "separate").lower()
 
 # -------------------------------
 # Dynamic Helper Agents for Writing Metrics
 # Each helper is provided the full detailed criteria for its category.
 # -------------------------------
 
+CONTENT_RUBRIC = (
+    "Rubric for Content (Including Quality and Clarity of Ideas and Meaning):\n"
+    "1. The writing may announce the topic, but no central focus is present; ideas are minimal or undeveloped.\n"
+    "2. The writing presents several ideas without a clear focus; ideas are confusing or incidental.\n"
+    "3. The writing has a discernible focus; ideas somewhat support the central theme, but details are poorly developed.\n"
+    "4. The writing is generally clear and focused; ideas satisfactorily support the theme, though predictable.\n"
+    "5. The writing is clear and focused; ideas enhance the theme with developed details and creativity.\n"
+    "6. The writing is clear, consistently focused, and exceptionally well developed; ideas fully support the theme with creativity.\n"
+)
+
 def content_metrics_agent_llm(text: str, context: str = "") -> dict:
-    rubric = (
-        "Rubric for Content (Including Quality and Clarity of Ideas and Meaning):\n"
-        "1. The writing may announce the topic, but no central focus is present; ideas are minimal or undeveloped.\n"
-        "2. The writing presents several ideas without a clear focus; ideas are confusing or incidental.\n"
-        "3. The writing has a discernible focus; ideas somewhat support the central theme, but details are poorly developed.\n"
-        "4. The writing is generally clear and focused; ideas satisfactorily support the theme, though predictable.\n"
-        "5. The writing is clear and focused; ideas enhance the theme with developed details and creativity.\n"
-        "6. The writing is clear, consistently focused, and exceptionally well developed; ideas fully support the theme with creativity.\n"
-    )
-    prompt = (
-        "You are an expert evaluator for the 'Content' dimension using the following rubric:\n"
-        f"{rubric}\n"
-        "Evaluate the following student writing on Content. Return a JSON object with keys 'score' (1-6) and 'comment'.\n\n"
-        "Student Writing:\n" + text
-    )
-    output_text = llm_call(prompt)
-    # Strip markdown code block delimiters if present
-    if output_text.startswith("```json"):
-        output_text = output_text[len("```json"):].strip()
-    if output_text.endswith("```"):
-        output_text = output_text[:-3].strip()
-    return json.loads(output_text)
+    prompt = _rubric_prompt("Content", CONTENT_RUBRIC, text)
+    return call_json_agent(prompt, RUBRIC_SCHEMA, fallback=RUBRIC_FALLBACK, task="rubric")
+
+STRUCTURE_RUBRIC = (
+    "Rubric for Structure:\n"
+    "1. Lacks direction; structure is absent or chaotic.\n"
+    "2. Organization is inadequate; loosely connected events or details, weak openings/closures.\n"
+    "3. Minimally adequate; formulaic or inconsistent structure with mechanical openings/closures.\n"
+    "4. Satisfactorily developed; clear opening and closure, though predictable.\n"
+    "5. Well shaped; strong organization with consistent flow and effective transitions.\n"
+    "6. Exceptionally well structured; compelling, seamless organization with outstanding resolution.\n"
+)
 
 def structure_metrics_agent_llm(text: str, context: str = "") -> dict:
-    rubric = (
-        "Rubric for Structure:\n"
-        "1. Lacks direction; structure is absent or chaotic.\n"
-        "2. Organization is inadequate; loosely connected events or details, weak openings/closures.\n"
-        "3. Minimally adequate; formulaic or inconsistent structure with mechanical openings/closures.\n"
-        "4. Satisfactorily developed; clear opening and closure, though predictable.\n"
-        "5. Well shaped; strong organization with consistent flow and effective transitions.\n"
-        "6. Exceptionally well structured; compelling, seamless organization with outstanding resolution.\n"
-    )
-    prompt = (
-        "You are an expert evaluator for the 'Structure' dimension using the following rubric:\n"
-        f"{rubric}\n"
-        "Evaluate the following student writing on Structure. Return a JSON object with keys 'score' (1-6) and 'comment'.\n\n"
-        "Student Writing:\n" + text
-    )
-    output_text = llm_call(prompt)
-    # Strip markdown code block delimiters if present
-    if output_text.startswith("```json"):
-        output_text = output_text[len("```json"):].strip()
-    if output_text.endswith("```"):
-        output_text = output_text[:-3].strip()
-    return json.loads(output_text)
+    prompt = _rubric_prompt("Structure", STRUCTURE_RUBRIC, text)
+    return call_json_agent(prompt, RUBRIC_SCHEMA, fallback=RUBRIC_FALLBACK, task="rubric")
+
+STANCE_RUBRIC = (
+    "Rubric for Stance (Tone and Style):\n"
+    "1. Demonstrates no clear perspective; tone is flat and inappropriate.\n"
+    "2. Weak perspective; tone and style are not clearly defined.\n"
+    "3. Sporadic demonstration of a clear perspective; uneven tone.\n"
+    "4. Adequate perspective; tone is acceptable for purpose.\n"
+    "5. Convincing perspective; tone adds interest and is appropriate.\n"
+    "6. Consistently powerful perspective; distinctive and sophisticated tone.\n"
+)
 
 def stance_metrics_agent_llm(text: str, context: str = "") -> dict:
-    rubric = (
-        "Rubric for Stance (Tone and Style):\n"
-        "1. Demonstrates no clear perspective; tone is flat and inappropriate.\n"
-        "2. Weak perspective; tone and style are not clearly defined.\n"
-        "3. Sporadic demonstration of a clear perspective; uneven tone.\n"
-        "4. Adequate perspective; tone is acceptable for purpose.\n"
-        "5. Convincing perspective; tone adds interest and is appropriate.\n"
-        "6. Consistently powerful perspective; distinctive and sophisticated tone.\n"
-    )
-    prompt = (
-        "You are an expert evaluator for the 'Stance' dimension using the following rubric:\n"
-        f"{rubric}\n"
-        "Evaluate the following student writing on Stance. Return a JSON object with keys 'score' (1-6) and 'comment'.\n\n"
-        "Student Writing:\n" + text
-    )
-    output_text = llm_call(prompt)
-    # Strip markdown code block delimiters if present
-    if output_text.startswith("```json"):
-        output_text = output_text[len("```json"):].strip()
-    if output_text.endswith("```"):
-        output_text = output_text[:-3].strip()
-    return json.loads(output_text)
-
-def sentence_fluency_agent_llm(text: str, context: str = "") -> dict:
-    rubric = (
-        "Rubric for Sentence Fluency:\n"
-        "1. Sentences are choppy or awkward; little flow.\n"
-        "2. Some structural issues causing confusion or unnatural phrasing.\n"
-        "3. Minimal flow; rigid or mechanical phrasing with little variation.\n"
-        "4. Some flow and rhythm; transitions are sometimes forced.\n"
-        "5. Generally rhythmic with effective variation; most sentences are clear.\n"
-        "6. Exceptionally fluid and varied; each sentence flows smoothly into the next.\n"
-    )
-    prompt = (
-        "You are an expert evaluator for the 'Sentence Fluency' dimension using the following rubric:\n"
-        f"{rubric}\n"
-        "Evaluate the following student writing on Sentence Fluency. Return a JSON object with keys 'score' (1-6) and 'comment'.\n\n"
-        "Student Writing:\n" + text
-    )
-    output_text = llm_call(prompt)
-    # Strip markdown code block delimiters if present
-    if output_text.startswith("```json"):
-        output_text = output_text[len("```json"):].strip()
-    if output_text.endswith("```"):
-        output_text = output_text[:-3].strip()
-    return json.loads(output_text)
-
-def diction_metrics_agent_llm(text: str, context: str = "") -> dict:
-    rubric = (
-        "Rubric for Diction (Language):\n"
-        "1. Vocabulary is limited; redundant or incorrectly used words; no imagery.\n"
-        "2. Occasional clarity, but with vague or incorrect expressions; little imagery.\n"
-        "3. Sometimes clear and precise; mostly simple language with occasional imagery.\n"
-        "4. Generally clear and appropriate; some variety but predictable imagery.\n"
-        "5. Vivid and precise language; creative and effective imagery.\n"
-        "6. Consistently powerful and varied language; imagery is consistently effective.\n"
-    )
-    prompt = (
-        "You are an expert evaluator for the 'Diction' dimension using the following rubric:\n"
-        f"{rubric}\n"
-        "Evaluate the following student writing on Diction. Return a JSON object with keys 'score' (1-6) and 'comment'.\n\n"
-        "Student Writing:\n" + text
-    )
-    output_text = llm_call(prompt)
-    # Strip markdown code block delimiters if present
-    if output_text.startswith("```json"):
-        output_text = output_text[len("```json"):].strip()
-    if output_text.endswith("```"):
-        output_text = output_text[:-3].strip()
-    return json.loads(output_text)
-
-def conventions_metrics_agent_llm(text: str, context: str = "") -> dict:
-    rubric = (
-        "Rubric for Conventions:\n"
-        "1. Many errors; spelling, usage, punctuation, capitalization, and formatting are poor.\n"
-        "2. Several errors that show struggle with basic conventions; extensive editing needed.\n"
-        "3. Limited control over conventions; moderate editing required.\n"
-        "4. Reasonable control with minor errors; basic conventions mostly followed.\n"
-        "5. Few errors; effective control over conventions with some stylistic use.\n"
-        "6. Almost error-free; outstanding control of conventions used intentionally for style.\n"
-    )
+    prompt = _rubric_prompt("Stance", STANCE_RUBRIC, text)
+    return call_json_agent(prompt, RUBRIC_SCHEMA, fallback=RUBRIC_FALLBACK, task="rubric")
+
+SENTENCE_FLUENCY_RUBRIC = (
+    "Rubric for Sentence Fluency:\n"
+    "1. Sentences are choppy or awkward; little flow.\n"
+    "2. Some structural issues causing confusion or unnatural phrasing.\n"
+    "3. Minimal flow; rigid or mechanical phrasing with little variation.\n"
+    "4. Some flow and rhythm; transitions are sometimes forced.\n"
+    "5. Generally rhythmic with effective variation; most sentences are clear.\n"
+    "6. Exceptionally fluid and varied; each sentence flows smoothly into the next.\n"
+)
+
+def sentence_fluency_agent_llm(text: str, context: str = "", hints: str = "") -> dict:
+    prompt = _rubric_prompt("Sentence Fluency", SENTENCE_FLUENCY_RUBRIC, text, hints)
+    return call_json_agent(prompt, RUBRIC_SCHEMA, fallback=RUBRIC_FALLBACK, task="rubric")
+
+DICTION_RUBRIC = (
+    "Rubric for Diction (Language):\n"
+    "1. Vocabulary is limited; redundant or incorrectly used words; no imagery.\n"
+    "2. Occasional clarity, but with vague or incorrect expressions; little imagery.\n"
+    "3. Sometimes clear and precise; mostly simple language with occasional imagery.\n"
+    "4. Generally clear and appropriate; some variety but predictable imagery.\n"
+    "5. Vivid and precise language; creative and effective imagery.\n"
+    "6. Consistently powerful and varied language; imagery is consistently effective.\n"
+)
+
+def diction_metrics_agent_llm(text: str, context: str = "", hints: str = "") -> dict:
+    prompt = _rubric_prompt("Diction", DICTION_RUBRIC, text, hints)
+    return call_json_agent(prompt, RUBRIC_SCHEMA, fallback=RUBRIC_FALLBACK, task="rubric")
+
+CONVENTIONS_RUBRIC = (
+    "Rubric for Conventions:\n"
+    "1. Many errors; spelling, usage, punctuation, capitalization, and formatting are poor.\n"
+    "2. Several errors that show struggle with basic conventions; extensive editing needed.\n"
+    "3. Limited control over conventions; moderate editing required.\n"
+    "4. Reasonable control with minor errors; basic conventions mostly followed.\n"
+    "5. Few errors; effective control over conventions with some stylistic use.\n"
+    "6. Almost error-free; outstanding control of conventions used intentionally for style.\n"
+)
+
+def conventions_metrics_agent_llm(text: str, context: str = "", hints: str = "") -> dict:
+    prompt = _rubric_prompt("Conventions", CONVENTIONS_RUBRIC, text, hints)
+    return call_json_agent(prompt, RUBRIC_SCHEMA, fallback=RUBRIC_FALLBACK, task="rubric")
+
+# -------------------------------
+# Fused Rubric Agent
+# One prompt carrying all six rubrics, answered with one JSON object keyed by dimension.
+# -------------------------------
+RUBRIC_DIMENSIONS = [
+    ("content", "Content", CONTENT_RUBRIC),
+    ("structure", "Structure", STRUCTURE_RUBRIC),
+    ("stance", "Stance", STANCE_RUBRIC),
+    ("sentence_fluency", "Sentence Fluency", SENTENCE_FLUENCY_RUBRIC),
+    ("diction", "Diction", DICTION_RUBRIC),
+    ("conventions", "Conventions", CONVENTIONS_RUBRIC),
+]
+
+FUSED_RUBRIC_SCHEMA = {
+    "type": "object",
+    "properties": {key: RUBRIC_SCHEMA for key, _, _ in RUBRIC_DIMENSIONS},
+    "required": [key for key, _, _ in RUBRIC_DIMENSIONS],
+}
+
+def fused_metrics_agent_llm(text: str, context: str = "", text_stats: dict = None) -> dict:
+    text_stats = text_stats or analyze_text(text)
+    sections = []
+    for key, label, rubric in RUBRIC_DIMENSIONS:
+        hints = format_hints(text_stats, key)
+        sections.append(f"[{key}] {label}\n{rubric}" + ("Measured statistics:\n" + hints + "\n" if hints else ""))
     prompt = (
-        "You are an expert evaluator for the 'Conventions' dimension using the following rubric:\n"
-        f"{rubric}\n"
-        "Evaluate the following student writing on Conventions. Return a JSON object with keys 'score' (1-6) and 'comment'.\n\n"
+        "You are an expert evaluator using the NWP Analytic Writing Continuum. Score the student writing below on "
+        "each of the six dimensions, using that dimension's rubric. The measured statistics are exact; use them "
+        "rather than recounting. Return one JSON object with the keys "
+        + ", ".join(f"'{key}'" for key, _, _ in RUBRIC_DIMENSIONS)
+        + ", each an object with 'score' (1-6) and a one or two sentence 'comment'.\n\n"
+        + "\n".join(sections) + "\n"
         "Student Writing:\n" + text
     )
-    output_text = llm_call(prompt)
-    # Strip markdown code block delimiters if present
-    if output_text.startswith("```json"):
-        output_text = output_text[len("```json"):].strip()
-    if output_text.endswith("```"):
-        output_text = output_text[:-3].strip()
-    return json.loads(output_text)
-
-def evaluate_writing_metrics(text: str, context: str = "") -> dict:
+    # One attempt only: a dimension that comes back unusable is re-asked on its own.
+    return call_json_agent(prompt, FUSED_RUBRIC_SCHEMA, fallback={}, max_attempts=1, task="rubric")
+
+def _run_rubric_agents(names: list, text: str, context: str, text_stats: dict, max_workers: int = None) -> dict:
+    agents = {
+        "content": content_metrics_agent_llm,
+        "structure": structure_metrics_agent_llm,
+        "stance": stance_metrics_agent_llm,
+        "sentence_fluency": sentence_fluency_agent_llm,
+        "diction": diction_metrics_agent_llm,
+        "conventions": conventions_metrics_agent_llm,
+    }
+    hinted = {"sentence_fluency", "diction", "conventions"}
+    if not names:
+        return {}
+    workers = max(1, min(max_workers or METRICS_CONCURRENCY, len(names)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            name: submit(executor, traced(name)(agents[name]), text, context, format_hints(text_stats, name))
+            if name in hinted else submit(executor, traced(name)(agents[name]), text, context)
+            for name in names
+        }
+        return {name: future.result() for name, future in futures.items()}
+
+def evaluate_writing_metrics(text: str, context: str = "", max_workers: int = None, text_stats: dict = None,
+                             mode: str = None) -> dict:
     """
     Calls all the helper agents to evaluate writing metrics.
     Aggregates the scores and comments from:
@@ -221,40 +409,93 @@ def evaluate_writing_metrics(text: str, context: str = "") -> dict:
       - Sentence Fluency
       - Diction
       - Conventions
+    The agents are independent, so they run concurrently on a thread pool capped at
+    `max_workers` (defaults to METRICS_CONCURRENCY). Sentence Fluency, Diction and
+    Conventions also receive the matching `text_stats` figures as hints (computed here
+    when not given).
+    With `mode="fused"` (default: METRICS_MODE) one prompt scores every dimension, and
+    only the dimensions it got wrong are sent to their own agents.
     Returns a dictionary with individual results and an overall average score.
     """
-    content = content_metrics_agent_llm(text, context)
-    structure = structure_metrics_agent_llm(text, context)
-    stance = stance_metrics_agent_llm(text, context)
-    fluency = sentence_fluency_agent_llm(text, context)
-    diction = diction_metrics_agent_llm(text, context)
-    conventions = conventions_metrics_agent_llm(text, context)
+    text_stats = text_stats or analyze_text(text)
+    mode = mode or METRICS_MODE
+    names = [key for key, _, _ in RUBRIC_DIMENSIONS]
+    results = {}
+    if mode == "fused":
+        fused = traced("fused_rubric")(fused_metrics_agent_llm)(text, context, text_stats)
+        for name in names:
+            try:
+                if not isinstance(fused.get(name), dict):
+                    raise StructuredOutputError(f"Missing dimension '{name}'")
+                results[name] = validate_output(fused[name], RUBRIC_SCHEMA)
+            except StructuredOutputError:
+                continue
+    fallbacks = [name for name in names if name not in results]
+    results.update(_run_rubric_agents(fallbacks, text, context, text_stats, max_workers))
     
     # Aggregate scores (average)
     scores = []
-    for res in [content, structure, stance, fluency, diction, conventions]:
+    for name in names:
         try:
-            scores.append(float(res.get("score", 0)))
+            scores.append(float(results[name].get("score", 0)))
         except Exception:
             scores.append(0)
     overall = round(sum(scores) / len(scores), 2) if scores else 0
+    comment = "Average score across all dimensions."
+    if mode == "fused":
+        comment += (f" Scored in one fused prompt; re-asked separately: {', '.join(fallbacks)}."
+                    if fallbacks else " Scored in one fused prompt.")
     
-    return {
-        "Content": content,
-        "Structure": structure,
-        "Stance": stance,
-        "Sentence Fluency": fluency,
-        "Diction": diction,
-        "Conventions": conventions,
-        "Overall": {"score": overall, "comment": "Average score across all dimensions."}
-    }
+    report = {label: results[key] for key, label, _ in RUBRIC_DIMENSIONS}
+    report["Overall"] = {"score": overall, "comment": comment}
+    return report
 
 # -------------------------------
 # Helper: Dynamic Text Modification
 # -------------------------------
+VOICE_NOTE = "Ensure that informal and creative expressions are preserved in your revisions."
+
 def modify_text_for_voice(text: str, vp_results: dict) -> str:
-    note = " [Ensure that informal and creative expressions are preserved in your revisions.]"
-    return text + note
+    # The next pass edits the voice agent's adjusted text; the voice note travels as
+    # context for the grammar agent instead of being appended to the student's text.
+    return vp_results.get("final_text") or text
+
+# -------------------------------
+# Helper: Voice Loop Convergence
+# -------------------------------
+VOICE_TARGET_SCORE = 90
+# Edited texts at least this similar (difflib ratio) count as converged.
+CONVERGENCE_SIMILARITY = 0.98
+# After this many passes, a voice-score gain below PLATEAU_MIN_GAIN ends the loop.
+PLATEAU_MIN_ITERATIONS = 2
+PLATEAU_MIN_GAIN = 5
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.strip().encode("utf-8")).hexdigest()
+
+def loop_stop_reason(state: dict, final_text: str, voice_score: float, edited_text: str = None):
+    """
+    Decide whether the grammar -> voice -> modify loop should end after this pass.
+    Returns the reason as a string, or None to keep iterating.
+    """
+    iteration = state.get("iteration_count", 0) + 1
+    if voice_score >= VOICE_TARGET_SCORE:
+        return "voice_target_reached"
+    if iteration >= state.get("max_iterations", 5):
+        return "max_iterations"
+    # The voice agent kept the grammar agent's text: another pass would re-edit the grammar
+    # agent's own output and ask the voice agent the same question again.
+    if edited_text is not None and text_hash(edited_text) == text_hash(final_text):
+        return "fixed_point"
+    previous_text = state.get("prev_final_text")
+    if previous_text is not None:
+        if text_hash(previous_text) == text_hash(final_text):
+            return "fixed_point"
+        if difflib.SequenceMatcher(None, previous_text, final_text).ratio() >= CONVERGENCE_SIMILARITY:
+            return "text_converged"
+    if iteration >= PLATEAU_MIN_ITERATIONS and voice_score - state.get("prev_voice_score", 0) < PLATEAU_MIN_GAIN:
+        return "score_plateau"
+    return None
 
 # -------------------------------
 # Build Workflow Graph Using LangGraph StateGraph API
@@ -262,84 +503,160 @@ def modify_text_for_voice(text: str, vp_results: dict) -> str:
 # We define nodes for grammar, voice, modify, feedback, and metrics.
 # The conditional edge from the voice node checks the voice score to decide if we should loop or continue.
 # This is our final concrete workflow.
-from langgraph.graph import StateGraph  # Using StateGraph from LangGraph
 
 # Define the State schema for our workflow.
-# For simplicity, we use a Python dict; in production you might use a TypedDict.
-State = dict
+# Each key is its own channel so that the parallel feedback and metrics branches
+# can write their results in the same step without clobbering each other.
+class State(TypedDict, total=False):
+    metadata: dict
+    full_text: str
+    current_text: str
+    prior_context: str
+    gs_results: dict
+    vp_results: dict
+    iteration_logs: list
+    prev_voice_score: float
+    prev_final_text: str
+    iteration_count: int
+    max_iterations: int
+    stop_reason: str
+    pf_results: dict
+    wm_results: dict
+    text_stats: dict
+    grammar_chunks: dict
+    grammar_chunks_reused: int
+    grammar_chunk_count: int
+    grammar_llm_calls: int
+
+def _grammar_context(state: State) -> str:
+    # The same on every pass and every rerun of a submission (the history leaves out its
+    # earlier drafts), so chunk results and cached chunk prompts are reusable.
+    return (state.get("prior_context", "") + "\n" + VOICE_NOTE).strip()
 
+@traced("grammar")
 def grammar_node(state: State) -> State:
-    # Call the grammar agent.
-    state["gs_results"] = grammar_and_style_agent_llm(state["current_text"], state.get("prior_context", ""))
+    # Chunks unchanged since an earlier pass are taken from grammar_chunks.
+    chunk_results = dict(state.get("grammar_chunks", {}))
+    state["gs_results"], state["grammar_chunks_reused"], state["grammar_llm_calls"] = edit_in_chunks(
+        state["current_text"], _grammar_context(state), chunk_results)
+    state["grammar_chunks"] = chunk_results
+    state["grammar_chunk_count"] = sum(len(paragraph) for paragraph in _grammar_chunks(state["current_text"]))
     return state
 
+@traced("voice")
 def voice_node(state: State) -> State:
     # Call the voice preservation agent.
-    state["vp_results"] = voice_preservation_agent_llm(state["full_text"], state["gs_results"].get("edited_text", state["current_text"]), state.get("prior_context", ""))
+    edited_text = state["gs_results"].get("edited_text", state["current_text"])
+    state["vp_results"] = voice_preservation_agent_llm(state["full_text"], edited_text, state.get("prior_context", ""))
+    final_text = state["vp_results"].get("final_text") or edited_text
+    voice_score = state["vp_results"].get("voice_score", 0)
+    state["stop_reason"] = loop_stop_reason(state, final_text, voice_score, edited_text)
+
+    # Log the pass together with its LLM cost.
+    state["iteration_logs"] = state.get("iteration_logs", []) + [{
+        "iteration": state.get("iteration_count", 0) + 1,
+        "input_text": state["current_text"],
+        "edited_text": edited_text,
+        "final_text": final_text,
+        "text_hash": text_hash(final_text),
+        "voice_score": voice_score,
+        "grammar_changes": state["gs_results"].get("changes", []),
+        "llm_calls": state.get("grammar_llm_calls", 0) + 1,
+        "grammar_chunks_reused": state.get("grammar_chunks_reused", 0),
+        "grammar_chunk_count": state.get("grammar_chunk_count", 1),
+        "stop_reason": state["stop_reason"],
+    }]
+    state["prev_final_text"] = final_text
     return state
 
+@traced("modify")
 def modify_node(state: State) -> State:
-    # Store previous voice score if not already set
-    prev_score = state.get("prev_voice_score", 0)
-    current_score = state.get("vp_results", {}).get("voice_score", 0)
-    
-    # Update current text using a more aggressive modification
+    # Prepare the next pass.
     state["current_text"] = modify_text_for_voice(state["current_text"], state["vp_results"])
-    
-    # Log the iteration
-    if "iteration_logs" not in state:
-        state["iteration_logs"] = []
-    state["iteration_logs"].append({
-        "input_text": state["current_text"],
-        "edited_text": state["gs_results"].get("edited_text", state["current_text"]),
-        "voice_score": current_score,
-        "grammar_changes": state["gs_results"].get("changes", [])
-    })
-    
-    # Check if improvement is minimal
-    improvement = current_score - prev_score
-    state["prev_voice_score"] = current_score  # Update for next iteration
-    # If improvement is less than 5 and we've iterated at least twice, break out by setting a flag.
-    if state.get("iteration_count", 0) >= 2 and improvement < 5:
-        state["force_stop"] = True
+    state["prev_voice_score"] = state["vp_results"].get("voice_score", 0)
+    state["iteration_count"] = state.get("iteration_count", 0) + 1
     return state
 
-
+# feedback and metrics run as parallel branches, so they return only the key they own.
+@traced("feedback")
 def feedback_node(state: State) -> State:
-    state["pf_results"] = personalized_feedback_agent_llm(state["metadata"], state["full_text"], state.get("prior_context", ""))
-    return state
+    return {"pf_results": personalized_feedback_agent_llm(state["metadata"], state["full_text"], state.get("prior_context", ""))}
 
+@traced("metrics")
 def metrics_node(state: State) -> State:
-    state["wm_results"] = evaluate_writing_metrics(state["full_text"], state.get("prior_context", ""))
-    return state
+    return {"wm_results": evaluate_writing_metrics(state["full_text"], state.get("prior_context", ""),
+                                                   text_stats=state.get("text_stats"))}
 
 # Define condition function for looping.
 def voice_condition(state: State) -> bool:
-    # Exit if voice score is at least 80 OR if force_stop is set.
-    return state.get("vp_results", {}).get("voice_score", 0) >= 90 or state.get("force_stop", False)
-
-# Build the StateGraph.
-graph_builder = StateGraph(State)
-graph_builder.add_node("grammar", grammar_node)
-graph_builder.add_node("voice", voice_node)
-graph_builder.add_node("modify", modify_node)
-graph_builder.add_node("feedback", feedback_node)
-graph_builder.add_node("metrics", metrics_node)
-
-# Define edges:
-graph_builder.add_edge(START, "grammar")
-graph_builder.add_edge("grammar", "voice")
-# Use conditional edges from voice node:
-def route_from_voice(state: State) -> str:
-    return "modify" if voice_condition(state) else "feedback"
-graph_builder.add_conditional_edges("voice", route_from_voice)
-graph_builder.add_edge("modify", "grammar")
-graph_builder.add_edge("feedback", "metrics")
-graph_builder.add_edge("metrics", END)
-
-# Compile the graph with a checkpointer.
-memory = MemorySaver()
-graph = graph_builder.compile(checkpointer=memory)
+    # Exit once loop_stop_reason found a reason: target score, iteration budget,
+    # fixed point, converged text or plateaued score.
+    return bool(state.get("stop_reason"))
+
+# Leaving the loop fans out to feedback and metrics, which read only the original text.
+def route_from_voice(state: State):
+    return ["feedback", "metrics"] if voice_condition(state) else "modify"
+
+def build_graph(checkpointer=None):
+    """Build and compile the StateGraph. LangGraph is imported here, not at module import."""
+    from langgraph.graph import START, END, StateGraph
+
+    graph_builder = StateGraph(State)
+    graph_builder.add_node("grammar", grammar_node)
+    graph_builder.add_node("voice", voice_node)
+    graph_builder.add_node("modify", modify_node)
+    graph_builder.add_node("feedback", feedback_node)
+    graph_builder.add_node("metrics", metrics_node)
+
+    # Define edges:
+    graph_builder.add_edge(START, "grammar")
+    graph_builder.add_edge("grammar", "voice")
+    # Use conditional edges from voice node:
+    graph_builder.add_conditional_edges("voice", route_from_voice, ["modify", "feedback", "metrics"])
+    graph_builder.add_edge("modify", "grammar")
+    # Both branches join before END.
+    graph_builder.add_edge(["feedback", "metrics"], END)
+    return graph_builder.compile(checkpointer=checkpointer)
+
+_workflow = None
+_workflow_lock = threading.Lock()
+
+def get_workflow():
+    """
+    Return (graph, thread_registry), compiling the graph on first use so that importing
+    this module stays cheap for scripts and the CLI.
+    Checkpoints live on disk, one thread per submission, so an interrupted run can resume.
+    """
+    global _workflow
+    if _workflow is None:
+        with _workflow_lock:
+            if _workflow is None:
+                memory = make_checkpointer()
+                _workflow = (build_graph(memory), ThreadRegistry(memory))
+    return _workflow
+
+def _has_output_errors(values: dict) -> bool:
+    # A finished run whose agents fell back is redone rather than served again; the
+    # malformed replies were already evicted from the response cache.
+    results = [values.get(key, {}) for key in ("gs_results", "vp_results", "pf_results", "wm_results")]
+    # Rubric dimensions report their errors one level down in wm_results.
+    results += [value for value in values.get("wm_results", {}).values() if isinstance(value, dict)]
+    return any(result.get("output_error") for result in results)
+
+def summarize_loop(iteration_logs: list, max_iterations: int) -> dict:
+    """Totals for the voice loop, including LLM calls saved against running the full budget."""
+    llm_calls = sum(entry.get("llm_calls", 0) for entry in iteration_logs)
+    # Without early stops or chunk reuse, a pass calls the grammar agent once per chunk and
+    # the voice agent once; passes that never ran would have cost what the last one did.
+    passes = [entry.get("grammar_chunk_count", 1) + 1 for entry in iteration_logs]
+    full_budget = sum(passes) + max(0, max_iterations - len(passes)) * (passes[-1] if passes else 2)
+    return {
+        "Iterations": len(iteration_logs),
+        "StopReason": iteration_logs[-1].get("stop_reason") if iteration_logs else None,
+        "LLMCalls": llm_calls,
+        "GrammarChunksReused": sum(entry.get("grammar_chunks_reused", 0) for entry in iteration_logs),
+        "LLMCallsSaved": max(0, full_budget - llm_calls),
+    }
 
 # -------------------------------
 # Orchestrator: Execute Workflow Using LangGraph's invoke API
@@ -349,28 +666,66 @@ def run_workflow(ocr_json: dict, max_iterations: int = 5, context_dir="context_s
     title = ocr_json.get("Title", "").strip()
     story = ocr_json.get("Story", "").strip()
     full_text = (title + "\n\n" + story).strip()
-    prior_context = ""
+    # Local statistics need no LLM, so they are ready before the first agent runs.
+    text_stats = analyze_text(full_text)
+    
+    # The thread id is derived from the submission, so a rerun finds its own checkpoints.
+    thread_id = submission_thread_id(metadata, full_text, max_iterations)
+    # Relevant notes from the student's earlier submissions, kept within the history's token
+    # budget. Earlier drafts of this one (same submission_id from the caller, e.g. the image
+    # hash, or near-identical text) are not prior work, so a rerun builds the same prompts.
+    history = get_student_history(context_dir)
+    submission_id = ocr_json.get("submission_id")
+    prior_context, history_entries = history.context_for(metadata, full_text, submission_id=submission_id)
     
     # Prepare initial state.
     state = {
         "metadata": metadata,
         "full_text": full_text,
         "current_text": full_text,
-        "prior_context": prior_context
+        "prior_context": prior_context,
+        "max_iterations": max(1, max_iterations),
+        "text_stats": text_stats,
+        # A new run on a thread that already completed would otherwise continue its loop.
+        "iteration_logs": [],
+        "iteration_count": 0,
+        "prev_voice_score": 0,
+        "prev_final_text": None,
+        "stop_reason": None,
+        "grammar_chunks": {},
     }
     
-    # Provide a config with required keys and increase recursion_limit.
+    # Provide a config with required keys. Each loop pass takes three steps, and the
+    # iteration budget is enforced by loop_stop_reason, so this is only a safety net.
     config = {
-        "recursion_limit": 25,
+        "recursion_limit": max(25, 3 * max_iterations + 5),
         "configurable": {
-            "thread_id": "1",
+            "thread_id": thread_id,
             "checkpoint_ns": "",
-            "checkpoint_id": "1"
         }
     }
+    graph, thread_registry = get_workflow()
+    thread_registry.touch(thread_id)
     
-    # Invoke the graph with the configuration.
-    final_state = graph.invoke(state, config)
+    # Invoke the graph with the configuration, resuming from the last completed node
+    # if an earlier run of this submission was interrupted. Every node and LLM call
+    # inside is timed for the report's Timings section.
+    start = time.perf_counter()
+    with instrumentation.collect() as run_metrics:
+        snapshot = graph.get_state(config)
+        if snapshot.next:
+            final_state = graph.invoke(None, config)
+        elif ("pf_results" in snapshot.values and "wm_results" in snapshot.values
+              and not _has_output_errors(snapshot.values)):
+            final_state = snapshot.values
+        else:
+            final_state = graph.invoke(state, config)
+    total_seconds = round(time.perf_counter() - start, 4)
+    thread_registry.prune()
+    if instrumentation.METRICS_JSONL_PATH:
+        run_metrics.export_jsonl(instrumentation.METRICS_JSONL_PATH, run_id=thread_id)
+    if instrumentation.METRICS_PROMETHEUS_PATH:
+        instrumentation.process_metrics.export_prometheus(instrumentation.METRICS_PROMETHEUS_PATH)
     
     overall_score = (final_state["gs_results"].get("grammar_score", 0) * 0.3 +
                      final_state["gs_results"].get("style_score", 0) * 0.3 +
@@ -383,7 +738,10 @@ def run_workflow(ocr_json: dict, max_iterations: int = 5, context_dir="context_s
         "Timestamp": datetime.datetime.now().isoformat(),
         "FinalEditedText": final_state["vp_results"].get("final_text", full_text),
         "IterationLogs": final_state.get("iteration_logs", []),
-        "ChangeSuggestions": final_state["gs_results"].get("changes", []),
+        "LoopSummary": summarize_loop(final_state.get("iteration_logs", []), final_state["max_iterations"]),
+        # Offsets index full_text: the title, a blank line, then the story.
+        "ChangeSuggestions": rebase_offsets(final_state["gs_results"].get("changes", []),
+                                            final_state.get("current_text", full_text), full_text),
         "Feedback": {
             "VoicePreservation": final_state["vp_results"].get("voice_feedback", ""),
             "Personalized": final_state["pf_results"].get("feedback_message", "")
@@ -395,8 +753,23 @@ def run_workflow(ocr_json: dict, max_iterations: int = 5, context_dir="context_s
             "PersonalizedFeedback": final_state["pf_results"].get("personalized_score", 0),
             "Overall": overall_score
         },
-        "WritingMetrics": final_state.get("wm_results", {})
+        # Agents whose output was unusable; their scores above are fallback values.
+        "OutputErrors": {
+            name: results["output_error"]
+            for name, results in (("GrammarAndStyle", final_state["gs_results"]),
+                                  ("VoicePreservation", final_state["vp_results"]),
+                                  ("PersonalizedFeedback", final_state["pf_results"]))
+            if results.get("output_error")
+        },
+        "PriorContext": {"Entries": history_entries, "Tokens": estimate_tokens(prior_context) if prior_context else 0},
+        "TextStatistics": text_stats,
+        "WritingMetrics": final_state.get("wm_results", {}),
+        "Timings": {"TotalSeconds": total_seconds, **run_metrics.summary()}
     }
+    history.record(metadata, report, full_text, submission_id=submission_id)
+    # Flattened scores feed the trend aggregates. A re-analysis of this submission, edited
+    # or not, replaces its earlier report there; the thread id only identifies its text.
+    get_report_store().append(report, submission_id=submission_id or thread_id)
     return report
 
 # -------------------------------
@@ -1,10 +1,91 @@
-import subprocess
-from llm_call import llm_call
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-def extract_text_with_gemma3(file_path):
-    # Build the command as a string exactly as you use in the terminal
-    command = f"Extract the text from image without any initial or trailing text {file_path}"
-    return llm_call(command)
+import image_preprocessing
+from instrumentation import submit
+from llm_call import llm_call, llm_call_stream
+
+# Set EXTRACTION_PREPROCESS=0 to send the original file to the model unchanged.
+PREPROCESS = os.environ.get("EXTRACTION_PREPROCESS", "1").lower() not in ("0", "false", "no")
+# Upper bound on tiles sent to Ollama at the same time.
+EXTRACTION_CONCURRENCY = int(os.environ.get("EXTRACTION_CONCURRENCY", "4"))
+
+def _extraction_prompt(file_path):
+    return f"Extract the text from image without any initial or trailing text {file_path}"
+
+def _tile_prompt(tile_path, index: int, count: int):
+    if count == 1:
+        return _extraction_prompt(tile_path)
+    return (
+        f"This image is part {index} of {count} of a page, cut horizontally, so the first and last lines "
+        "may be cut off. " + _extraction_prompt(tile_path)
+    )
+
+def _extract_tiles(pages: list) -> str:
+    # Every tile of every page is extracted concurrently; results are stitched per page in order.
+    count = sum(len(tiles) for tiles in pages)
+    with ThreadPoolExecutor(max_workers=max(1, min(EXTRACTION_CONCURRENCY, count))) as executor:
+        futures = [
+            [submit(executor, llm_call, _tile_prompt(tile, i, len(tiles)), task="extraction")
+             for i, tile in enumerate(tiles, start=1)]
+            for tiles in pages
+        ]
+        texts = [[future.result() for future in page] for page in futures]
+    return "\n\n".join(image_preprocessing.stitch(page) for page in texts)
+
+def extract_text_with_gemma3(file_path, preprocess: bool = None):
+    """
+    Extract the text of an image or PDF. By default the file is first normalized and cut
+    into overlapping tiles (see image_preprocessing), which are extracted concurrently.
+    """
+    if not (PREPROCESS if preprocess is None else preprocess):
+        # Build the command as a string exactly as you use in the terminal
+        return llm_call(_extraction_prompt(file_path), task="extraction")
+    with tempfile.TemporaryDirectory(prefix="extraction-") as tile_dir:
+        return _extract_tiles(image_preprocessing.prepare_tiles(file_path, tile_dir))
+
+def _stream_page(tiles: list):
+    # The first tile streams token by token while the others are extracted concurrently;
+    # each of those is yielded in order once done. The words stitching may still trim or
+    # match against the next tile are held back until that tile arrives.
+    if len(tiles) == 1:
+        yield from llm_call_stream(_extraction_prompt(tiles[0]), task="extraction")
+        return
+    with ThreadPoolExecutor(max_workers=max(1, min(EXTRACTION_CONCURRENCY, len(tiles) - 1))) as executor:
+        rest = [submit(executor, llm_call, _tile_prompt(tile, i, len(tiles)), task="extraction")
+                for i, tile in enumerate(tiles[1:], start=2)]
+        tail = ""
+        for piece in llm_call_stream(_tile_prompt(tiles[0], 1, len(tiles)), task="extraction"):
+            settled, tail = image_preprocessing.hold_back_tail((tail + piece).lstrip())
+            if settled:
+                yield settled
+        for future in rest:
+            settled, tail = image_preprocessing.hold_back_tail(image_preprocessing.stitch_pair(tail, future.result()))
+            if settled:
+                yield settled
+        yield tail.strip()
+
+def extract_text_with_gemma3_stream(file_path, stats: dict = None, preprocess: bool = None):
+    # Same as extract_text_with_gemma3, but yields text as the model produces it, page by
+    # page and, for a page cut into tiles, tile by tile in reading order.
+    if not (PREPROCESS if preprocess is None else preprocess):
+        yield from llm_call_stream(_extraction_prompt(file_path), stats=stats, task="extraction")
+        return
+    with tempfile.TemporaryDirectory(prefix="extraction-") as tile_dir:
+        pages = image_preprocessing.prepare_tiles(file_path, tile_dir)
+        if len(pages) == 1 and len(pages[0]) == 1:
+            yield from llm_call_stream(_extraction_prompt(pages[0][0]), stats=stats, task="extraction")
+            return
+        stats = {} if stats is None else stats
+        start = time.perf_counter()
+        for number, tiles in enumerate(pages):
+            for index, piece in enumerate(_stream_page(tiles)):
+                if "ttft" not in stats:
+                    stats["ttft"] = time.perf_counter() - start
+                yield ("\n\n" if number and not index else "") + piece
+        stats["total_time"] = time.perf_counter() - start
 
 if __name__ == "__main__":
     file_path = "/Users/vineetarora/Desktop/word-weavers/test_img.png"
@@ -0,0 +1,224 @@
+import os
+import re
+
+import numpy as np
+
+from segmentation import PARAGRAPH_BREAK, SENTENCE_END
+
+# -------------------------------
+# Configuration
+# Local, LLM-free statistics for a story. They are exact and take milliseconds, so the app
+# can show them before any agent has answered and the rubric agents get them as hints.
+# -------------------------------
+MISSPELLINGS_PATH = os.environ.get(
+    "TEXT_STATS_MISSPELLINGS", os.path.join(os.path.dirname(os.path.abspath(__file__)), "common_misspellings.txt")
+)
+# Sentences longer than this (in words) are reported as run-on candidates.
+LONG_SENTENCE_WORDS = 30
+SHORT_SENTENCE_WORDS = 4
+# Content words used at least this often are reported as repeated.
+REPEATED_WORD_MIN_COUNT = 3
+REPEATED_WORDS_SHOWN = 8
+# Upper bounds of the sentence length histogram buckets; the last bucket is open-ended.
+LENGTH_BUCKETS = (5, 10, 20, 30)
+
+WORD = re.compile(r"[^\W\d_]+(?:['’][^\W\d_]+)*")
+
+STOPWORDS = frozenset("""
+a about after all also am an and any are as at be because been before but by can could did do does
+don't for from had has have he her him his how i i'm if in into is it it's its just like me my no not
+of on one or our out she so some than that the their them then there they this to up us very was we
+were what when where which who will with would you your
+""".split())
+
+def _load_misspellings(path: str = MISSPELLINGS_PATH) -> dict:
+    misspellings = {}
+    if not os.path.exists(path):
+        return misspellings
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#") and "->" in line:
+                wrong, right = line.split("->", 1)
+                misspellings[wrong.strip().lower()] = right.strip()
+    return misspellings
+
+MISSPELLINGS = _load_misspellings()
+
+# -------------------------------
+# Tokenization
+# -------------------------------
+def _tokenize(text: str):
+    """Return (sentence word counts, paragraph index per sentence, lowercased words) for one text."""
+    sentence_lengths, sentence_paragraphs, words = [], [], []
+    paragraphs = [p for p in PARAGRAPH_BREAK.split(text.strip()) if p.strip()]
+    for p_index, paragraph in enumerate(paragraphs):
+        for sentence in SENTENCE_END.split(paragraph.strip()):
+            tokens = [w.lower().replace("’", "'") for w in WORD.findall(sentence)]
+            if tokens:
+                sentence_lengths.append(len(tokens))
+                sentence_paragraphs.append(p_index)
+                words.extend(tokens)
+    return sentence_lengths, sentence_paragraphs, words
+
+# -------------------------------
+# Batch Analysis
+# All texts are tokenized once and their sentences and words concatenated into flat arrays,
+# so every statistic is a single bincount/unique over the whole batch.
+# -------------------------------
+def analyze_texts(texts: list) -> list:
+    """Compute text statistics for every text in `texts`; returns one dict per text, in order."""
+    n = len(texts)
+    if n == 0:
+        return []
+    lengths, sentence_doc, paragraph_ids, word_ids, word_doc = [], [], [], [], []
+    vocabulary = {}
+    paragraph_offset = 0
+    paragraph_doc = []
+    for doc, text in enumerate(texts):
+        doc_lengths, doc_paragraphs, doc_words = _tokenize(text or "")
+        lengths.extend(doc_lengths)
+        sentence_doc.extend([doc] * len(doc_lengths))
+        paragraph_ids.extend(paragraph_offset + p for p in doc_paragraphs)
+        doc_paragraph_count = (max(doc_paragraphs) + 1) if doc_paragraphs else 0
+        paragraph_doc.extend([doc] * doc_paragraph_count)
+        paragraph_offset += doc_paragraph_count
+        word_ids.extend(vocabulary.setdefault(w, len(vocabulary)) for w in doc_words)
+        word_doc.extend([doc] * len(doc_words))
+
+    lengths = np.asarray(lengths, dtype=np.float64)
+    sentence_doc = np.asarray(sentence_doc, dtype=np.int64)
+    paragraph_ids = np.asarray(paragraph_ids, dtype=np.int64)
+    paragraph_doc = np.asarray(paragraph_doc, dtype=np.int64)
+    word_ids = np.asarray(word_ids, dtype=np.int64)
+    word_doc = np.asarray(word_doc, dtype=np.int64)
+    words_by_id = np.array(list(vocabulary), dtype=object)
+
+    # Sentence length distribution per text.
+    sentence_count = np.bincount(sentence_doc, minlength=n)
+    length_sum = np.bincount(sentence_doc, weights=lengths, minlength=n)
+    length_sq_sum = np.bincount(sentence_doc, weights=lengths ** 2, minlength=n)
+    safe_count = np.maximum(sentence_count, 1)
+    mean = length_sum / safe_count
+    variance = np.maximum(length_sq_sum / safe_count - mean ** 2, 0.0)
+    long_count = np.bincount(sentence_doc, weights=lengths > LONG_SENTENCE_WORDS, minlength=n)
+    short_count = np.bincount(sentence_doc, weights=lengths <= SHORT_SENTENCE_WORDS, minlength=n)
+    length_min = np.full(n, np.inf)
+    length_max = np.zeros(n)
+    np.minimum.at(length_min, sentence_doc, lengths)
+    np.maximum.at(length_max, sentence_doc, lengths)
+    buckets = len(LENGTH_BUCKETS) + 1
+    bucket = np.searchsorted(np.asarray(LENGTH_BUCKETS), lengths, side="left")
+    histogram = np.bincount(sentence_doc * buckets + bucket, minlength=n * buckets).reshape(n, buckets)
+    bucket_labels = [f"{lo + 1}-{hi}" for lo, hi in zip((0,) + LENGTH_BUCKETS, LENGTH_BUCKETS)]
+    bucket_labels.append(f"{LENGTH_BUCKETS[-1] + 1}+")
+
+    # Paragraph structure.
+    paragraph_sentences = np.bincount(paragraph_ids, minlength=paragraph_offset)
+    paragraph_words = np.bincount(paragraph_ids, weights=lengths, minlength=paragraph_offset).astype(np.int64)
+    paragraph_count = np.bincount(paragraph_doc, minlength=n)
+
+    # Vocabulary: distinct (text, word) pairs give per-text type counts and frequencies.
+    word_count = np.bincount(word_doc, minlength=n)
+    vocab_size = max(len(vocabulary), 1)
+    pair_keys, pair_counts = np.unique(word_doc * vocab_size + word_ids, return_counts=True)
+    pair_doc, pair_word = pair_keys // vocab_size, pair_keys % vocab_size
+    type_count = np.bincount(pair_doc, minlength=n)
+    is_stopword = np.array([w in STOPWORDS for w in vocabulary], dtype=bool)
+    is_misspelled = np.array([w in MISSPELLINGS for w in vocabulary], dtype=bool)
+    repeated = (pair_counts >= REPEATED_WORD_MIN_COUNT) & ~is_stopword[pair_word]
+    misspelled = is_misspelled[pair_word]
+    # The same word twice in a row ("the the") within one text.
+    doubled = np.flatnonzero((word_ids[1:] == word_ids[:-1]) & (word_doc[1:] == word_doc[:-1]))
+    # Pairs and doubled words are ordered by text, so each text owns one contiguous slice.
+    doc_edges = np.arange(n + 1)
+    pair_bounds = np.searchsorted(pair_doc, doc_edges)
+    doubled_bounds = np.searchsorted(word_doc[doubled], doc_edges)
+
+    results = []
+    paragraph_start = 0
+    for doc in range(n):
+        lo, hi = pair_bounds[doc], pair_bounds[doc + 1]
+        doc_repeated = lo + np.flatnonzero(repeated[lo:hi])
+        doc_repeated = doc_repeated[np.argsort(-pair_counts[doc_repeated], kind="stable")][:REPEATED_WORDS_SHOWN]
+        doc_misspelled = lo + np.flatnonzero(misspelled[lo:hi])
+        doc_doubled = sorted(set(words_by_id[word_ids[doubled[doubled_bounds[doc]:doubled_bounds[doc + 1]]]]))
+        p_end = paragraph_start + int(paragraph_count[doc])
+        has_sentences = sentence_count[doc] > 0
+        results.append({
+            "Sentences": {
+                "count": int(sentence_count[doc]),
+                "mean_words": round(float(mean[doc]), 2),
+                "variance": round(float(variance[doc]), 2),
+                "std": round(float(np.sqrt(variance[doc])), 2),
+                "min_words": int(length_min[doc]) if has_sentences else 0,
+                "max_words": int(length_max[doc]),
+                "long_sentences": int(long_count[doc]),
+                "short_sentences": int(short_count[doc]),
+                "length_histogram": dict(zip(bucket_labels, histogram[doc].tolist())),
+            },
+            "Vocabulary": {
+                "words": int(word_count[doc]),
+                "unique_words": int(type_count[doc]),
+                "type_token_ratio": round(float(type_count[doc]) / max(int(word_count[doc]), 1), 3),
+                "repeated_words": [
+                    {"word": words_by_id[pair_word[i]], "count": int(pair_counts[i])} for i in doc_repeated
+                ],
+                "doubled_words": doc_doubled,
+            },
+            "Spelling": {
+                "candidates": [
+                    {"word": words_by_id[pair_word[i]], "suggestion": MISSPELLINGS[words_by_id[pair_word[i]]],
+                     "count": int(pair_counts[i])}
+                    for i in doc_misspelled
+                ],
+            },
+            "Paragraphs": {
+                "count": int(paragraph_count[doc]),
+                "sentences_per_paragraph": paragraph_sentences[paragraph_start:p_end].tolist(),
+                "words_per_paragraph": paragraph_words[paragraph_start:p_end].tolist(),
+            },
+        })
+        paragraph_start = p_end
+    return results
+
+def analyze_text(text: str) -> dict:
+    return analyze_texts([text])[0]
+
+# -------------------------------
+# Hints for the Rubric Agents
+# -------------------------------
+def format_hints(stats: dict, dimension: str) -> str:
+    """
+    Render the statistics relevant to one rubric dimension as a few short lines for its
+    prompt. Lines with nothing to report are left out; "" when none remain.
+    """
+    sentences, vocabulary = stats["Sentences"], stats["Vocabulary"]
+    paragraphs = stats["Paragraphs"]
+    lines = []
+    if dimension == "sentence_fluency":
+        if sentences["count"]:
+            lines.append(f"Sentences: {sentences['count']}, {sentences['mean_words']} words on average "
+                         f"(std {sentences['std']}, range {sentences['min_words']}-{sentences['max_words']})")
+        if sentences["long_sentences"]:
+            lines.append(f"Over {LONG_SENTENCE_WORDS} words: {sentences['long_sentences']}")
+        if sentences["short_sentences"]:
+            lines.append(f"{SHORT_SENTENCE_WORDS} words or fewer: {sentences['short_sentences']}")
+        if paragraphs["count"] > 1:
+            lines.append("Sentences per paragraph: " + ", ".join(map(str, paragraphs["sentences_per_paragraph"])))
+    elif dimension == "diction":
+        if vocabulary["words"]:
+            lines.append(f"Words: {vocabulary['words']}, distinct: {vocabulary['unique_words']} "
+                         f"(type-token ratio {vocabulary['type_token_ratio']})")
+        if vocabulary["repeated_words"]:
+            lines.append("Most repeated content words: "
+                         + ", ".join(f"{r['word']} x{r['count']}" for r in vocabulary["repeated_words"]))
+    elif dimension == "conventions":
+        if stats["Spelling"]["candidates"]:
+            lines.append("Likely misspellings: "
+                         + ", ".join(f"{c['word']} -> {c['suggestion']}" for c in stats["Spelling"]["candidates"]))
+        if vocabulary["doubled_words"]:
+            lines.append("Doubled words: " + ", ".join(vocabulary["doubled_words"]))
+        if sentences["long_sentences"]:
+            lines.append(f"Sentences over {LONG_SENTENCE_WORDS} words (possible run-ons): {sentences['long_sentences']}")
+    return "\n".join("- " + line for line in lines)
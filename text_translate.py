@@ -1,14 +1,232 @@
+import os
 import subprocess
-from llm_call import llm_call
+import time
+from concurrent.futures import ThreadPoolExecutor
+from llm_call import llm_call, llm_call_stream, LLMError
+from instrumentation import submit
+from translation_memory import TranslationMemory, get_translation_memory
+from segmentation import split_into_chunks
 
-def translate_english_to_spanish(english_text: str):
-    # Build the command as a string exactly as you use in the terminal
-    command = f"Translate the following text to Spanish without any initial or trailing text: {english_text}"
-    return llm_call(command)
+# Texts longer than this are translated in chunks of at most this many characters.
+CHUNK_MAX_CHARS = int(os.environ.get("TRANSLATION_CHUNK_MAX_CHARS", "1500"))
+# Upper bound on chunks sent to Ollama at the same time.
+TRANSLATION_CONCURRENCY = int(os.environ.get("TRANSLATION_CONCURRENCY", "4"))
 
-def translate_spanish_to_english(spanish_text: str) -> str:
-    command = f"Translate the following text to English without any initial or trailing text: {spanish_text}"
-    return llm_call(command)
+# Translation memory direction keyed by target language.
+MEMORY_DIRECTIONS = {"Spanish": "en-es", "English": "es-en"}
+
+def _translation_prompt(text: str, target_language: str, references=()) -> str:
+    prompt = f"Translate the following text to {target_language} without any initial or trailing text: {text}"
+    if references:
+        # Near matches from the translation memory, for consistent wording only.
+        prompt = (
+            "Earlier translations of similar sentences, for consistent wording. The text may differ "
+            "from them, so translate what it actually says:\n"
+            + "\n".join(f"{source} => {target}" for source, target in references) + "\n\n" + prompt
+        )
+    return prompt
+
+# -------------------------------
+# Chunked Translation for Long Texts
+# -------------------------------
+def split_into_segments(text: str) -> list:
+    """Split text into paragraphs of single sentences, the unit stored in the translation memory."""
+    # With a zero budget every sentence ends up in a chunk of its own.
+    return split_into_chunks(text, max_chars=0)
+
+def _reassemble(paragraphs: list, results: list) -> str:
+    output = []
+    position = 0
+    for paragraph in paragraphs:
+        output.append(" ".join(results[position:position + len(paragraph)]))
+        position += len(paragraph)
+    return "\n\n".join(output)
+
+def _translate_segments(segments: list, target_language: str, max_workers: int = None, max_retries: int = 2,
+                        references: list = None) -> list:
+    """
+    Translate every segment concurrently and return the translations in input order.
+    Segments that fail are retried on their own, up to `max_retries` times. `references`
+    optionally gives each segment a list of (source, target) pairs to show the model.
+    """
+    references = references or [()] * len(segments)
+    results = [None] * len(segments)
+    pending = list(range(len(segments)))
+    if not pending:
+        return results
+    workers = max(1, min(max_workers or TRANSLATION_CONCURRENCY, len(segments)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for _ in range(max_retries + 1):
+            futures = {i: submit(executor, llm_call, _translation_prompt(segments[i], target_language, references[i]),
+                                 task="translation")
+                       for i in pending}
+            failed = []
+            for i, future in futures.items():
+                try:
+                    results[i] = future.result()
+                except LLMError as e:
+                    failed.append(i)
+                    last_error = e
+            pending = failed
+            if not pending:
+                break
+    if pending:
+        raise LLMError(f"{len(pending)} of {len(segments)} translation chunks failed after "
+                       f"{max_retries + 1} attempts: {last_error}") from last_error
+    return results
+
+def translate_chunked(text: str, target_language: str, max_chars: int = CHUNK_MAX_CHARS,
+                      max_workers: int = None, max_retries: int = 2) -> str:
+    """
+    Translate every chunk concurrently and reassemble them in the original order, keeping
+    paragraph breaks. Chunks that fail are retried on their own, up to `max_retries` times.
+    """
+    paragraphs = split_into_chunks(text, max_chars)
+    chunks = [chunk for paragraph in paragraphs for chunk in paragraph]
+    return _reassemble(paragraphs, _translate_segments(chunks, target_language, max_workers, max_retries))
+
+def _translate_runs(runs: list, target_language: str, references: list, max_chars: int = CHUNK_MAX_CHARS) -> list:
+    """
+    Translate runs of sentences from within one paragraph each, chunked as in
+    translate_chunked and in one concurrent batch. Returns one translation per run.
+    """
+    split = [[chunk for paragraph in split_into_chunks(run, max_chars) for chunk in paragraph] for run in runs]
+    chunks = [chunk for run_chunks in split for chunk in run_chunks]
+    chunk_references = [refs for run_chunks, refs in zip(split, references) for _ in run_chunks]
+    translated = _translate_segments(chunks, target_language, references=chunk_references)
+    results, position = [], 0
+    for run_chunks in split:
+        results.append(" ".join(translated[position:position + len(run_chunks)]))
+        position += len(run_chunks)
+    return results
+
+# -------------------------------
+# Translation Memory Reuse
+# -------------------------------
+def _store(memory: TranslationMemory, direction: str, sentences: list, translation: str):
+    # Only a sentence translated on its own is known to pair with its translation. A run's
+    # translation is stored whole: splitting it on sentence ends can misalign the pairs
+    # even when the counts agree (the model may merge two sentences and split another).
+    memory.add(direction, " ".join(sentences), translation)
+
+def _memory_translate(paragraphs: list, target_language: str, memory: TranslationMemory, stats: dict) -> list:
+    """
+    Serve every sentence (or whole paragraph) stored in the translation memory exactly,
+    and translate the runs of remaining sentences in each paragraph together, so the model
+    keeps their context. A run is stored whole, one sentence on its own as a sentence.
+    Near matches are passed along as references, never reused as is.
+    Updates the coverage counters in `stats` and returns one translation per paragraph.
+    """
+    direction = MEMORY_DIRECTIONS[target_language]
+    # Per paragraph, a list of parts: a stored translation (str) or a run of sentences (list).
+    layouts, runs = [], []
+    for sentences in paragraphs:
+        whole = memory.lookup(direction, " ".join(sentences)) if len(sentences) > 1 else None
+        if whole is not None:
+            layouts.append([whole])
+            stats["exact"] += len(sentences)
+            stats["covered_chars"] += sum(len(sentence) for sentence in sentences)
+            continue
+        parts = []
+        for sentence in sentences:
+            target = memory.lookup(direction, sentence)
+            if target is None:
+                if not parts or isinstance(parts[-1], str):
+                    parts.append([])
+                    runs.append(parts[-1])
+                parts[-1].append(sentence)
+                continue
+            parts.append(target)
+            stats["exact"] += 1
+            stats["covered_chars"] += len(sentence)
+        layouts.append(parts)
+
+    references = []
+    for run in runs:
+        found = [match for match in (memory.similar(direction, sentence) for sentence in run) if match]
+        stats["fuzzy"] += len(found)
+        references.append(found)
+    translations = _translate_runs([" ".join(run) for run in runs], target_language, references)
+    translated = {}
+    for run, translation in zip(runs, translations):
+        translated[id(run)] = translation
+        _store(memory, direction, run, translation)
+
+    segments = sum(len(sentences) for sentences in paragraphs)
+    stats["segments"] += segments
+    stats["translated"] += sum(len(run) for run in runs)
+    stats["requests"] += len(runs)
+    stats["total_chars"] += sum(len(sentence) for sentences in paragraphs for sentence in sentences)
+    stats["coverage"] = round(stats["exact"] / stats["segments"], 4) if stats["segments"] else 0.0
+    stats["char_coverage"] = round(stats["covered_chars"] / stats["total_chars"], 4) if stats["total_chars"] else 0.0
+    results = [" ".join(translated[id(part)] if isinstance(part, list) else part for part in parts) for parts in layouts]
+    for sentences, parts, result in zip(paragraphs, layouts, results):
+        # A paragraph mixing remembered sentences and new runs is stored whole as well, so
+        # it is served in one lookup next time (a paragraph that was one run already is).
+        if len(parts) > 1 and any(isinstance(part, list) for part in parts):
+            memory.add(direction, " ".join(sentences), result)
+    return results
+
+def _new_memory_stats(stats: dict = None) -> dict:
+    stats = {} if stats is None else stats
+    for key in ("segments", "exact", "fuzzy", "translated", "requests", "covered_chars", "total_chars"):
+        stats.setdefault(key, 0)
+    return stats
+
+def translate_with_memory(text: str, target_language: str, memory: TranslationMemory = None, stats: dict = None) -> str:
+    """
+    Translate text, reusing the stored translation of every sentence seen before and
+    sending the rest to the LLM a paragraph at a time. If `stats` is given it receives
+    sentence counts (`exact` reused, `translated` sent to the LLM, `fuzzy` of those sent with
+    a near match as reference), `requests`, `coverage` (fraction of sentences reused) and
+    `char_coverage` (fraction of characters).
+    """
+    memory = memory or get_translation_memory()
+    paragraphs = split_into_segments(text)
+    return "\n\n".join(_memory_translate(paragraphs, target_language, memory, _new_memory_stats(stats)))
+
+def _translate(text: str, target_language: str, chunked: bool = None, use_memory: bool = None, stats: dict = None) -> str:
+    # The memory translates its misses in paragraph-sized chunks; asking for one unchunked
+    # call (chunked=False) therefore bypasses it.
+    if use_memory is None:
+        use_memory = get_translation_memory().enabled and chunked is not False
+    if use_memory:
+        return translate_with_memory(text, target_language, stats=stats)
+    # By default only texts too long for one comfortable prompt are chunked.
+    if chunked is None:
+        chunked = len(text) > CHUNK_MAX_CHARS
+    if chunked:
+        return translate_chunked(text, target_language)
+    return llm_call(_translation_prompt(text, target_language), task="translation")
+
+def translate_english_to_spanish(english_text: str, chunked: bool = None, use_memory: bool = None, stats: dict = None):
+    return _translate(english_text, "Spanish", chunked, use_memory, stats)
+
+def translate_spanish_to_english(spanish_text: str, chunked: bool = None, use_memory: bool = None, stats: dict = None) -> str:
+    return _translate(spanish_text, "English", chunked, use_memory, stats)
+
+# Streaming variants yield the translation token by token for progressive rendering.
+# With the translation memory enabled they yield one paragraph at a time instead, so
+# remembered paragraphs appear immediately and only new sentences wait on the LLM.
+def _translate_stream(text: str, target_language: str, stats: dict = None):
+    memory = get_translation_memory()
+    if not memory.enabled:
+        yield from llm_call_stream(_translation_prompt(text, target_language), stats=stats, task="translation")
+        return
+    start = time.perf_counter()
+    stats = _new_memory_stats(stats)
+    for index, paragraph in enumerate(split_into_segments(text)):
+        translated = _memory_translate([paragraph], target_language, memory, stats)[0]
+        if "ttft" not in stats:
+            stats["ttft"] = time.perf_counter() - start
+        yield ("\n\n" if index else "") + translated
+    stats["total_time"] = time.perf_counter() - start
+
+def translate_english_to_spanish_stream(english_text: str, stats: dict = None):
+    return _translate_stream(english_text, "Spanish", stats)
+
+def translate_spanish_to_english_stream(spanish_text: str, stats: dict = None):
+    return _translate_stream(spanish_text, "English", stats)
 
 if __name__ == "__main__":
     english_text = "Hi! My name is Dhruv."
@@ -0,0 +1,195 @@
+import difflib
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+# -------------------------------
+# Configuration
+# -------------------------------
+DEFAULT_MEMORY_PATH = os.environ.get("TRANSLATION_MEMORY_PATH", os.path.join("cache_storage", "translation_memory.sqlite"))
+# Similarity (0-1) a stored segment needs to be offered to the LLM as a reference translation.
+# Near matches are never reused directly: "on Sunday" and "on Monday" score above 0.95.
+DEFAULT_FUZZY_THRESHOLD = float(os.environ.get("TRANSLATION_MEMORY_FUZZY_THRESHOLD", "0.95"))
+# Set TRANSLATION_MEMORY_DISABLED=1 to send every segment to the LLM.
+MEMORY_DISABLED = os.environ.get("TRANSLATION_MEMORY_DISABLED", "").lower() in ("1", "true", "yes")
+
+# Very short segments ("Yes.", "The end.") are only ever matched exactly.
+FUZZY_MIN_CHARS = 20
+# Number of index candidates re-scored with difflib for each fuzzy lookup.
+FUZZY_CANDIDATES = 5
+
+_WHITESPACE = re.compile(r"\s+")
+
+def normalize_segment(text: str) -> str:
+    return _WHITESPACE.sub(" ", text).strip()
+
+def _trigrams(text: str) -> set:
+    text = " " + text.lower() + " "
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+# -------------------------------
+# Fuzzy Index
+# -------------------------------
+class _TrigramIndex:
+    """In-memory inverted index from character trigrams to stored source segments."""
+
+    def __init__(self):
+        self.postings = {}
+        self.sources = {}
+
+    def add(self, source: str):
+        if source in self.sources or len(source) < FUZZY_MIN_CHARS:
+            return
+        grams = _trigrams(source)
+        self.sources[source] = len(grams)
+        for gram in grams:
+            self.postings.setdefault(gram, set()).add(source)
+
+    def best_match(self, query: str, threshold: float):
+        if len(query) < FUZZY_MIN_CHARS:
+            return None, 0.0
+        grams = _trigrams(query)
+        overlap = Counter()
+        for gram in grams:
+            overlap.update(self.postings.get(gram, ()))
+        best, best_ratio = None, 0.0
+        for source, shared in overlap.most_common(FUZZY_CANDIDATES):
+            # Cheap Dice bound first: a candidate sharing few trigrams cannot be near-exact.
+            if 2 * shared / (len(grams) + self.sources[source]) < threshold - 0.1:
+                continue
+            ratio = difflib.SequenceMatcher(None, query, source).ratio()
+            if ratio > best_ratio:
+                best, best_ratio = source, ratio
+        if best_ratio >= threshold:
+            return best, best_ratio
+        return None, best_ratio
+
+# -------------------------------
+# Translation Memory
+# -------------------------------
+class TranslationMemory:
+    """
+    Local store of source/target segment pairs, kept separately per direction (e.g. "en-es").
+    Exact matches are looked up by hash in SQLite. Near-exact matches, which only serve as
+    references for a new translation, come from an in-memory trigram index that is built
+    lazily per direction and re-scored with difflib.
+    """
+
+    def __init__(self, path: str = DEFAULT_MEMORY_PATH, fuzzy_threshold: float = DEFAULT_FUZZY_THRESHOLD,
+                 enabled: bool = not MEMORY_DISABLED):
+        self.path = path
+        self.fuzzy_threshold = fuzzy_threshold
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._conn = None
+        self._indexes = {}
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS segments ("
+                " direction TEXT NOT NULL,"
+                " source_hash TEXT NOT NULL,"
+                " source TEXT NOT NULL,"
+                " target TEXT NOT NULL,"
+                " uses INTEGER NOT NULL DEFAULT 0,"
+                " updated REAL NOT NULL,"
+                " PRIMARY KEY (direction, source_hash))"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _hash(source: str) -> str:
+        return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+    def _index(self, direction: str) -> _TrigramIndex:
+        index = self._indexes.get(direction)
+        if index is None:
+            index = _TrigramIndex()
+            for (source,) in self._connect().execute("SELECT source FROM segments WHERE direction = ?", (direction,)):
+                index.add(source)
+            self._indexes[direction] = index
+        return index
+
+    def lookup(self, direction: str, segment: str):
+        """
+        Return the stored translation of exactly this segment (up to whitespace), or None.
+        """
+        source = normalize_segment(segment)
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT target FROM segments WHERE direction = ? AND source_hash = ?",
+                               (direction, self._hash(source))).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE segments SET uses = uses + 1 WHERE direction = ? AND source_hash = ?",
+                         (direction, self._hash(source)))
+            conn.commit()
+            return row[0]
+
+    def similar(self, direction: str, segment: str):
+        """
+        Return the (source, target) pair of the most similar stored segment above the fuzzy
+        threshold, or None. Its translation must not be reused as is: it is a reference.
+        """
+        source = normalize_segment(segment)
+        with self._lock:
+            match, _ = self._index(direction).best_match(source, self.fuzzy_threshold)
+            if match is None or match == source:
+                return None
+            row = self._connect().execute("SELECT target FROM segments WHERE direction = ? AND source_hash = ?",
+                                          (direction, self._hash(match))).fetchone()
+            return (match, row[0]) if row else None
+
+    def add(self, direction: str, segment: str, target: str):
+        source = normalize_segment(segment)
+        target = target.strip()
+        if not source or not target:
+            return
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO segments (direction, source_hash, source, target, uses, updated)"
+                " VALUES (?, ?, ?, ?, 0, ?)",
+                (direction, self._hash(source), source, target, time.time()),
+            )
+            conn.commit()
+            if direction in self._indexes:
+                self._indexes[direction].add(source)
+
+    def clear(self):
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM segments")
+            conn.commit()
+            self._indexes.clear()
+
+    def size(self, direction: str = None) -> int:
+        with self._lock:
+            conn = self._connect()
+            if direction is None:
+                return conn.execute("SELECT COUNT(*) FROM segments").fetchone()[0]
+            return conn.execute("SELECT COUNT(*) FROM segments WHERE direction = ?", (direction,)).fetchone()[0]
+
+_memory = None
+_memory_lock = threading.Lock()
+
+def get_translation_memory() -> TranslationMemory:
+    """Return the process-wide translation memory, creating it on first use."""
+    global _memory
+    if _memory is None:
+        with _memory_lock:
+            if _memory is None:
+                _memory = TranslationMemory()
+    return _memory
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import warnings
+
+# -------------------------------
+# Configuration
+# -------------------------------
+DEFAULT_CHECKPOINT_PATH = os.environ.get("WORKFLOW_CHECKPOINT_PATH", os.path.join("context_storage", "checkpoints.sqlite"))
+# Threads untouched for longer than this, or beyond the newest MAX_THREADS, are pruned.
+MAX_THREAD_AGE = float(os.environ.get("WORKFLOW_CHECKPOINT_MAX_AGE_SECONDS", str(7 * 24 * 3600)))
+MAX_THREADS = int(os.environ.get("WORKFLOW_CHECKPOINT_MAX_THREADS", "500"))
+
+# -------------------------------
+# Checkpointer
+# -------------------------------
+def make_checkpointer(path: str = DEFAULT_CHECKPOINT_PATH):
+    """
+    Return a SQLite-backed LangGraph checkpointer so completed nodes survive crashes and
+    Streamlit reruns. Falls back to the in-process MemorySaver when the
+    langgraph-checkpoint-sqlite package is not installed.
+    """
+    try:
+        from langgraph.checkpoint.sqlite import SqliteSaver
+    except ImportError:
+        from langgraph.checkpoint.memory import MemorySaver
+        # A warning, not a print: the CLI writes its JSON result to stdout.
+        warnings.warn("langgraph-checkpoint-sqlite is not installed; workflow checkpoints will not survive a restart.",
+                      RuntimeWarning, stacklevel=2)
+        return MemorySaver()
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    saver = SqliteSaver(conn)
+    saver.setup()
+    return saver
+
+def submission_thread_id(*parts) -> str:
+    """Derive a stable thread id from the submission content, so a rerun finds its own checkpoints."""
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+# -------------------------------
+# Thread Registry and Pruning
+# -------------------------------
+class ThreadRegistry:
+    """
+    Records when each workflow thread was last used, and deletes the checkpoints of
+    threads that are too old or beyond the most recent `max_threads`.
+    """
+
+    def __init__(self, checkpointer, path: str = DEFAULT_CHECKPOINT_PATH,
+                 max_age: float = MAX_THREAD_AGE, max_threads: int = MAX_THREADS):
+        self.checkpointer = checkpointer
+        self.path = path
+        self.max_age = max_age
+        self.max_threads = max_threads
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS workflow_threads ("
+                " thread_id TEXT PRIMARY KEY,"
+                " created REAL NOT NULL,"
+                " last_used REAL NOT NULL)"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def touch(self, thread_id: str):
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT INTO workflow_threads (thread_id, created, last_used) VALUES (?, ?, ?)"
+                " ON CONFLICT(thread_id) DO UPDATE SET last_used = excluded.last_used",
+                (thread_id, now, now),
+            )
+            conn.commit()
+
+    def prune(self) -> int:
+        """Delete expired and surplus threads. Returns how many were removed."""
+        with self._lock:
+            conn = self._connect()
+            expired = [row[0] for row in conn.execute(
+                "SELECT thread_id FROM workflow_threads WHERE last_used < ?", (time.time() - self.max_age,))]
+            surplus = [row[0] for row in conn.execute(
+                "SELECT thread_id FROM workflow_threads ORDER BY last_used DESC LIMIT -1 OFFSET ?", (self.max_threads,))]
+            doomed = set(expired) | set(surplus)
+            for thread_id in doomed:
+                self.checkpointer.delete_thread(thread_id)
+            conn.executemany("DELETE FROM workflow_threads WHERE thread_id = ?", [(t,) for t in doomed])
+            conn.commit()
+        return len(doomed)